@@ -22,6 +22,7 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+import numpy as np
 import vgamepad as vg
 from pyLegoMario import *
 from typing import Union, Callable
@@ -41,11 +42,11 @@ def acc_to_float(number: int) -> float:
 class MarioController(Mario):
     def __init__(self) -> None:
 
-        super().__init__(True, default_volume=0)
+        # buffer keeps the current and the 5 previous accelerations
+        super().__init__(True, default_volume=0, acceleration_buffer_size=6)
         self.add_accelerometer_hooks(_accHandling)
         self.add_tile_hooks(_rgbHandling)
         self.gamepad = vg.VX360Gamepad()
-        self.y_cache=[] #  cache of length 5 to store recent y accelerations
 
 def _rgbHandling(sender: MarioController, t: str) -> None:
     """
@@ -59,15 +60,20 @@ def _rgbHandling(sender: MarioController, t: str) -> None:
     sender.gamepad.update()
 
 def _accHandling(sender: MarioController, x: int, y: int, z: int) -> None:
+    # absolute y accelerations of the 5 samples before this one
+    _, recent = sender.acceleration_buffer.last(6)
+    recent_y = np.abs(recent[:-1, 1])
+    recent_very_large = np.any(recent_y > 120)
+    recent_large = np.any((recent_y > LARGE) & (recent_y <= 120))
     # jumping and movement handling
-    if y > LARGE and not "large" in sender.y_cache:
+    if y > LARGE and not recent_large:
         sender.gamepad.press_button(button=vg.XUSB_BUTTON.XUSB_GAMEPAD_A)
     # keep a down for big jump
-    elif "very large" in sender.y_cache:
+    elif recent_very_large:
         sender.gamepad.press_button(button=vg.XUSB_BUTTON.XUSB_GAMEPAD_A)
     # z (ground pound/longjump)
     elif y < -60:
-        if not "large" in sender.y_cache:
+        if not recent_large:
             sender.gamepad.left_trigger_float(1)
     else:
         # only adjust joystick if not jumping to avoid shaky inputs
@@ -85,15 +91,6 @@ def _accHandling(sender: MarioController, x: int, y: int, z: int) -> None:
     # input moves into sender.gamepad
     sender.gamepad.update()
 
-    # write cache
-    if abs(y) > 120:
-        sender.y_cache.insert(0, "very large")
-    elif abs(y) > LARGE:
-        sender.y_cache.insert(0, "large")
-    else:
-        sender.y_cache.insert(0, "small")
-    sender.y_cache = sender.y_cache[:5]
-
 
 if __name__ == "__main__":
     # Initialize Marios
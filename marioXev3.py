@@ -2,6 +2,7 @@ from random import randint
 import ev3_dc as ev3
 from thread_task import Sleep
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from pyLegoMario import Mario, run
 import itertools
 
@@ -56,10 +57,13 @@ with (ev3.EV3(**EV3_SETTINGS) as brick,
         # Initialize Marios
         mario = Mario(do_log = True, 
             accelerometer_hooks = my_accelerometer_hook, default_volume=0,
-            tile_event_hooks = my_tile_hook, pants_event_hooks=None)
+            pants_event_hooks=None)
         
         # Add Hook Functions
         mario.add_pants_hooks(my_pants_hook)
+        # moving the car blocks until the EV3 answers, so run it in a thread
+        mario.add_tile_hooks(my_tile_hook,
+                             executor=ThreadPoolExecutor(max_workers=1))
         loop = asyncio.get_event_loop()
         # loop.create_task(SOME COROUTINE)
 
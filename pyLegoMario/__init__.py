@@ -1,4 +1,17 @@
 from .mario import Mario, run
+from .mario_runtime import serve
+from .mario_thread import MarioThread, ThreadedMario
+from .mario_fleet import MarioFleet
+from .mario_events import (LogRecord, DEBUG, INFO, WARNING, ERROR, MarioEvent,
+    TileEvent, ColorEvent, AccelEvent, PantsEvent, HubEvent, EventStream)
+from .mario_recording import NotificationRecorder, NotificationReplayer
+from .mario_transport import BleakTransport, DeviceFilter, scan
+from .mario_devices import KnownDevices, KnownDevice
+from .mario_polling import PortPoller
+from .mario_tuning import DeltaIntervalTuner
+from .mario_simulator import (SimulatedHub, SimulatedClient, SimulatedTransport,
+    SimulatedScanner)
 from .mario_GUI import MarioWindow
-from .pygame_mario import PygameMario, AsyncClock, ACC_EVENT, RGB_EVENT, PANTS_EVENT
+from .pygame_mario import (PygameMario, AsyncClock, InputRouter,
+    MarioInput, ACC_EVENT, RGB_EVENT, PANTS_EVENT)
 from .lego_mario_data import *
\ No newline at end of file
@@ -0,0 +1,307 @@
+"""
+bench.py
+This file implements pyLegoMario's benchmarks. Run them with
+    python -m pyLegoMario.bench [--quick] [--only NAME ...] [--output FILE]
+Results are printed (or written to FILE) as JSON, so runs of different
+versions can be compared. Every benchmark reports operations per second and
+percentiles of the time per operation in microseconds.
+
+Benchmarks:
+    decode.<message>: Mario._handle_events per message type, without any
+        log sink.
+    decode.accelerometer_logged: the same with a log record hook at DEBUG.
+    decode.accelerometer_no_stats: the same with collect_stats=False.
+    dispatch.<n>_hooks: accelerometer notification to n hooks.
+    pygame.acc_post, pygame.rgb_post: PygameMario notification to posted
+        pygame event.
+    pygame.acc_collect: accelerometer notification with acc_mode="mean",
+        collected for the event of the frame.
+    gui.input_log_data: MarioWindow._input_log_data (needs a display).
+    import.<module>: import time in a fresh interpreter, bleak for
+        comparison.
+No bluetooth is needed, Mario is never connected.
+Copyright (c) 2022 Jamin Kauf
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import types
+from typing import Any, Callable, Iterator, Union
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "hide"
+
+try:
+    from .mario import Mario
+    from .mario_events import DEBUG
+    from .mario_simulator import SimulatedTransport
+except ImportError:
+    from mario import Mario
+    from mario_events import DEBUG
+    from mario_simulator import SimulatedTransport
+
+# one notification of every type Mario decodes
+MESSAGES = {
+    "accelerometer": bytearray([0x07, 0x00, 0x45, 0x00, 0x05, 0xf6, 0x2a]),
+    "gesture": bytearray([0x08, 0x00, 0x45, 0x00, 0x00, 0x01, 0x00, 0x01]),
+    "tile": bytearray([0x08, 0x00, 0x45, 0x01, 0x02, 0x00, 0xff, 0xff]),
+    "color": bytearray([0x08, 0x00, 0x45, 0x01, 0xff, 0xff, 0x15, 0x00]),
+    "camera_idle": bytearray([0x08, 0x00, 0x45, 0x01, 0xff, 0xff, 0xff, 0xff]),
+    "pants": bytearray([0x05, 0x00, 0x45, 0x02, 0x21]),
+    "port_3": bytearray([0x07, 0x00, 0x45, 0x03, 0x13, 0x01, 0x02]),
+    "hub_action": bytearray([0x04, 0x00, 0x02, 0x30]),
+    "hub_property": bytearray([0x06, 0x00, 0x01, 0x06, 0x06, 0x64]),
+    "port_format": bytearray([0x0a, 0x00, 0x47, 0x00, 0x00, 0x01, 0x00,
+                              0x00, 0x00, 0x01]),
+    "attached_io": bytearray([0x0f, 0x00, 0x04, 0x00, 0x01, 0x47, 0x00, 0x00,
+                              0x00, 0x00, 0x10, 0x00, 0x00, 0x00, 0x10]),
+    "unknown": bytearray([0x05, 0x00, 0x03, 0x00, 0x00]),
+}
+
+
+def _percentile(sorted_values: list[float], fraction: float) -> float:
+    index = min(int(fraction * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def measure(func: Callable[[], Any], samples: int, batch: int,
+            between: Union[Callable[[], Any], None] = None
+            ) -> dict[str, float]:
+    """Times func.
+
+    func is called batch times per sample, the time per operation of a sample
+    is the duration of the sample divided by batch.
+
+    Args:
+        func (() -> Any): The operation.
+        samples (int): Number of samples.
+        batch (int): Calls of func per sample.
+        between (() -> Any, optional): Called (untimed) after every sample,
+            e.g. to clear queues. Defaults to None.
+
+    Returns:
+        dict[str, float]: ops_per_sec, p50_us, p90_us, p99_us, max_us and the
+            number of operations (ops).
+    """
+    per_op = []
+    total = 0
+    calls = range(batch)
+    for _ in range(samples):
+        start = time.perf_counter_ns()
+        for _ in calls:
+            func()
+        duration = time.perf_counter_ns() - start
+        total += duration
+        per_op.append(duration / batch / 1000)
+        if between is not None:
+            between()
+    per_op.sort()
+    return {"ops_per_sec": round(samples * batch / (total / 1e9), 1),
+            "p50_us": round(_percentile(per_op, 0.5), 3),
+            "p90_us": round(_percentile(per_op, 0.9), 3),
+            "p99_us": round(_percentile(per_op, 0.99), 3),
+            "max_us": round(per_op[-1], 3),
+            "ops": samples * batch}
+
+
+def _new_mario(cls: type = Mario, **kwargs: Any) -> Mario:
+    # Mario schedules its connection for when the loop runs, which it doesn't
+    kwargs.setdefault("do_log", False)
+    return cls(transport=SimulatedTransport(), **kwargs)
+
+
+def bench_decode(samples: int, batch: int) -> Iterator[tuple[str, dict]]:
+    mario = _new_mario()
+    for name, message in MESSAGES.items():
+        yield f"decode.{name}", measure(
+            lambda: mario._handle_events(0, message), samples, batch)
+    logged = _new_mario()
+    logged.add_log_record_hooks(lambda sender, record: record.msg, level=DEBUG)
+    message = MESSAGES["accelerometer"]
+    yield "decode.accelerometer_logged", measure(
+        lambda: logged._handle_events(0, message), samples, batch)
+    no_stats = _new_mario(collect_stats=False)
+    yield "decode.accelerometer_no_stats", measure(
+        lambda: no_stats._handle_events(0, message), samples, batch)
+
+
+def bench_dispatch(samples: int, batch: int) -> Iterator[tuple[str, dict]]:
+    message = MESSAGES["accelerometer"]
+    for count in (1, 10, 100):
+        mario = _new_mario()
+        mario.add_accelerometer_hooks(
+            [lambda sender, x, y, z: None for _ in range(count)])
+        # single calls, so percentiles show the latency of one notification
+        yield f"dispatch.{count}_hooks", measure(
+            lambda: mario._handle_events(0, message),
+            max(samples * batch // count, samples), 1)
+
+
+def bench_pygame(samples: int, batch: int) -> Iterator[tuple[str, dict]]:
+    import pygame
+    try:
+        from . import pygame_mario
+    except ImportError:
+        import pygame_mario
+    pygame.display.init()
+    try:
+        mario = _new_mario(pygame_mario.PygameMario)
+        # PygameMario adds these once connected
+        mario.add_accelerometer_hooks(pygame_mario._acceleration_callback)
+        mario.add_tile_hooks(pygame_mario._rgb_callback)
+        # pygame's event queue is limited, empty it after every sample
+        batch = min(batch, 100)
+        for name, message in (("acc_post", MESSAGES["accelerometer"]),
+                              ("rgb_post", MESSAGES["tile"])):
+            yield f"pygame.{name}", measure(
+                lambda: mario._handle_events(0, message), samples, batch,
+                between=pygame.event.clear)
+        coalescing = _new_mario(pygame_mario.PygameMario, acc_mode="mean")
+        coalescing.add_event_hooks(coalescing._collect_acceleration,
+                                   kinds=(pygame_mario.AccelEvent,))
+        message = MESSAGES["accelerometer"]
+        yield "pygame.acc_collect", measure(
+            lambda: coalescing._handle_events(0, message), samples, batch,
+            between=coalescing.post_acceleration)
+    finally:
+        pygame.display.quit()
+
+
+def bench_gui(samples: int, batch: int) -> Iterator[tuple[str, dict]]:
+    import tkinter as tk
+    try:
+        from .mario_GUI import MarioWindow
+    except ImportError:
+        from mario_GUI import MarioWindow
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        yield "gui.input_log_data", {"skipped": str(e)}
+        return
+    try:
+        mario = _new_mario()
+        # only the attributes _input_log_data uses, without loading images
+        window = types.SimpleNamespace(
+            mario=mario, logBox=tk.Text(root, width=70, height=10))
+        message = "Goomba Tile, Hex: 0800450102 00ffff"
+
+        def clear() -> None:
+            window.logBox.configure(state=tk.NORMAL)
+            window.logBox.delete("1.0", tk.END)
+
+        yield "gui.input_log_data", measure(
+            lambda: MarioWindow._input_log_data(window, mario, message),
+            samples, min(batch, 100), between=clear)
+    finally:
+        root.destroy()
+
+
+def bench_import(samples: int, batch: int) -> Iterator[tuple[str, dict]]:
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        filter(None, [package_dir, os.environ.get("PYTHONPATH")])))
+    runs = max(samples // 20, 3)
+    # importing any submodule runs the package's __init__ as well
+    for module in ("bleak", "pyLegoMario"):
+        code = ("import time; start = time.perf_counter_ns(); "
+                f"import {module}; print(time.perf_counter_ns() - start)")
+        durations = []
+        for _ in range(runs):
+            output = subprocess.run([sys.executable, "-c", code], env=env,
+                                    capture_output=True, text=True,
+                                    check=True).stdout
+            durations.append(int(output.split()[-1]) / 1000)
+        durations.sort()
+        yield f"import.{module}", {
+            "ops_per_sec": round(runs / (sum(durations) / 1e6), 3),
+            "p50_us": round(_percentile(durations, 0.5), 1),
+            "p90_us": round(_percentile(durations, 0.9), 1),
+            "p99_us": round(_percentile(durations, 0.99), 1),
+            "max_us": round(durations[-1], 1),
+            "ops": runs}
+
+
+BENCHMARKS = {
+    "decode": bench_decode,
+    "dispatch": bench_dispatch,
+    "pygame": bench_pygame,
+    "gui": bench_gui,
+    "import": bench_import,
+}
+
+
+def run_benchmarks(names: Union[list[str], None] = None,
+                   samples: int = 200, batch: int = 500) -> dict[str, Any]:
+    """Runs benchmarks.
+
+    Args:
+        names (list[str], optional): Groups to run (keys of BENCHMARKS).
+            Defaults to all of them.
+        samples (int, optional): Samples per benchmark. Defaults to 200.
+        batch (int, optional): Operations per sample. Defaults to 500.
+
+    Returns:
+        dict[str, Any]: Environment info and results by benchmark name.
+    """
+    try:
+        from importlib.metadata import version
+        package_version = version("pyLegoMario")
+    except Exception:
+        package_version = None
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    results: dict[str, Any] = {}
+    try:
+        for name in names or BENCHMARKS:
+            try:
+                for result_name, result in BENCHMARKS[name](samples, batch):
+                    results[result_name] = result
+            except ImportError as e:
+                results[name] = {"skipped": str(e)}
+    finally:
+        # start the connection attempts the Marios scheduled, then cancel them
+        loop.run_until_complete(asyncio.sleep(0))
+        tasks = asyncio.all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        loop.run_until_complete(
+            asyncio.gather(*tasks, return_exceptions=True))
+        loop.close()
+        asyncio.set_event_loop(None)
+    return {"package_version": package_version,
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "samples": samples,
+            "batch": batch,
+            "results": results}
+
+
+def main(argv: Union[list[str], None] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m pyLegoMario.bench",
+        description="Benchmarks pyLegoMario and prints the results as JSON.")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS),
+                        help="run only these groups")
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--quick", action="store_true",
+                        help="fewer samples, for smoke testing")
+    parser.add_argument("--output", help="write the JSON to this file")
+    args = parser.parse_args(argv)
+    samples, batch = (20, 50) if args.quick else (args.samples, args.batch)
+    report = json.dumps(run_benchmarks(args.only, samples, batch), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
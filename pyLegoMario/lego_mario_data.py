@@ -1,11 +1,13 @@
 import json
+import sys
 from pathlib import Path
 
 # hex to Lego RGB codes
 # code messages are always shape (hexadecimal): 08004501xx00ffff
 # (where xx is the tile code)
 with open(Path(__file__).parent / Path("ALL_RGB_CODES.json")) as f:
-    HEX_TO_RGB_TILE = {x[2]:x[1] for x in json.load(f)}
+    # names are interned, many tiles share the same name (e.g. "Unknown")
+    HEX_TO_RGB_TILE = {x[2]:sys.intern(x[1]) for x in json.load(f)}
 
 # hex to ground colors
 # color messages are always shape (hexadecimal): 08004501ffffxx00
@@ -64,16 +66,42 @@ HEX_TO_HUB_PROPERTIES = {
 # BLE Connection
 # https://github.com/bricklife/LEGO-Mario-Reveng
 LEGO_CHARACTERISTIC_UUID = "00001624-1212-efde-1623-785feabcd123"
+# lowercase beginnings of the advertised names of Mario, Luigi and Peach
+MARIO_NAME_PREFIXES = ("lego mario", "lego luigi", "lego peach")
+# Advertisements of LEGO hubs
+# https://lego.github.io/lego-ble-wireless-protocol-docs/index.html#advertising
+LEGO_HUB_SERVICE_UUID = "00001623-1212-efde-1623-785feabcd123"
+LEGO_MANUFACTURER_ID = 0x0397
+# System Type and Device Number (2nd byte of the manufacturer data)
+MARIO_SYSTEM_TYPES = {
+    0x43: "Mario",
+    0x44: "Luigi",
+    0x45: "Peach"
+}
 # Request Commmands
-REQUEST_RGB_COMMAND = bytearray([
-                                0x05,  # message length
-                                0x00,  # unused
-                                0x21,  # message type (21=Port Information Request)
-                                0x01,  # port ID
-                                0x00   # requested information type (0=Port Value)
-                                ])
-REQUEST_PANTS_COMMAND = bytearray([0x05, 0x00, 0x21, 0x02, 0x00])
-REQUEST_IMU_COMMAND = bytearray([0x05, 0x00, 0x21, 0x00, 0x00])
+def port_request_command(port: int, information_type: int = 0) -> bytes:
+    """Creates a PORT_INFORMATION_REQUEST message according to the Lego
+    Wireless Protocol: https://lego.github.io/lego-ble-wireless-protocol-docs/index.html#port-information-request
+
+    Args:
+        port (int): The port to request information about.
+        information_type (int, optional): 0 = Port Value, 1 = Mode Info,
+            2 = Possible Mode Combinations. Defaults to 0.
+
+    Returns:
+        bytes: A new message to be sent to Lego Mario
+    """
+    return bytes([
+                0x05,  # message length
+                0x00,  # unused
+                0x21,  # message type (21=Port Information Request)
+                port,  # port ID
+                information_type  # requested information type
+                ])
+
+REQUEST_RGB_COMMAND = port_request_command(1)
+REQUEST_PANTS_COMMAND = port_request_command(2)
+REQUEST_IMU_COMMAND = port_request_command(0)
 
 VALID_PORT_MODES = {0:(0,1), 1:(0,1), 2:(0,), 3:(0,1,2,3), 4:(0,), 6:(0,)}
 
@@ -154,6 +182,13 @@ TURN_OFF_COMMAND = bytearray([
                         0x02, # message type (02 = HUB Actions)
                         0x01, # specify action (01 = turn off)
                         ])
+RSSI_REQUEST_COMMAND = bytes([
+                        0x05, # message length
+                        0x00, # unused, always 0
+                        0x01, # message type (01 = Hub Properties)
+                        0x05, # specify hub property (05 = signal strength)
+                        0x05, # specify operation (5 = request update)
+                        ])
 
 BINARY_GESTURES = { # most likely wrong
                 0b0000000000000001: "Bump",
@@ -21,20 +21,72 @@ SOFTWARE.
 """
 
 import asyncio
-from typing import Any, Callable, Iterable, Union
-from bleak import BleakScanner, BleakClient, BleakError
+import random
+import struct
+import time
+import weakref
+from concurrent.futures import Executor
+from pathlib import Path
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Iterable, Union
+from bleak import BleakClient, BleakError
 try:
     from .lego_mario_data import (HEX_TO_RGB_TILE, HEX_TO_COLOR_TILE, HEX_TO_PANTS,
         HEX_TO_HUB_ACTIONS, HEX_TO_HUB_PROPERTIES, BINARY_GESTURES,
-        LEGO_CHARACTERISTIC_UUID, SUBSCRIBE_IMU_COMMAND, SUBSCRIBE_PANTS_COMMAND,
-        SUBSCRIBE_RGB_COMMAND, DISCONNECT_COMMAND, pifs_command, TURN_OFF_COMMAND,
-        MUTE_COMMAND, REQUEST_RGB_COMMAND)
+        LEGO_CHARACTERISTIC_UUID, SUBSCRIBE_PANTS_COMMAND, SUBSCRIBE_RGB_COMMAND,
+        DISCONNECT_COMMAND, pifs_command, TURN_OFF_COMMAND,
+        MUTE_COMMAND, port_request_command, RSSI_REQUEST_COMMAND)
+    from .mario_hooks import RateLimitedHook, OffloadedHook
+    from .mario_recording import NotificationRecorder
+    from .mario_transport import BleakTransport, DeviceFilter, scan
+    from .mario_devices import KnownDevices
+    from .mario_writer import WriteQueue
+    from .mario_polling import PortPoller
+    from .mario_tuning import DeltaIntervalTuner
+    from .mario_stats import LinkStats
+    from .mario_runtime import register, registered, serve, start_soon, run
+    from .mario_events import (LogRecord, DEBUG, INFO, WARNING, ERROR,
+        NO_LOGGING, MarioEvent, TileEvent, ColorEvent, AccelEvent, PantsEvent,
+        HubEvent, EVENT_TYPES, EventStream)
 except ImportError:
     from lego_mario_data import (HEX_TO_RGB_TILE, HEX_TO_COLOR_TILE, HEX_TO_PANTS,
         HEX_TO_HUB_ACTIONS, HEX_TO_HUB_PROPERTIES, BINARY_GESTURES,
-        LEGO_CHARACTERISTIC_UUID, SUBSCRIBE_IMU_COMMAND, SUBSCRIBE_PANTS_COMMAND,
-        SUBSCRIBE_RGB_COMMAND, DISCONNECT_COMMAND, pifs_command, TURN_OFF_COMMAND,
-        MUTE_COMMAND, REQUEST_RGB_COMMAND)
+        LEGO_CHARACTERISTIC_UUID, SUBSCRIBE_PANTS_COMMAND, SUBSCRIBE_RGB_COMMAND,
+        DISCONNECT_COMMAND, pifs_command, TURN_OFF_COMMAND,
+        MUTE_COMMAND, port_request_command, RSSI_REQUEST_COMMAND)
+    from mario_hooks import RateLimitedHook, OffloadedHook
+    from mario_recording import NotificationRecorder
+    from mario_transport import BleakTransport, DeviceFilter, scan
+    from mario_devices import KnownDevices
+    from mario_writer import WriteQueue
+    from mario_polling import PortPoller
+    from mario_tuning import DeltaIntervalTuner
+    from mario_stats import LinkStats
+    from mario_runtime import register, registered, serve, start_soon, run
+    from mario_events import (LogRecord, DEBUG, INFO, WARNING, ERROR,
+        NO_LOGGING, MarioEvent, TileEvent, ColorEvent, AccelEvent, PantsEvent,
+        HubEvent, EVENT_TYPES, EventStream)
+
+# Seconds to wait for a known device before scanning for it
+_DIRECT_CONNECT_TIMEOUT = 3.0
+# Seconds to wait for Mario to acknowledge a port setup, and number of retries
+_HANDSHAKE_TIMEOUT = 1.0
+_HANDSHAKE_RETRIES = 2
+
+# Precompiled layouts of the Port Value (0x45) payloads, starting at byte 4
+_ACCELERATION_STRUCT = struct.Struct(">bbb")
+_GESTURE_STRUCT = struct.Struct(">HH")
+_TILE_STRUCT = struct.Struct(">I")
+
+
+# Names for codes that aren't in lego_mario_data, created once per code
+@lru_cache(maxsize=256)
+def _unknown_tile_name(tile_code: int) -> str:
+    return f"Unkown Tile Code: {hex(tile_code)}"
+
+@lru_cache(maxsize=256)
+def _unknown_color_name(color_code: int) -> str:
+    return f"Unkown Color: {hex(color_code)}"
 
 
 class Mario:
@@ -44,18 +96,39 @@ class Mario:
     ----------
     do_log: bool
         If True, log messages will be printed to stdout.
+    log_level: int
+        Minimum level (logging.DEBUG, INFO, ...) of messages printed to stdout.
     pants: str | None
         Value of most recent pants value
     ground: str | None
         Value of most recent camera/rgb value
     acceleration: tuple[int, int, int] | None
         Value of most recent acceleration value
+    acceleration_buffer: AccelerationBuffer | None
+        Recent accelerometer samples as NumPy arrays, if enabled.
+    recorder: NotificationRecorder | None
+        Records all raw notifications while recording.
     auto_reconnect: bool
         Whether .connect() should be called after disconnecting
     run: bool
         TBD
     client: BleakClient | None
         The bluetooth client that communicates with Mario
+    transport: BleakTransport | SimulatedTransport
+        Finds devices and creates clients, see mario_transport.
+    device_filter: (device, AdvertisementData) -> bool
+        Decides which devices Mario connects to, see DeviceFilter.
+    known_devices: KnownDevices
+        Previously connected Marios, tried directly before scanning.
+    retry_budget: int | None
+        Number of failed connection attempts before .connect() gives up.
+    reconnect_backoff: tuple[float, float]
+        Initial and maximum delay in seconds between connection attempts.
+    handshake_time: float | None
+        Seconds it took to set up the ports after the last connection,
+        until Mario acknowledged the last setup.
+    fleet: MarioFleet | None
+        If set, the fleet finds a device for this Mario when connecting.
     default_volume: int | None
         The % volume that Mario will be set to after (re)connecting.
     _accelerometer_hooks: list[(Mario, int, int, int) -> None]
@@ -64,26 +137,62 @@ class Mario:
         List of callback functions for pants updates.
     _tile_event_hooks: list[(Mario, str) -> None]
         List of callback functions for camera/rgb updates.
+    _event_hooks: dict[type[MarioEvent], list[(Mario, MarioEvent) -> None]]
+        Lists of callback functions for typed events, one per event type.
+    _event_streams: WeakSet[EventStream]
+        Open event streams created by .events().
     _log_event_hooks: list[(Mario, str) -> None]
         List of callback functions for log messages.
+    _disconnect_hooks: list[(Mario) -> None]
+        List of callback functions for lost or closed connections.
+    _log_record_hooks: list[(Mario, LogRecord) -> None]
+        List of callback functions for structured log records.
+    _log_hook_levels: dict[callback, int]
+        Minimum log level of each log hook.
+    _log_threshold: int
+        Lowest log level any sink listens to. Messages below it are
+        discarded before a LogRecord is even created.
     _all_hooks: tuple[list[callbacks]]
         tuple that contains all of the previous lists of callback functions
+    _supervisor: asyncio.Task | None
+        The only task that reconnects Mario after the connection ended.
+    _writer: WriteQueue | None
+        Sends all commands of the current connection, in order.
 
     Methods
     -------
-    add_accelerometer_hooks: (Callable | list[Callable]) -> None
-        Adds the given function(s) as callback functions for accelerometer data
+    add_accelerometer_hooks: (Callable | list[Callable], float, bool) -> None
+        Adds the given function(s) as callback functions for accelerometer
+        data, optionally rate limited
     add_pants_hooks: (Callable | list[Callable]) -> None
         Adds the given function(s) as callback functions for pants data
     add_tile_hooks: (Callable | list[Callable]) -> None
         Adds the given function(s) as callback functions for tile data
-    add_log_hooks: (Callable | list[Callable]) -> None
+    add_event_hooks: (Callable | list[Callable], Iterable[type]) -> None
+        Adds the given function(s) as callback functions for typed events
+    add_log_hooks: (Callable | list[Callable], int) -> None
         Adds the given function(s) as callback functions for log calls
+    add_log_record_hooks: (Callable | list[Callable], int) -> None
+        Adds the given function(s) as callback functions for LogRecords
+    add_disconnect_hooks: (Callable | list[Callable]) -> None
+        Adds the given function(s) as callback functions for disconnects
     remove_hooks: (list[Any] | Callable) -> None
         Removes the given object(s) from all hook lists.
+    events: (Iterable[type], int, str) -> EventStream
+        Creates an async iterator over Mario's typed events.
+    start_recording: (str | Path) -> NotificationRecorder
+        Starts writing all raw notifications to a file.
+    stop_recording: () -> None
+        Stops the recording and closes the file.
+    hook_stats: () -> dict
+        Counters of coalesced and dropped samples of rate limited hooks.
+    write_stats: () -> dict | None
+        Queue depth and latency of the commands sent to Mario.
     log: (str) -> None
         logs the message to stdout if self.do_log is true. Also passes message
         to all callback functions in self._log_hooks.
+    log_enabled: (int) -> bool
+        Whether a message of the given level would reach any sink.
     connect: () -> Coroutine
         Searches for Lego Mario objects via bluetooth and tries to connect.
         Needs to be awaited.
@@ -109,7 +218,19 @@ class Mario:
                     Callable[["Mario", str], Any],
                     Iterable[Callable[["Mario", str], Any]]
                     ]=[],
-                default_volume: Union[int, None]=None
+                default_volume: Union[int, None]=None,
+                log_level: int=DEBUG,
+                acceleration_buffer_size: int=0,
+                max_concurrent_hooks: int=8,
+                transport: Any=None,
+                auto_connect: bool=True,
+                device_filter: Union[
+                    Callable[[Any, Any], bool], None]=None,
+                known_devices: Union[KnownDevices, None]=None,
+                retry_budget: Union[int, None]=10,
+                reconnect_backoff: tuple[float, float]=(0.5, 30.0),
+                imu_delta_interval: int=2,
+                collect_stats: bool=True
                 ) -> None:
         """
         Args:
@@ -139,12 +260,77 @@ class Mario:
             defaultVolume (func or list of functions, optional): Volume (0-100)
                 that will be set every time Mario reconnects. If not provided,
                 will not adjust volume. Defaults to None.
+
+            log_level (int, optional): Minimum level of log messages printed
+                to stdout. Raw accelerometer data is logged as DEBUG.
+                Defaults to DEBUG.
+
+            acceleration_buffer_size (int, optional): If not 0, the most
+                recent accelerometer samples are kept in
+                self.acceleration_buffer, see mario_buffer.AccelerationBuffer.
+                Requires numpy (pip install pyLegoMario[numpy]).
+                Defaults to 0.
+
+            max_concurrent_hooks (int, optional): Maximum number of coroutine
+                hooks and hooks running in an executor that may run at the
+                same time. Defaults to 8.
+
+            transport (optional): Used to find and connect to Mario. Use
+                mario_simulator.SimulatedTransport to run without bluetooth.
+                Defaults to BleakTransport() (real bluetooth).
+
+            auto_connect (bool, optional): Start connecting right away.
+                Pass False to add Mario to a MarioFleet, or to await
+                .connect() yourself. Defaults to True.
+
+            device_filter (function, optional): Takes (device,
+                advertisement data) and returns whether to connect to the
+                device, e.g. DeviceFilter(addresses=["..."]). Defaults to
+                DeviceFilter() (any Mario, Luigi or Peach).
+
+            known_devices (KnownDevices, optional): Cache of previously
+                connected Marios. Defaults to the shared cache file
+                (~/.pyLegoMario/known_devices.json) with real bluetooth and
+                to an in-memory cache with any other transport.
+
+            retry_budget (int | None, optional): Number of failed
+                connection attempts (direct reconnect or scan) before
+                .connect() gives up. None retries forever. Defaults to 10.
+
+            reconnect_backoff (tuple[float, float], optional): Initial and
+                maximum delay in seconds between attempts. The delay doubles
+                after every failed attempt and is randomized by +-50%, so
+                several Marios don't retry in lockstep.
+                Defaults to (0.5, 30.0).
+
+            imu_delta_interval (int, optional): Change of the accelerometer
+                values needed for a new notification, see
+                lego_mario_data.pifs_command(). Higher values send fewer
+                notifications. Use .tune_delta_interval() to adjust it
+                automatically. Defaults to 2.
+
+            collect_stats (bool, optional): Count notifications per kind
+                for .stats(). Pass False to save the bookkeeping on every
+                notification, .stats() then has no notification counts.
+                Defaults to True.
         """
 
-        self.do_log = do_log  # output logs to stdout if True
         self.run = False
         self.auto_reconnect = True  # handles reconnection on disconnect
         self.client: BleakClient | None = None
+        self.transport = transport if transport is not None else (
+            BleakTransport())
+        self.device_filter = device_filter if device_filter is not None else (
+            DeviceFilter())
+        if known_devices is None:
+            known_devices = (KnownDevices() if transport is None
+                             else KnownDevices(path=None))
+        self.known_devices = known_devices
+        self.retry_budget = retry_budget
+        self.reconnect_backoff = reconnect_backoff
+        self.fleet = None
+        self._last_address: str | None = None  # device of the last connection
+        self._connecting_to: str | None = None  # device being connected to
         self.default_volume = default_volume  # if None, volume won't be changed
 
         # values to keep most recent event in memory
@@ -152,6 +338,21 @@ class Mario:
         self.ground: str | None = None
         self.acceleration: tuple[int, int, int] | None = None
         self.recent_tile: str | None = None
+        self.recorder: NotificationRecorder | None = None
+        self.acceleration_buffer = None
+        if acceleration_buffer_size:
+            try:
+                import numpy  # noqa: F401
+            except ImportError as e:
+                raise ImportError(
+                    "acceleration_buffer_size requires numpy, install it "
+                    "with pip install pyLegoMario[numpy]") from e
+            try:
+                from .mario_buffer import AccelerationBuffer
+            except ImportError:
+                from mario_buffer import AccelerationBuffer
+            self.acceleration_buffer = AccelerationBuffer(
+                acceleration_buffer_size)
 
         self._accelerometer_hooks: list[
                                         Callable[
@@ -159,104 +360,351 @@ class Mario:
                                         ] = []
         self._tile_event_hooks: list[Callable[[Mario, str], Any]] = []
         self._pants_event_hooks: list[Callable[[Mario, str], Any]] = []
+        self._event_hooks: dict[
+                                type[MarioEvent],
+                                list[Callable[[Mario, Any], Any]]
+                                ] = {kind: [] for kind in EVENT_TYPES}
+        self._event_streams: weakref.WeakSet[EventStream] = weakref.WeakSet()
         self._log_event_hooks: list[Callable[[Mario, str], Any]] = []
+        self._log_record_hooks: list[Callable[[Mario, LogRecord], Any]] = []
+        self._log_hook_levels: dict[Callable[..., Any], int] = {}
+        self._disconnect_hooks: list[Callable[[Mario], Any]] = []
+        self._max_concurrent_hooks = max_concurrent_hooks
         self._all_hooks = (self._accelerometer_hooks, self._pants_event_hooks,
-                         self._tile_event_hooks, self._log_event_hooks)
+                         self._tile_event_hooks, self._log_event_hooks,
+                         self._log_record_hooks, self._disconnect_hooks,
+                         *self._event_hooks.values())
+
+        # asyncio primitives, created on the loop Mario runs on by
+        # _bind_loop(). Python 3.9 binds them to the loop that is current
+        # when they are created, which serve() doesn't run yet.
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._hook_semaphore: asyncio.Semaphore | None = None
+        self._connect_lock: asyncio.Lock | None = None  # one attempt at a time
+        self._connected: asyncio.Event | None = None
+        self._supervisor: asyncio.Task | None = None
+        self.handshake_time: float | None = None
+        self.imu_delta_interval = imu_delta_interval
+        self._link_stats = LinkStats(self._DECODER_KINDS)
+        # ArrivalStats by decoder index, updated for every notification
+        self._arrivals = (self._link_stats.arrivals if collect_stats
+                          else None)
+        self._writer: WriteQueue | None = None
+        # (port, mode) -> futures waiting for the Port Input Format Handshake
+        self._port_format_waiters: dict[
+            tuple[int, int], list[asyncio.Future]] = {}
+        # set by the hook callers if a hook raised, see _handle_events()
+        self._hook_failed = False
+        # port -> whether notifications are on, as acknowledged by Mario
+        self._port_notifications: dict[int, bool] = {}
+        # port -> futures of .read_port() waiting for the next Port Value
+        self._port_value_waiters: dict[int, list[asyncio.Future]] = {}
+
+        self._log_threshold = NO_LOGGING
+        self._do_log = do_log  # output logs to stdout if True
+        self._log_level = log_level
+        self._update_log_threshold()
 
         self.add_accelerometer_hooks(accelerometer_hooks)
         self.add_tile_hooks(tile_event_hooks)
         self.add_pants_hooks(pants_event_hooks)
         self.add_log_hooks(log_event_hooks)
 
-        try:  # if event loop exists, use that one
-            asyncio.get_event_loop().create_task(self.connect())
-        except RuntimeError:  # otherwise, create a new one
-            asyncio.set_event_loop(asyncio.SelectorEventLoop())
-            asyncio.get_event_loop().create_task(self.connect())
+        register(self)
+        if auto_connect:  # as soon as an event loop runs
+            start_soon(self.start)
+
+    @property
+    def do_log(self) -> bool:
+        """If True, log messages will be printed to stdout."""
+        return self._do_log
+
+    @do_log.setter
+    def do_log(self, value: bool) -> None:
+        self._do_log = value
+        self._update_log_threshold()
+
+    @property
+    def log_level(self) -> int:
+        """Minimum level of log messages printed to stdout."""
+        return self._log_level
+
+    @log_level.setter
+    def log_level(self, value: int) -> None:
+        self._log_level = value
+        self._update_log_threshold()
+
+    def _update_log_threshold(self) -> None:
+        """Recalculates the lowest log level that any sink listens to."""
+        levels = [self._log_hook_levels[func] for func
+                  in (*self._log_event_hooks, *self._log_record_hooks)]
+        if self._do_log:
+            levels.append(self._log_level)
+        self._log_threshold = min(levels, default=NO_LOGGING)
+
+    def log_enabled(self, level: int) -> bool:
+        """Checks whether a message of the given level would reach stdout or
+        any log hook.
+
+        Args:
+            level (int): Log level, e.g. logging.DEBUG.
+
+        Returns:
+            bool: False if the message would be discarded.
+        """
+        return level >= self._log_threshold
 
-    def log(self, msg: str, end: str = "\n") -> None:
+    def log(self, msg: str, end: str = "\n", level: int = INFO,
+            category: str = "general") -> None:
         """Log any message to stdout and call all assigned LogEvent handlers.
 
         Args:
             msg (object): Any printable object.
             end (str, optional): Same as end in print(). Defaults to "\n".
+            level (int, optional): Log level. Defaults to INFO.
+            category (str, optional): What the message is about.
+                Defaults to "general".
+        """
+        if level >= self._log_threshold:
+            self._emit_log(LogRecord(level, category, str(msg)), end)
+
+    def _log(self, level: int, category: str, fmt: str, *args: Any,
+             data: Union[bytearray, None] = None, end: str = "\n") -> None:
+        """Logs a message that is only formatted if a sink needs it.
+
+        Args:
+            level (int): Log level.
+            category (str): What the message is about.
+            fmt (str): Format string, see LogRecord.
+            *args: Arguments for fmt.
+            data (bytearray, optional): Raw notification. Defaults to None.
+            end (str, optional): Same as end in print(). Defaults to "\n".
         """
+        if level >= self._log_threshold:
+            self._emit_log(LogRecord(level, category, fmt, args, data), end)
+
+    def _emit_log(self, record: LogRecord, end: str = "\n") -> None:
+        """Passes a LogRecord to every sink whose level it satisfies."""
+        level = record.level
+        hook_levels = self._log_hook_levels
         for func in self._log_event_hooks:
-            func(self, msg)
-        if self.do_log:
+            if level >= hook_levels[func]:
+                func(self, record.msg)
+        for func in self._log_record_hooks:
+            if level >= hook_levels[func]:
+                func(self, record)
+        if self._do_log and level >= self._log_level:
             address = "Not Connected" if not self.client else self.client.address
-            print((f"\r{address}: {msg}").ljust(100), end=end)
+            print((f"\r{address}: {record.msg}").ljust(100), end=end)
+
+    def _bind_loop(self) -> None:
+        """Creates Mario's asyncio primitives on the running loop, unless
+        they already belong to it."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._hook_semaphore = asyncio.Semaphore(
+                self._max_concurrent_hooks)
+            self._connect_lock = asyncio.Lock()
+            self._connected = asyncio.Event()
+
+    def _hook_limiter(self) -> asyncio.Semaphore:
+        """The semaphore shared by Mario's offloaded hooks."""
+        self._bind_loop()
+        assert self._hook_semaphore is not None
+        return self._hook_semaphore
+
+    def _wrap_hook(self, func: Callable[..., Any],
+                   executor: Union[Executor, None] = None
+                   ) -> Callable[..., Any]:
+        """Wraps coroutine functions and functions that should run in an
+        executor in an OffloadedHook. Returns other functions unchanged."""
+        if executor is not None or asyncio.iscoroutinefunction(func):
+            return OffloadedHook(func, self._hook_limiter, executor)
+        return func
 
     def add_log_hooks(
         self, funcs: Union[
                      Callable[["Mario", str], Any], 
-                     Iterable[Callable[["Mario", str], Any]]]
+                     Iterable[Callable[["Mario", str], Any]]],
+        level: int = DEBUG,
+        executor: Union[Executor, None] = None
         ) -> None:
-        """Adds function(s) as event hooks for updated tile or color values.
+        """Adds function(s) as event hooks for log messages.
 
         Args:
             funcs (func or list of functions): callback functions must take
-                (Mario, str) as input.
+                (Mario, str) as input. May be coroutine functions.
+            level (int, optional): Minimum level of messages passed to the
+                function(s). Defaults to DEBUG.
+            executor (Executor, optional): Run the function(s) in this
+                executor instead of the event loop. Defaults to None.
         """
         if callable(funcs):
+            funcs = self._wrap_hook(funcs, executor)
             self._log_event_hooks.append(funcs)
+            self._log_hook_levels[funcs] = level
+            self._update_log_threshold()
         elif hasattr(funcs, '__iter__'):
             for hook_function in funcs:
-                self.add_log_hooks(hook_function)
+                self.add_log_hooks(hook_function, level, executor)
+
+    def add_log_record_hooks(
+        self, funcs: Union[
+                     Callable[["Mario", LogRecord], Any],
+                     Iterable[Callable[["Mario", LogRecord], Any]]],
+        level: int = DEBUG,
+        executor: Union[Executor, None] = None
+        ) -> None:
+        """Adds function(s) as event hooks for structured log records.
+
+        Args:
+            funcs (func or list of functions): callback functions must take
+                (Mario, LogRecord) as input. May be coroutine functions.
+            level (int, optional): Minimum level of records passed to the
+                function(s). Defaults to DEBUG.
+            executor (Executor, optional): Run the function(s) in this
+                executor instead of the event loop. Defaults to None.
+        """
+        if callable(funcs):
+            funcs = self._wrap_hook(funcs, executor)
+            self._log_record_hooks.append(funcs)
+            self._log_hook_levels[funcs] = level
+            self._update_log_threshold()
+        elif hasattr(funcs, '__iter__'):
+            for hook_function in funcs:
+                self.add_log_record_hooks(hook_function, level, executor)
 
     def add_tile_hooks(
         self,
         funcs: Union[
             Callable[["Mario", str], Any],
-            Iterable[Callable[["Mario", str], Any]]]
+            Iterable[Callable[["Mario", str], Any]]],
+        executor: Union[Executor, None] = None
         ) -> None:
         """Adds function(s) as event hooks for updated tile or color values.
 
         Args:
             funcs (func or list of functions): callback functions must take
-                (Mario, str) as input.
+                (Mario, str) as input. May be coroutine functions.
+            executor (Executor, optional): Run the function(s) in this
+                executor instead of the event loop. Defaults to None.
         """
         if callable(funcs):
-            self._tile_event_hooks.append(funcs)
+            self._tile_event_hooks.append(self._wrap_hook(funcs, executor))
         elif hasattr(funcs, '__iter__'):
             for hook_function in funcs:
-                self.add_tile_hooks(hook_function)
+                self.add_tile_hooks(hook_function, executor)
 
     def add_accelerometer_hooks(
         self,
         funcs: Union[
             Callable[["Mario", int, int, int], Any], 
-            Iterable[Callable[["Mario", int, int, int], Any]]]
+            Iterable[Callable[["Mario", int, int, int], Any]]],
+        max_rate: Union[float, None] = None,
+        average: bool = False,
+        executor: Union[Executor, None] = None
         ) -> None:
         """Adds function(s) as event hooks for updated accelerometer values.
 
         Args:
             funcs (function or list of functions): callback function(s) take
-            input as (Mario, int, int, int).
+            input as (Mario, int, int, int). May be coroutine functions.
+            max_rate (float, optional): Maximum number of calls per second
+                for each function. Samples arriving in between are
+                coalesced, only the newest one is delivered. Use this for
+                slow hooks, e.g. ones that update a GUI. Defaults to None
+                (every sample is delivered).
+            average (bool, optional): If True, coalesced samples are
+                delivered as their mean instead of only the newest one.
+                Defaults to False.
+            executor (Executor, optional): Run the function(s) in this
+                executor instead of the event loop. Defaults to None.
         """
         if callable(funcs):
+            funcs = self._wrap_hook(funcs, executor)
+            if (max_rate is not None or average
+                    or isinstance(funcs, OffloadedHook)):
+                # offloaded hooks only get the newest sample when they are
+                # still busy with older ones
+                funcs = RateLimitedHook(funcs, max_rate, average)
             self._accelerometer_hooks.append(funcs)
         elif hasattr(funcs, '__iter__'):
             for hook_function in funcs:
-                self.add_accelerometer_hooks(hook_function)
+                self.add_accelerometer_hooks(hook_function, max_rate, average,
+                                             executor)
 
     def add_pants_hooks(
         self,
         funcs: Union[
             Callable[["Mario", str], Any],
-            Iterable[Callable[["Mario", str], Any]]]
+            Iterable[Callable[["Mario", str], Any]]],
+        executor: Union[Executor, None] = None
         ) -> None:
         """Adds function(s) as event hooks for updated pants values.
 
         Args:
             funcs (func or list of functions): callback function(s) take
-                input as (Mario, str).
+                input as (Mario, str). May be coroutine functions.
+            executor (Executor, optional): Run the function(s) in this
+                executor instead of the event loop. Defaults to None.
         """
         if callable(funcs):
-            self._pants_event_hooks.append(funcs)
+            self._pants_event_hooks.append(self._wrap_hook(funcs, executor))
         elif hasattr(funcs, '__iter__'):
             for hook_function in funcs:
-                self.add_pants_hooks(hook_function)
+                self.add_pants_hooks(hook_function, executor)
+
+    def add_disconnect_hooks(
+        self,
+        funcs: Union[
+            Callable[["Mario"], Any],
+            Iterable[Callable[["Mario"], Any]]],
+        executor: Union[Executor, None] = None
+        ) -> None:
+        """Adds function(s) as event hooks for ended connections. They are
+        called once per connection, right after it was lost or closed.
+
+        Args:
+            funcs (func or list of functions): callback function(s) take
+                input as (Mario). May be coroutine functions.
+            executor (Executor, optional): Run the function(s) in this
+                executor instead of the event loop. Defaults to None.
+        """
+        if callable(funcs):
+            self._disconnect_hooks.append(self._wrap_hook(funcs, executor))
+        elif hasattr(funcs, '__iter__'):
+            for hook_function in funcs:
+                self.add_disconnect_hooks(hook_function, executor)
+
+    def add_event_hooks(
+        self,
+        funcs: Union[
+            Callable[["Mario", MarioEvent], Any],
+            Iterable[Callable[["Mario", MarioEvent], Any]]],
+        kinds: Iterable[type[MarioEvent]] = EVENT_TYPES,
+        executor: Union[Executor, None] = None
+        ) -> None:
+        """Adds function(s) as event hooks for typed events. Unlike the
+        other hooks, these receive the decoded event object including the
+        time the notification was received.
+
+        Args:
+            funcs (func or list of functions): callback function(s) take
+                input as (Mario, MarioEvent). May be coroutine functions.
+            kinds (iterable of event types, optional): The types of events
+                (TileEvent, ColorEvent, AccelEvent, PantsEvent, HubEvent) the
+                function(s) will be called for. Defaults to all of them.
+            executor (Executor, optional): Run the function(s) in this
+                executor instead of the event loop. Defaults to None.
+        """
+        if callable(funcs):
+            funcs = self._wrap_hook(funcs, executor)
+            for kind in kinds:
+                self._event_hooks[kind].append(funcs)
+        elif hasattr(funcs, '__iter__'):
+            for hook_function in funcs:
+                self.add_event_hooks(hook_function, kinds, executor)
 
     def remove_hooks(
         self,
@@ -274,198 +722,559 @@ class Mario:
         if callable(funcs):
             for hooktype in self._all_hooks:
                 if funcs in hooktype:
-                    hooktype.remove(funcs)
+                    hook = hooktype.pop(hooktype.index(funcs))
+                    if isinstance(hook, (RateLimitedHook, OffloadedHook)):
+                        hook.cancel()
+            if (funcs in self._log_hook_levels
+                    and funcs not in self._log_event_hooks
+                    and funcs not in self._log_record_hooks):
+                del self._log_hook_levels[funcs]
+                self._update_log_threshold()
         elif hasattr(funcs, '__iter__'):
             for hook_function in funcs:
                 self.remove_hooks(hook_function)
 
+    def hook_stats(self) -> dict[Callable[..., Any], dict[str, int]]:
+        """Sample counters of all rate limited accelerometer hooks.
+
+        Returns:
+            dict: Maps each hook function to a dict with the number of
+                received, delivered, coalesced, dropped and pending samples.
+        """
+        return {getattr(hook.func, "func", hook.func): hook.stats
+                for hook in self._accelerometer_hooks
+                if isinstance(hook, RateLimitedHook)}
+
+    def events(self, kinds: Iterable[type[MarioEvent]] = EVENT_TYPES,
+               maxsize: int = 256, overflow: str = "drop_oldest",
+               max_backlog: Union[int, None] = None) -> EventStream:
+        """Creates an async iterator over Mario's typed events. Every call
+        creates a new stream with its own queue.
+
+        Example:
+            async with mario.events(kinds=(TileEvent,)) as stream:
+                async for event in stream:
+                    print(event.name)
+
+        Args:
+            kinds (iterable of event types, optional): Types of events the
+                stream receives. Defaults to all of them.
+            maxsize (int, optional): Number of events the stream buffers
+                before overflow applies. Defaults to 256.
+            overflow (str, optional): What to do if the buffer is full:
+                "drop_oldest", "drop_newest" or "block" (keep up to
+                max_backlog more, see EventStream). Defaults to
+                "drop_oldest".
+            max_backlog (int, optional): Events kept beyond maxsize with
+                overflow "block". Defaults to 16 * maxsize.
+
+        Returns:
+            EventStream: The stream. Stops receiving events when closed (or
+                garbage collected).
+        """
+        stream = EventStream(kinds, maxsize, overflow,
+                             on_close=self._event_streams.discard,
+                             max_backlog=max_backlog)
+        self._event_streams.add(stream)
+        return stream
+
+    def start_recording(self, path: Union[str, Path], block_size: int = 256
+                        ) -> NotificationRecorder:
+        """Writes all raw notifications from now on to a file, which can be
+        played back with mario_recording.NotificationReplayer.
+        Stops a previous recording.
+
+        Args:
+            path (str | Path): File to write to. Will be overwritten.
+            block_size (int, optional): Number of notifications written to
+                the file at once. Defaults to 256.
+
+        Returns:
+            NotificationRecorder: The recorder.
+        """
+        self.stop_recording()
+        self.recorder = NotificationRecorder(path, block_size,
+                                             on_close=self._recording_closed)
+        return self.recorder
 
-    def _call_tile_hooks(self, tile: str) -> None:
-        self.ground = tile
-        for func in self._tile_event_hooks:
-            func(self, tile)
+    def stop_recording(self) -> None:
+        """Stops the recording and closes the file."""
+        if self.recorder is not None:
+            self.recorder.close()
 
-    def _call_accelerometer_hooks(self, x: int, y: int, z: int) -> None:
-        self.acceleration = (x, y, z)
-        for func in self._accelerometer_hooks:
-            func(self, x, y, z)
+    def _recording_closed(self, recorder: NotificationRecorder) -> None:
+        """Detaches a recorder that was closed, e.g. by a with block."""
+        if self.recorder is recorder:
+            self.recorder = None
 
-    def _call_pants_hooks(self, powerup: str) -> None:
-        self.pants = powerup
-        for func in self._pants_event_hooks:
-            func(self, powerup)
+    def _feed_streams(self, event: MarioEvent) -> None:
+        for stream in self._event_streams:
+            stream.put(event)
+
+    # Hook callers for the decoders. They update Mario's state and call the
+    # hooks. Event objects are only created if an event hook, an event
+    # stream or a .read_port() needs them. Waiting reads get the value
+    # before the hooks run, so a failing hook doesn't make them time out.
+    def _dispatch_event(self, data: Union[bytearray, None],
+                        event: MarioEvent) -> None:
+        if data is not None and self._port_value_waiters:
+            self._resolve_port_reads(data, event)
+        if self._event_streams:
+            self._feed_streams(event)
+        for func in self._event_hooks[type(event)]:
+            func(self, event)
+
+    def _call_tile_hooks(self, data: bytearray, kind: type, timestamp: int,
+                         code: int, name: str) -> None:
+        self.ground = name
+        try:
+            if (self._port_value_waiters or self._event_streams
+                    or self._event_hooks[kind]):
+                self._dispatch_event(data, kind(timestamp, code, name))
+            for func in self._tile_event_hooks:
+                func(self, name)
+        except Exception:
+            self._hook_failed = True
+            raise
+
+    def _call_accelerometer_hooks(self, data: bytearray, timestamp: int,
+                                  x: int, y: int, z: int) -> None:
+        if self.acceleration_buffer is not None:
+            self.acceleration_buffer.append(timestamp, x, y, z)
+        try:
+            if (self._port_value_waiters or self._event_streams
+                    or self._event_hooks[AccelEvent]):
+                self._dispatch_event(data, AccelEvent(timestamp, x, y, z))
+            for func in self._accelerometer_hooks:
+                func(self, x, y, z)
+        except Exception:
+            self._hook_failed = True
+            raise
+
+    def _call_pants_hooks(self, data: bytearray, timestamp: int, bits: int,
+                          name: str) -> None:
+        self.pants = name
+        try:
+            if (self._port_value_waiters or self._event_streams
+                    or self._event_hooks[PantsEvent]):
+                self._dispatch_event(data, PantsEvent(timestamp, bits, name))
+            for func in self._pants_event_hooks:
+                func(self, name)
+        except Exception:
+            self._hook_failed = True
+            raise
+
+    def _call_hub_hooks(self, timestamp: int, message_type: int, code: int,
+                        name: str, payload: bytes = b"") -> None:
+        try:
+            if self._event_streams or self._event_hooks[HubEvent]:
+                self._dispatch_event(None, HubEvent(
+                    timestamp, message_type, code, name, payload))
+        except Exception:
+            self._hook_failed = True
+            raise
 
     def _handle_events(self, sender: int, data: bytearray) -> None:
         """Handles bluetooth notifications.
 
-        Decodes the sent data and calls Mario's appropriate event hooks.
+        Looks up the decoder for the message type and port (byte 3) of the
+        notification in Mario._DECODERS and lets it call Mario's appropriate
+        event hooks.
 
         Args:
             sender (int): Only necessary for bleak compatibility
             data (bytearray): The data of the notification
         """
-        hex_data = data.hex()
-        # Port Value
-        if data[2] == 0x45:
-            # Camera Sensor Data
-            if data[3] == 0x01:
-                if data[4] == data[5] == data[6] == data[7] == 0xff:
-                    self.log(f"IDLE?, Hex: {hex_data}")
-                elif data[4] == data[5] == 0xff:
-                    # Ground Colors
-                    color = HEX_TO_COLOR_TILE.get(
-                        data[6],
-                        f"Unkown Color: {hex(data[6])}")
-                    self.log(f"{color} Ground, Hex: {hex_data}")
-                    self._call_tile_hooks(color)
-                else:
-                    # RGB code
-                    tile_code = int.from_bytes(data[4:], 'big')
-                    tile_name = HEX_TO_RGB_TILE.get(
-                        tile_code,
-                        f"Unkown Tile Code: {hex(tile_code)}")
-                    self.recent_tile = tile_name
-                    self.log(f"{tile_name} Tile, Hex: {hex_data}")
-                    self._call_tile_hooks(tile_name)
-
-            # Accelerometer data
-            elif data[3] == 0x00:
-                # Gesture Mode - experimental, likely not accurate
-                if data[4:6] == data[6:]:
-                    gesture = ""
-                    integer_data = int.from_bytes(data[4:6], "big")
-                    for binary, name in BINARY_GESTURES.items():
-                        if integer_data & binary:
-                            gesture += name
-                    self.log(gesture)
-
-                # RAW Mode
-                else:
-                    try:
-                        x = int(signed(data[4]))
-                        y = int(signed(data[5]))
-                        z = int(signed(data[6]))
-                    except IndexError:
-                        error_msg = (f'Message length is {len(data)}, expected 6.'
-                            'The most likely cause is outdated software. To update, '
-                            'connect your Lego Mario to the Lego Mario smartphone app.')
-                        self.log(error_msg)
-                        raise ValueError(error_msg)
-                    self.log(f"X: {x} Y: {y} Z: {z}", end="")
-                    self._call_accelerometer_hooks(x, y, z)
-
-            # Pants data
-            elif data[3] == 0x02:
-                pants = HEX_TO_PANTS.get(data[4], "Unkown")
-                binary_pants = bin(data[4])
-                self.log(f"{pants} Pants, "
-                    f"Pants-Only Binary: {binary_pants},"
-                    f"Hex: {hex_data}")
-                self._call_pants_hooks(pants)
-            # Port 3 data - uncertain about all of it
-            elif data[3] == 0x03:
-                if data[4] == 0x13 and data[5] == 0x01:
-                    tile_name = HEX_TO_RGB_TILE.get(data[6], "Unkown Tile")
-                    self.log(f"Port 3: Jumped on {tile_name}, Hex: {hex_data}")
-                else:
-                    #TBD
-                    self.log(
-                        f"Unknown value from port 3: {data[4:].hex()}, "
-                        f"Hex: {hex_data}")
-            else:
-                self.log(
-                    f"Unknown value from port {data[3]}: "
-                    f"{data[4:].hex()}, Hex: {hex_data}")
-
-        # other technical messages
-        elif data[2] == 0x02: # Hub Actions
-            action = HEX_TO_HUB_ACTIONS.get(
-                data[3], 
-                f"Unkown Hub Action, Hex: {hex_data}")
-            self.log(f"{action}, Hex: {hex_data}")
-            if data[3] == 0x31:  # 0x31 = Hub Will Disconnect
-                asyncio.get_event_loop().create_task(self.disconnect())
-        elif data[2] == 0x04:  # Hub Attached I/O
-            if data[4]:
-                self.log(f"Port {data[3]} got attached, Hex: {hex_data}")
+        timestamp = time.monotonic_ns()
+        if self.recorder is not None:
+            self.recorder.record(timestamp, data)
+        decoders = self._DECODERS
+        decoder, index = (decoders.get((data[2], data[3]))
+                          or decoders.get((data[2], None),
+                                       self._UNKNOWN_DECODER))
+        if self._arrivals is not None:
+            self._arrivals[index].add(timestamp)
+        try:
+            decoder(self, data, timestamp)
+        except Exception:
+            if self._hook_failed:
+                self._hook_failed = False
+                self._link_stats.hook_errors += 1
             else:
-                self.log(
-                    f"Port {data[3]} got detached, "
-                    f"this shouldn't happen. Hex: {hex_data}")
-        elif data[2] == 0x47:  # Port Input Format Handshake
-            self.log(
-                f"Port {data[3]} changed to mode {data[4]} "
-                f"with{'out' if not data[9] else ''} notifications, "
-                f"Hex: {hex_data}")
-        elif data[2] == 0x01 and data[4] == 0x06:
-            hub_property = HEX_TO_HUB_PROPERTIES.get(data[3], "Unknown Property")
-            self.log(
-                f"Hub Update About {hub_property}: "
-                f"{data[5:].hex()}, "
-                f"Hex: {hex_data}")
-        else:  # Other
-            self.log(
-                f"Unknown message - check Lego Wireless Protocol, "
-                f"Hex: {hex_data}")
+                self._link_stats.undecodable += 1
+            raise
+        # port values without an event (e.g. port 3) are read as bytes
+        if self._port_value_waiters and data[2] == 0x45:
+            self._resolve_port_reads(data, None)
+
+    # Decoders for Mario._DECODERS. Each takes the raw notification and the
+    # time it was received and calls the hooks for it. Log messages are
+    # passed as format strings, so they (and their hex strings) are only
+    # built if somebody is listening.
+    def _decode_camera(self, data: bytearray, timestamp: int) -> None:
+        tile_code, = _TILE_STRUCT.unpack_from(data, 4)
+        if tile_code == 0xffffffff:
+            self._log(INFO, "camera", "IDLE?, Hex: {hex}", data=data)
+            return
+        if tile_code >> 16 == 0xffff:
+            # Ground Colors
+            color_code = data[6]
+            color = (HEX_TO_COLOR_TILE.get(color_code)
+                     or _unknown_color_name(color_code))
+            if self._log_threshold <= INFO:
+                self._log(INFO, "camera", "{} Ground, Hex: {hex}", color,
+                          data=data)
+            self._call_tile_hooks(data, ColorEvent, timestamp, color_code,
+                                  color)
+        else:
+            # RGB code
+            tile_name = (HEX_TO_RGB_TILE.get(tile_code)
+                         or _unknown_tile_name(tile_code))
+            self.recent_tile = tile_name
+            if self._log_threshold <= INFO:
+                self._log(INFO, "camera", "{} Tile, Hex: {hex}", tile_name,
+                          data=data)
+            self._call_tile_hooks(data, TileEvent, timestamp, tile_code,
+                                  tile_name)
+
+    def _decode_accelerometer(self, data: bytearray, timestamp: int) -> None:
+        length = len(data)
+        # Gesture Mode - experimental, likely not accurate
+        if length == 8:
+            first, second = _GESTURE_STRUCT.unpack_from(data, 4)
+            if first == second:
+                if self._log_threshold <= INFO:
+                    self._log(INFO, "gesture", "".join(
+                        name for binary, name in BINARY_GESTURES.items()
+                        if first & binary))
+                return
+        # RAW Mode
+        if length < 7:
+            error_msg = (f'Message length is {length}, expected 6.'
+                'The most likely cause is outdated software. To update, '
+                'connect your Lego Mario to the Lego Mario smartphone app.')
+            self.log(error_msg, level=ERROR, category="accelerometer")
+            raise ValueError(error_msg)
+        x, y, z = self.acceleration = _ACCELERATION_STRUCT.unpack_from(data, 4)
+        # checked here to skip creating the record for every sample
+        if self._log_threshold <= DEBUG:
+            self._log(DEBUG, "accelerometer", "X: {} Y: {} Z: {}", x, y, z,
+                      end="")
+        self._call_accelerometer_hooks(data, timestamp, x, y, z)
+
+    def _decode_pants(self, data: bytearray, timestamp: int) -> None:
+        bits = data[4]
+        pants = HEX_TO_PANTS.get(bits, "Unkown")
+        if self._log_threshold <= INFO:
+            self._log(INFO, "pants",
+                      "{} Pants, Pants-Only Binary: {},Hex: {hex}",
+                      pants, bin(bits), data=data)
+        self._call_pants_hooks(data, timestamp, bits, pants)
+
+    def _decode_port_3(self, data: bytearray, timestamp: int) -> None:
+        # Port 3 data - uncertain about all of it
+        if data[4] == 0x13 and data[5] == 0x01:
+            tile_name = HEX_TO_RGB_TILE.get(data[6], "Unkown Tile")
+            self._log(INFO, "port", "Port 3: Jumped on {}, Hex: {hex}",
+                      tile_name, data=data)
+        elif self._log_threshold <= INFO:
+            #TBD
+            self._log(INFO, "port", "Unknown value from port 3: {}, Hex: {hex}",
+                      memoryview(data)[4:].hex(), data=data)
+
+    def _decode_unknown_port(self, data: bytearray, timestamp: int) -> None:
+        if self._log_threshold <= INFO:
+            self._log(INFO, "port",
+                      "Unknown value from port {}: {}, Hex: {hex}",
+                      data[3], memoryview(data)[4:].hex(), data=data)
+
+    def _decode_hub_action(self, data: bytearray, timestamp: int) -> None:
+        action = HEX_TO_HUB_ACTIONS.get(data[3], "Unkown Hub Action")
+        self._log(INFO, "hub", "{}, Hex: {hex}", action, data=data)
+        if data[3] == 0x31:  # 0x31 = Hub Will Disconnect
+            asyncio.get_event_loop().create_task(self.disconnect())
+        self._call_hub_hooks(timestamp, 0x02, data[3], action)
+
+    def _decode_attached_io(self, data: bytearray, timestamp: int) -> None:
+        if data[4]:
+            self._log(INFO, "port", "Port {} got attached, Hex: {hex}",
+                      data[3], data=data)
+        else:
+            self._log(WARNING, "port",
+                      "Port {} got detached, this shouldn't happen. Hex: {hex}",
+                      data[3], data=data)
+
+    def _decode_port_format(self, data: bytearray, timestamp: int) -> None:
+        # Port Input Format Handshake
+        self._log(INFO, "port",
+                  "Port {} changed to mode {} with{} notifications, Hex: {hex}",
+                  data[3], data[4], 'out' if not data[9] else '', data=data)
+        self._port_notifications[data[3]] = bool(data[9])
+        for future in self._port_format_waiters.pop((data[3], data[4]), ()):
+            if not future.done():
+                future.set_result(None)
+
+    def _decode_hub_property(self, data: bytearray, timestamp: int) -> None:
+        if data[4] != 0x06:
+            self._decode_unknown(data, timestamp)
+            return
+        hub_property = HEX_TO_HUB_PROPERTIES.get(data[3], "Unknown Property")
+        payload = bytes(memoryview(data)[5:])
+        if data[3] == 0x05 and payload:  # Signal Strength
+            self._link_stats.set_rssi(signed(payload[0]))
+        if self._log_threshold <= INFO:
+            self._log(INFO, "hub", "Hub Update About {}: {}, Hex: {hex}",
+                      hub_property, payload.hex(), data=data)
+        self._call_hub_hooks(timestamp, 0x01, data[3], hub_property, payload)
+
+    def _decode_unknown(self, data: bytearray, timestamp: int) -> None:
+        self._log(INFO, "hub",
+                  "Unknown message - check Lego Wireless Protocol, Hex: {hex}",
+                  data=data)
+
+    # names of the decoders in .stats(), indexed like Mario._arrivals
+    _DECODER_KINDS = ("accelerometer", "camera", "pants", "port_3",
+                      "unknown_port", "hub_action", "attached_io",
+                      "port_format", "hub_property", "unknown")
+
+    # (message type, port) -> (decoder, index in Mario._DECODER_KINDS).
+    # Port None matches any port and is only used if there is no entry for
+    # the specific port.
+    _DECODERS: dict[tuple[int, Union[int, None]], tuple[Callable[
+                    ["Mario", bytearray, int], None], int]] = {
+        (0x45, 0x00): (_decode_accelerometer, 0),  # Port Value
+        (0x45, 0x01): (_decode_camera, 1),
+        (0x45, 0x02): (_decode_pants, 2),
+        (0x45, 0x03): (_decode_port_3, 3),
+        (0x45, None): (_decode_unknown_port, 4),
+        (0x02, None): (_decode_hub_action, 5),  # Hub Actions
+        (0x04, None): (_decode_attached_io, 6),  # Hub Attached I/O
+        (0x47, None): (_decode_port_format, 7),  # Port Input Format Handshake
+        (0x01, None): (_decode_hub_property, 8),  # Hub Properties
+    }
+    _UNKNOWN_DECODER = (_decode_unknown, 9)  # any other message type
+
+    def start(self) -> asyncio.Task:
+        """Starts .connect() in the background, unless Mario is already
+        connecting.
+
+        Returns:
+            asyncio.Task: The task running .connect().
+        """
+        if self._supervisor is None or self._supervisor.done():
+            self._supervisor = asyncio.get_event_loop().create_task(
+                self.connect())
+        return self._supervisor
+
+    def run_forever(self, main: Union[
+                        Callable[[], Awaitable[Any]], None] = None,
+                    **kwargs: Any) -> Any:
+        """Runs Mario until it stops or the program gets Ctrl+C / SIGTERM,
+        then disconnects. See mario_runtime.serve().
+
+        Args:
+            main (coroutine function, optional): Run until it returns
+                instead. Defaults to None.
+            **kwargs: Passed on to serve().
+
+        Returns:
+            Any: What main returned.
+        """
+        return serve(self, main=main, **kwargs)
+
+    async def shutdown(self) -> None:
+        """Stops reconnecting, disconnects and finishes what is still
+        queued: running hook calls, recordings and event streams."""
+        self.auto_reconnect = False
+        supervisor, self._supervisor = self._supervisor, None
+        if supervisor is not None and not supervisor.done():
+            supervisor.cancel()
+        await self.disconnect()
+        self.run = False
+        busy = []
+        for hooks in self._all_hooks:
+            for hook in hooks:
+                if isinstance(hook, RateLimitedHook):
+                    hook = hook.func
+                if isinstance(hook, OffloadedHook) and hook._task is not None:
+                    busy.append(hook._task)
+        if busy:
+            await asyncio.wait(busy)
+        for stream in list(self._event_streams):
+            stream.close()
+        self.stop_recording()
 
     async def connect(self) -> bool:
+        """Connects to a Lego Mario.
+
+        First tries to connect directly to the last connected (or a known)
+        device, then scans for one. If Mario belongs to a fleet, the fleet's
+        shared scan is used. Failed attempts are retried with exponential
+        backoff until self.retry_budget is used up. Concurrent calls wait
+        for the running one instead of connecting a second time.
+
+        Returns:
+            bool: Whether Mario is connected.
+        """
+        self._bind_loop()
+        assert self._connect_lock is not None
+        async with self._connect_lock:
+            if self.is_connected:
+                return True
+            return await self._connect_with_retries()
+
+    async def _connect_with_retries(self) -> bool:
         self.run = True
-        retries = 0
+        failures = 0
+        known = self._known_device()
         while self.run:
-            retries += 1
-            if retries > 3:
-                self.log("Stopped after 3 attempts, disconnecting...")
+            if known is not None:
+                self.log(f"Reconnecting to {known.address}...",
+                         category="connection")
+                connected = await self._connect_device(
+                    known, timeout=_DIRECT_CONNECT_TIMEOUT)
+                known = None  # if it's not there, it has to be found again
+                if connected:
+                    return True
+                continue  # scan right away
+            if self.fleet is not None:
+                connected = await self.fleet.request(self)
+            else:
+                connected = await self._connect_scan()
+            if connected:
+                return True
+            failures += 1
+            if self.retry_budget is not None and failures >= self.retry_budget:
+                self.log(f"Stopped after {failures} attempts",
+                         level=WARNING, category="connection")
                 break
-            self.log("Searching for device...")
-            try:
-                devices = await BleakScanner.discover()
-            except OSError as e:
-                raise OSError("Can't use device - make sure your device"
-                              f" supports Bluetooth and turn it on.\n{e}")
-            for d in devices:
-                if d.name and (
-                    d.name.lower().startswith("lego luigi")
-                    or
-                    d.name.lower().startswith("lego mario")
-                    or
-                    d.name.lower().startswith("lego peach")
-                    ):
-                    try:
-                        client = BleakClient(d.address)
-                        await client.connect()
-                        self.client = client
-                        self.log(f"Mario Connected: {client.address}")
-
-                        # subscribe to events
-                        await client.start_notify(
-                            LEGO_CHARACTERISTIC_UUID,
-                            self._handle_events)
-                        await asyncio.sleep(0.1)
-                        await client.write_gatt_char(
-                            LEGO_CHARACTERISTIC_UUID, 
-                            SUBSCRIBE_IMU_COMMAND)
-                        await asyncio.sleep(0.1)
-                        await client.write_gatt_char(
-                            LEGO_CHARACTERISTIC_UUID,
-                            SUBSCRIBE_RGB_COMMAND)
-                        await asyncio.sleep(0.1)
-                        await client.write_gatt_char(
-                            LEGO_CHARACTERISTIC_UUID,
-                            SUBSCRIBE_PANTS_COMMAND)
-
-                        asyncio.get_event_loop().create_task(
-                            self._check_connection_loop())
-
-                        if not self.default_volume is None: 
-                            self.set_volume(self.default_volume)
-                        return True
-                    except Exception as ex:
-                        self.log(f"Error connecting: {ex}")
-                        await self.disconnect()
-                        return False
-        await self.disconnect()
+            if not self.run:
+                break
+            delay = self._backoff_delay(failures)
+            self.log(f"Retrying in {delay:.1f}s", category="connection")
+            await asyncio.sleep(delay)
+        self.run = False
+        return False
+
+    def _known_device(self) -> Any:
+        """Device to try a direct connection to, None to scan right away.
+        Devices other Marios are connected or connecting to are skipped."""
+        taken = self._taken_addresses()
+        if self._last_address is not None:
+            if self._last_address in taken:
+                return None
+            return next((device for device in self.known_devices
+                         if device.address == self._last_address), None)
+        if self.fleet is not None:
+            return None  # the fleet assigns the devices it finds
+        return self.known_devices.find(self.device_filter, exclude=taken)
+
+    def _taken_addresses(self) -> set[str]:
+        """Addresses other Marios are connected or connecting to."""
+        return {mario._held_address for mario in registered()
+                if mario is not self} - {None}
+
+    @property
+    def _held_address(self) -> Union[str, None]:
+        """Address of the device Mario is connected or connecting to."""
+        if self.client is not None:
+            return self.client.address
+        return self._connecting_to
+
+    def _backoff_delay(self, failures: int) -> float:
+        """Exponential backoff with jitter after the given number of failed
+        attempts."""
+        initial, maximum = self.reconnect_backoff
+        delay = min(initial * 2 ** (failures - 1), maximum)
+        return delay * random.uniform(0.5, 1.5)
+
+    async def _connect_scan(self) -> bool:
+        """Scans for a Mario and connects to the first one found."""
+        self.log("Searching for device...", category="connection")
+        try:
+            # connects as soon as the first advertisement is seen
+            devices = await scan(self.transport, self.device_filter,
+                                 exclude=self._taken_addresses())
+        except OSError as e:
+            raise OSError("Can't use device - make sure your device"
+                          f" supports Bluetooth and turn it on.\n{e}")
+        for d in devices:
+            return await self._connect_device(d)
         return False
 
+    async def _connect_device(self, device: Any,
+                              timeout: Union[float, None] = None) -> bool:
+        """Connects to a discovered device and subscribes to its ports.
+
+        Args:
+            device (BLEDevice | KnownDevice): The device, must have an
+                .address.
+            timeout (float, optional): Timeout of the connection attempt.
+                Defaults to None (the transport's default).
+
+        Returns:
+            bool: Whether connecting succeeded. If not, self.client is None.
+        """
+        client = None
+        self._bind_loop()
+        self._connecting_to = device.address
+        try:
+            client = self.transport.client(
+                device.address,
+                disconnected_callback=self._on_client_disconnected)
+            if timeout is None:
+                await client.connect()
+            else:
+                await client.connect(timeout=timeout)
+            self.client = client
+            self._writer = WriteQueue(client, LEGO_CHARACTERISTIC_UUID)
+            self._last_address = device.address
+            # the file is written in an executor, not on the event loop
+            self.known_devices.remember(device.address, device.name,
+                                        save=False)
+            asyncio.get_running_loop().run_in_executor(
+                None, self.known_devices.save)
+            self.log(f"Mario Connected: {client.address}",
+                     category="connection")
+
+            # subscribe to events, each step waits for Mario's acknowledgement
+            await client.start_notify(
+                LEGO_CHARACTERISTIC_UUID,
+                self._handle_events)
+            start = time.monotonic()
+            imu_command = pifs_command(
+                0, 0, delta_interval=self.imu_delta_interval)
+            for command in (imu_command, SUBSCRIBE_RGB_COMMAND,
+                            SUBSCRIBE_PANTS_COMMAND):
+                if not await self._write_port_format(command):
+                    raise asyncio.TimeoutError(
+                        f"Port {command[3]} setup was not acknowledged")
+            self.handshake_time = time.monotonic() - start
+            self.log(f"Ports set up in {self.handshake_time * 1000:.0f} ms",
+                     category="connection")
+
+            assert self._connected is not None
+            self._connected.set()
+            self._link_stats.connected()
+            self.request_rssi()
+
+            if not self.default_volume is None: 
+                self.set_volume(self.default_volume)
+            return True
+        except Exception as ex:
+            self.log(f"Error connecting: {ex}", level=WARNING,
+                     category="connection")
+            self.client = None
+            self._close_writer()
+            if client is not None and client.is_connected:
+                try:
+                    await client.disconnect()
+                except (OSError, BleakError):
+                    pass
+            return False
+        finally:
+            self._connecting_to = None
+
     async def request_port_value(self, port:int=0) -> None:
         """Method for sending request for color sensor port value to Mario.
         Default port is 0.
@@ -475,7 +1284,8 @@ class Mario:
         3 - unknown
         4 - unknown
         6 - voltage?
-        Response will be sent to event handlers.
+        Response will be sent to event handlers. Use .read_port() to wait for
+        the response instead.
 
         Args:
             port (int, optional): Port to request value from. Defaults to 0.
@@ -483,15 +1293,167 @@ class Mario:
         assert port in (0,1,2,3,4,6), "Use a supported port (0,1,2,3,4,6)"
         if self.client:
             try:
-                command = REQUEST_RGB_COMMAND
-                command[3] = port
-                command = bytearray(command)
-                await self.client.write_gatt_char(LEGO_CHARACTERISTIC_UUID,
-                                                  command)
+                # requests of the same port that weren't sent yet are merged
+                await self._write(port_request_command(port),
+                                  key=("request", port))
             except (OSError, BleakError):
-                self.log("Connection error while requesting port value")
+                self.log("Connection error while requesting port value",
+                         level=WARNING, category="connection")
                 await self.disconnect()
 
+    async def read_port(self, port: int = 0, timeout: float = 1.0
+                        ) -> Union[MarioEvent, bytes]:
+        """Requests the value of one of Mario's ports and waits for it.
+        Reads of different ports can run concurrently, concurrent reads of
+        the same port share one request. Like with .request_port_value(),
+        the response is also sent to the hooks.
+
+        Example:
+            pants = await mario.read_port(2)
+            print(pants.name)
+
+        Args:
+            port (int, optional): Port to read, see .request_port_value().
+                Defaults to 0.
+            timeout (float, optional): Seconds to wait for the value.
+                Defaults to 1.0.
+
+        Returns:
+            MarioEvent | bytes: The event of the value (AccelEvent for port
+                0, TileEvent or ColorEvent for port 1, PantsEvent for port 2),
+                the raw payload for other ports or values without an event.
+
+        Raises:
+            ValueError: If the port isn't supported.
+            BleakError: If Mario isn't connected or disconnects while reading.
+            asyncio.TimeoutError: If Mario didn't send the value in time.
+        """
+        if port not in (0, 1, 2, 3, 4, 6):
+            raise ValueError("Invalid Port, expected one of (0,1,2,3,4,6) "
+                             f"got {port}")
+        future = self.start_port_read(port)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.discard_port_read(port, future)
+
+    def poll_ports(self, rates: dict[int, float],
+                   disable_notifications: bool = True) -> PortPoller:
+        """Requests the values of ports at fixed rates, e.g.
+        mario.poll_ports({0: 20, 2: 1}) for the accelerometer at 20 Hz and
+        the pants at 1 Hz. The values are sent to the hooks as usual.
+
+        Args:
+            rates (dict[int, float]): Port -> samples per second.
+            disable_notifications (bool, optional): Set the polled ports up
+                without notifications on every connection, so only the
+                polled values are sent. Defaults to True.
+
+        Returns:
+            PortPoller: The started poller. Use .stats() for the achieved
+                rates and await .stop() to stop polling.
+        """
+        poller = PortPoller(self, rates, disable_notifications)
+        poller.start()
+        return poller
+
+    def tune_delta_interval(self, max_rate: float = 50.0,
+                            max_lag: float = 0.02,
+                            max_cpu: Union[float, None] = None,
+                            **kwargs: Any) -> DeltaIntervalTuner:
+        """Adjusts .imu_delta_interval while Mario is connected, so that
+        the accelerometer notifications stay within the budget.
+
+        Args:
+            max_rate (float, optional): Maximum accelerometer notifications
+                per second. Defaults to 50.0.
+            max_lag (float, optional): Maximum event loop delay in seconds.
+                Defaults to 0.02.
+            max_cpu (float, optional): Maximum CPU time of the process per
+                second. Defaults to None (ignore CPU time).
+            **kwargs: Passed on to DeltaIntervalTuner.
+
+        Returns:
+            DeltaIntervalTuner: The started tuner. Use .stats() for its
+                measurements and await .stop() to stop tuning.
+        """
+        tuner = DeltaIntervalTuner(self, max_rate, max_lag, max_cpu,
+                                   **kwargs)
+        tuner.start()
+        return tuner
+
+    def start_port_read(self, port: int) -> asyncio.Future:
+        """Queues a request for the value of port without waiting for it.
+        Used by .read_port() and PortPoller.
+
+        Args:
+            port (int): Port to read, see .request_port_value().
+
+        Returns:
+            asyncio.Future: Resolved with the next value of the port, see
+                .read_port(). Raises BleakError if the request can't be
+                written. Discard it with .discard_port_read() if you stop
+                waiting for it.
+        """
+        if self._writer is None:
+            raise BleakError("Not connected")
+        future = asyncio.get_event_loop().create_future()
+        self._port_value_waiters.setdefault(port, []).append(future)
+        # requests of the same port that weren't sent yet are merged
+        written = self._writer.submit(port_request_command(port),
+                                      key=("request", port))
+
+        def check_written(written: asyncio.Future) -> None:
+            if (not written.cancelled() and written.exception() is not None
+                    and not future.done()):
+                future.set_exception(written.exception())
+        written.add_done_callback(check_written)
+        return future
+
+    def discard_port_read(self, port: int, future: asyncio.Future) -> None:
+        """Stops waiting for a value requested with .start_port_read().
+
+        Args:
+            port (int): The port of the read.
+            future (asyncio.Future): The future .start_port_read() returned.
+        """
+        waiters = self._port_value_waiters.get(port)
+        if waiters is not None and future in waiters:  # not resolved
+            waiters.remove(future)
+            if not waiters:
+                del self._port_value_waiters[port]
+
+    def port_notifications(self, port: int) -> bool:
+        """Whether Mario sends notifications for port, as acknowledged by
+        Mario for the last setup of the port. Ports that weren't set up yet
+        count as on.
+
+        Args:
+            port (int): The port.
+
+        Returns:
+            bool: Whether notifications are on.
+        """
+        return self._port_notifications.get(port, True)
+
+    def _resolve_port_reads(self, data: bytearray,
+                            event: Union[MarioEvent, None]) -> None:
+        """Passes a Port Value message to the reads waiting for its port."""
+        waiters = self._port_value_waiters.pop(data[3], None)
+        if not waiters:
+            return
+        value = event if event is not None else bytes(memoryview(data)[4:])
+        for future in waiters:
+            if not future.done():
+                future.set_result(value)
+
+    def _fail_port_reads(self) -> None:
+        waiters, self._port_value_waiters = self._port_value_waiters, {}
+        for futures in waiters.values():
+            for future in futures:
+                if not future.done():
+                    future.set_exception(BleakError("Not connected"))
+
     def set_volume(self, new_volume: int) -> None:
         """Sets mario's volume to the specified volume.
 
@@ -499,20 +1461,23 @@ class Mario:
             new_volume (int): Percentage of maximum volume. 
                 Values <0 or >100 will be set to 0 or 100 respectively."""
         new_volume = min(max(new_volume, 0), 100)
-        if self.client:
-            try:
-                command = bytearray([*MUTE_COMMAND[:5], new_volume])
-                asyncio.get_event_loop().create_task(
-                    self.client.write_gatt_char(
-                        LEGO_CHARACTERISTIC_UUID,
-                        command)
-                    )
-            except (OSError, BleakError):
-                self.log("Connection error while setting volume")
-                asyncio.get_event_loop().create_task(self.disconnect())
+        if self.client and self._writer:
+            command = bytearray([*MUTE_COMMAND[:5], new_volume])
+            # only the latest volume is sent if earlier ones are still queued
+            self._writer.submit(command, key="volume").add_done_callback(
+                self._on_volume_written)
+
+    def _on_volume_written(self, future: asyncio.Future) -> None:
+        if future.cancelled() or future.exception() is None:
+            return
+        if self._writer is not None:  # not a write discarded on disconnect
+            self.log("Connection error while setting volume",
+                     level=WARNING, category="connection")
+            asyncio.get_event_loop().create_task(self.disconnect())
 
     async def port_setup(self, port: int, mode: int,
-                         notifications: bool= True) -> None:
+                         notifications: bool= True,
+                         delta_interval: int = 1) -> bool:
         """Configures the settings of one of Mario's ports.
         Sends a message to Mario that configures the way one of its ports
         communicates.
@@ -535,60 +1500,201 @@ class Mario:
         notifications (bool, optional): Whether to receive updates about
             new values of the port. Defaults to True.
             If False, you'll need to manually request port values.
+        delta_interval (int, optional): Change of the value needed for a
+            new notification. Defaults to 1.
+
+        Returns:
+            bool: Whether Mario acknowledged the new settings.
         """
         await self.await_connection()
         if self.client:
             try:
-                command = pifs_command(port, mode, notifications)
-                await self.client.write_gatt_char(LEGO_CHARACTERISTIC_UUID,
-                                                  command)
+                command = pifs_command(port, mode, notifications,
+                                       delta_interval)
+                return await self._write_port_format(command)
             except (OSError, BleakError):
-                self.log("Connection error while setting up port")
+                self.log("Connection error while setting up port",
+                         level=WARNING, category="connection")
                 await self.disconnect()
+        return False
+
+    async def _write_port_format(self, command: bytearray,
+                                 timeout: float = _HANDSHAKE_TIMEOUT,
+                                 retries: int = _HANDSHAKE_RETRIES) -> bool:
+        """Sends a Port Input Format Setup and waits for the matching
+        Port Input Format Handshake.
+
+        Args:
+            command (bytearray): The setup, see pifs_command().
+            timeout (float, optional): Seconds to wait per attempt.
+            retries (int, optional): Number of times the setup is resent if
+                it isn't acknowledged.
 
-    async def _check_connection_loop(self) -> None:
-        while self.client:
+        Returns:
+            bool: Whether Mario acknowledged the setup.
+        """
+        key = (command[3], command[4])  # port, mode
+        loop = asyncio.get_event_loop()
+        for attempt in range(retries + 1):
+            future = loop.create_future()
+            waiters = self._port_format_waiters.setdefault(key, [])
+            waiters.append(future)
             try:
-                if not self.client.is_connected:
-                    self.log("Disconnect detected during connection check")
-                    await self.disconnect()
-                await asyncio.sleep(3)
-            except (OSError, BleakError):
-                self.log("Error during connection check")
-                await self.disconnect()
+                await self._write(command)
+                await asyncio.wait_for(future, timeout)
+                return True
+            except asyncio.TimeoutError:
+                self.log(f"Port {key[0]} setup not acknowledged "
+                         f"(attempt {attempt + 1})", level=WARNING,
+                         category="connection")
+            finally:
+                if future in waiters:
+                    waiters.remove(future)
+        return False
 
-    async def disconnect(self) -> None:
-        try:
-            self.log("Disconnecting... ")
-            if self.client:
-                await self.client.write_gatt_char(LEGO_CHARACTERISTIC_UUID,
-                                                   DISCONNECT_COMMAND)
-                await self.client.disconnect()
-                self.client = None
-        except (OSError, BleakError):
-            self.log("Connection error while disconnecting")
-            self.client = None
-        if self.auto_reconnect:
-            asyncio.get_event_loop().create_task(self.connect())
+    async def _write(self, command: Union[bytes, bytearray],
+                     key: Any = None, response: bool = False) -> None:
+        """Sends a command through the write queue of the connection.
+
+        Args:
+            command (bytes | bytearray): The command.
+            key (Hashable, optional): Queued commands with the same key are
+                replaced by newer ones. Defaults to None.
+            response (bool, optional): Write with response.
+                Defaults to False.
+
+        Raises:
+            BleakError: If Mario isn't connected or the write failed.
+        """
+        if self._writer is None:
+            raise BleakError("Not connected")
+        await self._writer.write(command, key, response)
+
+    def _close_writer(self) -> None:
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.close()
+
+    def write_stats(self) -> Union[dict[str, Any], None]:
+        """Counters, queue depth and write latency of the commands sent over
+        the current connection, see WriteQueue.stats.
+
+        Returns:
+            dict | None: The statistics, None if not connected.
+        """
+        return self._writer.stats if self._writer is not None else None
+
+    def request_rssi(self) -> None:
+        """Asks Mario for its signal strength. The answer is sent to the hub
+        hooks and shows up in .stats()."""
+        if self._writer is not None:
+            self._writer.submit(RSSI_REQUEST_COMMAND, key="rssi")
+
+    def stats(self) -> dict[str, Any]:
+        """Snapshot of what Mario is doing. Cheap enough to call every
+        frame, the counters are on unless Mario was created with
+        collect_stats=False.
+
+        Returns:
+            dict: With the keys
+                connected: whether Mario is connected,
+                notifications: per kind of notification (e.g. "accelerometer",
+                    "camera", "unknown") the count, and rate_hz,
+                    interval_ms and jitter_ms over the last 64 of them,
+                notifications_total: sum over all kinds,
+                unknown: notifications that weren't understood,
+                undecodable: notifications whose decoding raised an error,
+                hook_errors: notifications for which a synchronous hook
+                    raised an error,
+                connections, reconnects, reconnect_last_s, reconnect_mean_s:
+                    successful connections and how long it took to
+                    reconnect after a connection ended,
+                handshake_ms: duration of the last port setup,
+                imu_delta_interval: current delta interval of the
+                    accelerometer,
+                rssi, rssi_age_s: last reported signal strength in dBm and
+                    its age, None if unknown (see .request_rssi()),
+                writes: see .write_stats(), None if not connected,
+                hooks: .hook_stats() by hook name.
+        """
+        stats = self._link_stats.snapshot()
+        stats["connected"] = self.is_connected
+        stats["handshake_ms"] = (round(self.handshake_time * 1000, 1)
+                                 if self.handshake_time is not None else None)
+        stats["imu_delta_interval"] = self.imu_delta_interval
+        stats["writes"] = self.write_stats()
+        stats["hooks"] = {getattr(func, "__qualname__", repr(func)): counters
+                          for func, counters in self.hook_stats().items()}
+        return stats
+
+    def _on_client_disconnected(self, client: Any) -> None:
+        """Called by the bluetooth client as soon as the connection is lost.
+        """
+        if client is not self.client:
+            return  # closed by .disconnect() or an old connection
+        self.log("Disconnect detected", category="connection")
+        self.client = None
+        self._close_writer()
+        self._connection_ended()
+
+    def _connection_ended(self) -> None:
+        """Calls the disconnect hooks and starts reconnecting, if enabled."""
+        if self._connected is not None:
+            self._connected.clear()
+        self._link_stats.disconnected()
+        self._fail_port_reads()
+        for func in self._disconnect_hooks:
+            # a failing hook must not stop the reconnect
+            try:
+                func(self)
+            except Exception as e:
+                self.log(f"Error in disconnect hook {func!r}: {e!r}",
+                         level=ERROR, category="connection")
+        if not self.auto_reconnect:
+            self.run = False
         else:
+            self.start()
+
+    async def disconnect(self) -> None:
+        """Closes the connection. Reconnects afterwards if
+        self.auto_reconnect is set."""
+        self.log("Disconnecting... ", category="connection")
+        client, self.client = self.client, None
+        writer, self._writer = self._writer, None
+        if client:
+            try:
+                if writer is not None:
+                    # after the commands that are still queued
+                    await writer.write(DISCONNECT_COMMAND, response=True)
+                await client.disconnect()
+            except (OSError, BleakError):
+                self.log("Connection error while disconnecting",
+                         level=WARNING, category="connection")
+            finally:
+                if writer is not None:
+                    writer.close()
+            self._connection_ended()
+        elif not self.auto_reconnect:
             self.run = False
 
     async def turn_off(self) -> None:
         if not self.client:
             return
         try:
-            self.log("Turning Off... ")
-            await self.client.write_gatt_char(LEGO_CHARACTERISTIC_UUID,
-                                               TURN_OFF_COMMAND)
+            self.log("Turning Off... ", category="connection")
+            await self._write(TURN_OFF_COMMAND, response=True)
             await self.disconnect()
         except (OSError, BleakError):
-            self.log("Connection error while turning off")
+            self.log("Connection error while turning off",
+                     level=WARNING, category="connection")
             await self.disconnect()
 
     async def await_connection(self):
+        self._bind_loop()
+        assert self._connected is not None
         while not self.is_connected:
-            await asyncio.sleep(0.5)
-        return
+            self._connected.clear()
+            await self._connected.wait()
 
     @property
     def is_connected(self):
@@ -605,10 +1711,3 @@ class Mario:
 
 def signed(char):
     return char - 256 if char > 127 else char
-
-def run():
-    """Runs the asyncio event loop until until all tasks are done.
-    """
-    while asyncio.all_tasks(loop=asyncio.get_event_loop()):
-        asyncio.get_event_loop().run_until_complete(asyncio.gather(
-            *asyncio.all_tasks(loop=asyncio.get_event_loop())))
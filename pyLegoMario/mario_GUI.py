@@ -5,9 +5,13 @@ import asyncio
 from PIL import ImageTk, Image
 try:
     from .mario import Mario
+    from .mario_events import INFO
+    from .mario_runtime import start_soon
     from .lego_mario_data import *
 except ImportError:
     from mario import Mario
+    from mario_events import INFO
+    from mario_runtime import start_soon
     from lego_mario_data import *
 
 class MarioWindow(tk.Frame):
@@ -63,8 +67,9 @@ class MarioWindow(tk.Frame):
         self.x_acceleration_box.grid(row=1, column=0)
         self.y_acceleration_box.grid(row=1, column=1)
         self.z_acceleration_box.grid(row=1, column=2)
-        # Hook Fields to Mario
-        self.mario.add_accelerometer_hooks(self._input_acceleration_data)
+        # Hook Fields to Mario, no need to update faster than the window
+        self.mario.add_accelerometer_hooks(self._input_acceleration_data,
+                                           max_rate=20)
         # End Acceleration Data
 
         # Start Pants Data
@@ -117,7 +122,8 @@ class MarioWindow(tk.Frame):
         self.logText = tk.StringVar()
         self.logBox = tk.Text(self, state=tk.DISABLED, width=80)
         self.logBox.grid(row=1, columnspan=6, sticky=tk.NSEW)
-        self.mario.add_log_hooks(self._input_log_data)
+        # raw acceleration data is logged as DEBUG and not displayed
+        self.mario.add_log_hooks(self._input_log_data, level=INFO)
 
         # Start Buttons
         # Button Container
@@ -189,8 +195,9 @@ class MarioWindow(tk.Frame):
         self.portFrame.grid(row=2, column=3)
         self.request_port_button.grid(row=1, column=2)
 
-        # display and update the window
-        asyncio.get_event_loop().create_task(self._run_window())
+        # display and update the window as soon as the event loop runs
+        start_soon(lambda: asyncio.get_event_loop().create_task(
+            self._run_window()))
 
     def _update_mode_menu(self) -> None:
         """Update the port mode menu with the available port modes for the
@@ -222,7 +229,7 @@ class MarioWindow(tk.Frame):
         connected. Passes otherwise (e.g. running but not connected yet)
         """
         if not self.mario.run:
-            asyncio.create_task(self.mario.connect())
+            self.mario.start()
         elif self.mario.client:
             asyncio.create_task(self.mario.disconnect())
 
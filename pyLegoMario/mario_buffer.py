@@ -0,0 +1,95 @@
+"""
+mario_buffer.py
+This file implements AccelerationBuffer, a preallocated NumPy ring buffer that
+keeps the most recent accelerometer samples of a Mario, so they can be
+analyzed vectorized instead of sample by sample.
+Requires numpy.
+Copyright (c) 2022 Jamin Kauf
+"""
+from typing import Union
+import numpy as np
+
+
+class AccelerationBuffer:
+    """Fixed-capacity ring buffer of (timestamp, x, y, z) samples.
+
+    Every sample is written twice, at its index and at its index + capacity.
+    That way, the most recent n <= capacity samples are always stored in one
+    contiguous block, and last() and since() can return views instead of
+    copies. The views are overwritten by new samples - copy them if you need
+    to keep them.
+
+    Attributes
+    ----------
+    capacity: int
+        Maximum number of samples in the buffer.
+    total: int
+        Number of samples appended since creation (or the last clear()).
+    """
+    def __init__(self, capacity: int = 1024) -> None:
+        """
+        Args:
+            capacity (int, optional): Maximum number of samples to keep.
+                Defaults to 1024.
+        """
+        if capacity < 1:
+            raise ValueError(f"Capacity must be at least 1, got {capacity}")
+        self.capacity = int(capacity)
+        self.total = 0
+        self._head = 0  # index of the next write, 0 <= head < capacity
+        self._timestamps = np.zeros(2 * self.capacity, dtype=np.int64)
+        self._values = np.zeros((2 * self.capacity, 3), dtype=np.int16)
+
+    def append(self, timestamp: int, x: int, y: int, z: int) -> None:
+        """Adds a sample, overwriting the oldest one if the buffer is full.
+
+        Args:
+            timestamp (int): time.monotonic_ns() of the sample.
+            x (int): acceleration in x direction
+            y (int): acceleration in y direction
+            z (int): acceleration in z direction
+        """
+        head = self._head
+        mirror = head + self.capacity
+        self._timestamps[head] = self._timestamps[mirror] = timestamp
+        self._values[head] = self._values[mirror] = (x, y, z)
+        self._head = head + 1 if head + 1 < self.capacity else 0
+        self.total += 1
+
+    def __len__(self) -> int:
+        return min(self.total, self.capacity)
+
+    def last(self, n: Union[int, None] = None
+             ) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the most recent samples, oldest first.
+
+        Args:
+            n (int, optional): Number of samples. Limited to the number of
+                samples in the buffer. Defaults to all samples.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Views of the timestamps (shape (n,),
+                int64) and of the x, y, z values (shape (n, 3), int16).
+        """
+        size = len(self)
+        n = size if n is None else max(0, min(int(n), size))
+        end = self._head + self.capacity
+        return self._timestamps[end - n:end], self._values[end - n:end]
+
+    def since(self, timestamp: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns all samples that were received at or after timestamp.
+
+        Args:
+            timestamp (int): time.monotonic_ns() value.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Views like in last().
+        """
+        timestamps, values = self.last()
+        start = int(np.searchsorted(timestamps, timestamp, side="left"))
+        return timestamps[start:], values[start:]
+
+    def clear(self) -> None:
+        """Removes all samples."""
+        self.total = 0
+        self._head = 0
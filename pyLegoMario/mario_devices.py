@@ -0,0 +1,212 @@
+"""
+mario_devices.py
+This file implements KnownDevices, a small cache of the Marios that were
+connected before. Mario uses it to reconnect directly to a known address
+instead of scanning first. The cache is a JSON file, by default
+~/.pyLegoMario/known_devices.json, so it survives restarts. Every Mario has
+its own KnownDevices, so saving merges with the file instead of replacing
+it.
+Copyright (c) 2022 Jamin Kauf
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Iterator, Union
+
+DEFAULT_PATH = Path.home() / ".pyLegoMario" / "known_devices.json"
+
+
+class KnownDevice:
+    """A Mario that was connected before. Has .address and .name like a
+    discovered device, so it can be passed to device filters and
+    Mario._connect_device().
+
+    Attributes
+    ----------
+    address: str
+        Bluetooth address.
+    name: str | None
+        Advertised name.
+    last_connected: float
+        time.time() of the last successful connection.
+    connections: int
+        Number of successful connections.
+    """
+    __slots__ = ("address", "name", "last_connected", "connections")
+
+    def __init__(self, address: str, name: Union[str, None] = None,
+                 last_connected: float = 0.0, connections: int = 0) -> None:
+        self.address = address
+        self.name = name
+        self.last_connected = last_connected
+        self.connections = connections
+
+    def to_json(self) -> dict[str, Any]:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    def __repr__(self) -> str:
+        return (f"KnownDevice({self.address!r}, name={self.name!r}, "
+                f"connections={self.connections})")
+
+
+class KnownDevices:
+    """Addresses and metadata of previously connected Marios.
+
+    Attributes
+    ----------
+    path: Path | None
+        The JSON file. None keeps the cache in memory only.
+    """
+    def __init__(self, path: Union[str, Path, None] = DEFAULT_PATH) -> None:
+        """
+        Args:
+            path (str | Path | None, optional): JSON file to load from and
+                save to. None keeps the cache in memory only.
+                Defaults to ~/.pyLegoMario/known_devices.json.
+        """
+        self.path = Path(path) if path is not None else None
+        self._devices: dict[str, KnownDevice] = {}
+        # changes since the last save, applied to the file's devices
+        self._remembered: set[str] = set()
+        self._forgotten: set[str] = set()
+        # .save() may run in an executor, one at a time
+        self._lock = threading.Lock()
+        self.load()
+
+    def _read(self) -> Union[dict[str, KnownDevice], None]:
+        """The devices in the cache file, None if it is missing or broken."""
+        if self.path is None:
+            return None
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+            return {entry["address"]: KnownDevice(**entry)
+                    for entry in entries}
+        except (OSError, ValueError, TypeError, KeyError):
+            return None
+
+    def load(self) -> None:
+        """Reads the cache file. A missing or broken file is ignored."""
+        devices = self._read()
+        if devices is not None:
+            self._devices = devices
+
+    def _merge(self) -> None:
+        """Applies the changes since the last save to the devices in the
+        file, so changes saved by others in the meantime are kept."""
+        devices = self._read()
+        if devices is None:
+            return
+        for address in self._forgotten:
+            devices.pop(address, None)
+        for address in self._remembered:
+            device = self._devices.get(address)
+            saved = devices.get(address)
+            if device is not None and (
+                    saved is None
+                    or device.last_connected >= saved.last_connected):
+                devices[address] = device
+        self._devices = devices
+
+    def save(self) -> None:
+        """Merges the cache with the file (see above) and writes it. The
+        file is replaced atomically, so other programs never read half a
+        file. Safe to call from another thread, e.g. an executor."""
+        if self.path is None:
+            return
+        with self._lock:
+            self._merge()
+            temp_path = None
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                fd, temp_path = tempfile.mkstemp(dir=self.path.parent,
+                                                 suffix=".tmp")
+                with os.fdopen(fd, "w") as f:
+                    json.dump([device.to_json() for device in self], f,
+                              indent=1)
+                os.replace(temp_path, self.path)
+                self._remembered.clear()
+                self._forgotten.clear()
+            except OSError:
+                # the cache is only an optimization, but don't leave
+                # temporary files behind
+                if temp_path is not None:
+                    try:
+                        os.unlink(temp_path)
+                    except OSError:
+                        pass
+
+    def remember(self, address: str, name: Union[str, None] = None,
+                 save: bool = True) -> KnownDevice:
+        """Records a successful connection and saves the cache.
+
+        Args:
+            address (str): Bluetooth address.
+            name (str, optional): Advertised name. Defaults to None
+                (keep the known name).
+            save (bool, optional): Save the cache right away. Pass False
+                to call .save() yourself, e.g. in an executor.
+                Defaults to True.
+
+        Returns:
+            KnownDevice: The updated entry.
+        """
+        with self._lock:
+            self._forgotten.discard(address)
+            self._remembered.add(address)
+            device = self._devices.get(address)
+            if device is None:
+                device = self._devices[address] = KnownDevice(address)
+            device.name = name or device.name
+            device.last_connected = time.time()
+            device.connections += 1
+        if save:
+            self.save()
+        return device
+
+    def forget(self, address: str) -> None:
+        """Removes a device from the cache and saves it."""
+        with self._lock:
+            self._forgotten.add(address)
+            self._remembered.discard(address)
+            removed = self._devices.pop(address, None) is not None
+        if removed:
+            self.save()
+
+    def find(self, device_filter: Union[
+                 Callable[[Any, Any], bool], None] = None,
+             exclude: Union[set[str], None] = None
+             ) -> Union[KnownDevice, None]:
+        """The most recently connected device that matches the filter.
+
+        Args:
+            device_filter (function, optional): Takes (device, advertisement
+                data), advertisement data will be None. Defaults to None
+                (any device).
+            exclude (set[str], optional): Addresses to skip, e.g. of
+                devices that are already connected. Defaults to None.
+
+        Returns:
+            KnownDevice | None: The device, None if no device matches.
+        """
+        for device in self:
+            if exclude and device.address in exclude:
+                continue
+            if device_filter is None or device_filter(device, None):
+                return device
+        return None
+
+    def __iter__(self) -> Iterator[KnownDevice]:
+        """Iterates from the most to the least recently connected device."""
+        return iter(sorted(self._devices.values(),
+                           key=lambda device: device.last_connected,
+                           reverse=True))
+
+    def __len__(self) -> int:
+        return len(self._devices)
+
+    def __contains__(self, address: object) -> bool:
+        return address in self._devices
@@ -0,0 +1,309 @@
+"""
+mario_events.py
+This file implements the objects Mario hands to its hooks: LogRecord, a
+structured log message that is only rendered to a string when a sink actually
+needs it, the typed, timestamped events Mario's decoder produces for every
+notification, and EventStream, which lets asyncio code consume those events
+with "async for".
+Copyright (c) 2022 Jamin Kauf
+"""
+import asyncio
+from collections import deque
+from logging import DEBUG, INFO, WARNING, ERROR
+from typing import Any, Callable, Iterable, Union
+
+# Log level that no sink listens to, used when logging is disabled completely
+NO_LOGGING = ERROR + 100
+
+
+class LogRecord:
+    """A single log message of Mario.
+
+    The message is stored as a format string and its arguments and only
+    rendered (once) when .msg is accessed. "{hex}" in the format string is
+    replaced with the hex representation of .data.
+
+    Attributes
+    ----------
+    level: int
+        Severity of the message, same values as the logging module
+        (DEBUG, INFO, WARNING, ERROR).
+    category: str
+        What the message is about, e.g. "accelerometer", "camera", "pants",
+        "port", "hub" or "connection".
+    data: bytearray | None
+        The raw notification the message is about, if any.
+    """
+    __slots__ = ("level", "category", "data", "_fmt", "_args", "_msg")
+
+    def __init__(self, level: int, category: str, fmt: str,
+                 args: Union[tuple[Any, ...], None] = None,
+                 data: Union[bytearray, bytes, None] = None) -> None:
+        """
+        Args:
+            level (int): Severity of the message.
+            category (str): What the message is about.
+            fmt (str): The message. If args is None, it is used as is,
+                otherwise it is formatted with str.format(*args, hex=...).
+            args (tuple, optional): Arguments for fmt. Defaults to None.
+            data (bytearray, optional): Raw notification. Defaults to None.
+        """
+        self.level = level
+        self.category = category
+        self.data = data
+        self._fmt = fmt
+        self._args = args
+        self._msg = fmt if args is None else None
+
+    @property
+    def msg(self) -> str:
+        """The rendered message."""
+        if self._msg is None:
+            self._msg = self._fmt.format(*self._args, hex=self.hex)
+        return self._msg
+
+    @property
+    def hex(self) -> str:
+        """Hex representation of the raw notification ("" if there is none)."""
+        return "" if self.data is None else self.data.hex()
+
+    def __str__(self) -> str:
+        return self.msg
+
+    def __repr__(self) -> str:
+        return f"LogRecord({self.level}, {self.category!r}, {self.msg!r})"
+
+
+class MarioEvent:
+    """Base class of all decoded notifications of Mario.
+
+    Attributes
+    ----------
+    timestamp: int
+        time.monotonic_ns() at the moment the notification was received.
+    """
+    __slots__ = ("timestamp",)
+
+    def __init__(self, timestamp: int) -> None:
+        self.timestamp = timestamp
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}"
+                           for cls in reversed(type(self).__mro__)
+                           for name in getattr(cls, "__slots__", ()))
+        return f"{type(self).__name__}({fields})"
+
+
+class TileEvent(MarioEvent):
+    """Mario's camera scanned an RGB code (a tile).
+
+    Attributes
+    ----------
+    code: int
+        The 4 byte tile code, see lego_mario_data.HEX_TO_RGB_TILE.
+    name: str
+        Name of the tile.
+    """
+    __slots__ = ("code", "name")
+
+    def __init__(self, timestamp: int, code: int, name: str) -> None:
+        self.timestamp = timestamp
+        self.code = code
+        self.name = name
+
+
+class ColorEvent(MarioEvent):
+    """Mario's camera sees a ground color.
+
+    Attributes
+    ----------
+    code: int
+        The color code, see lego_mario_data.HEX_TO_COLOR_TILE.
+    name: str
+        Name of the color.
+    """
+    __slots__ = ("code", "name")
+
+    def __init__(self, timestamp: int, code: int, name: str) -> None:
+        self.timestamp = timestamp
+        self.code = code
+        self.name = name
+
+
+class AccelEvent(MarioEvent):
+    """New accelerometer values (raw mode).
+
+    Attributes
+    ----------
+    x: int
+    y: int
+    z: int
+        Acceleration in each direction, -128 to 127.
+    """
+    __slots__ = ("x", "y", "z")
+
+    def __init__(self, timestamp: int, x: int, y: int, z: int) -> None:
+        self.timestamp = timestamp
+        self.x = x
+        self.y = y
+        self.z = z
+
+
+class PantsEvent(MarioEvent):
+    """Mario put on new pants.
+
+    Attributes
+    ----------
+    bits: int
+        Raw value of the pants pins, see lego_mario_data.HEX_TO_PANTS.
+    name: str
+        Name of the pants.
+    """
+    __slots__ = ("bits", "name")
+
+    def __init__(self, timestamp: int, bits: int, name: str) -> None:
+        self.timestamp = timestamp
+        self.bits = bits
+        self.name = name
+
+
+class HubEvent(MarioEvent):
+    """Hub action or hub property update sent by Mario.
+
+    Attributes
+    ----------
+    message_type: int
+        0x02 for hub actions, 0x01 for hub property updates.
+    code: int
+        The action or property, see lego_mario_data.HEX_TO_HUB_ACTIONS and
+        lego_mario_data.HEX_TO_HUB_PROPERTIES.
+    name: str
+        Name of the action or property.
+    payload: bytes
+        Value of the property update, empty for hub actions.
+    """
+    __slots__ = ("message_type", "code", "name", "payload")
+
+    def __init__(self, timestamp: int, message_type: int, code: int,
+                 name: str, payload: bytes = b"") -> None:
+        self.timestamp = timestamp
+        self.message_type = message_type
+        self.code = code
+        self.name = name
+        self.payload = payload
+
+
+# All event types, in the order they are documented
+EVENT_TYPES = (TileEvent, ColorEvent, AccelEvent, PantsEvent, HubEvent)
+
+
+class EventStream:
+    """Async iterator over the events of a Mario, see Mario.events().
+
+    Events are buffered in a bounded asyncio.Queue, so the consumer can take
+    them at its own pace. What happens when the queue is full depends on
+    overflow:
+        "drop_oldest": the oldest queued event is discarded.
+        "drop_newest": the new event is discarded.
+        "block": nothing is discarded while the consumer keeps up.
+            Notifications can't be paused, so events that don't fit into
+            the queue wait in a backlog of at most max_backlog events and
+            are moved into the queue as the consumer catches up. If the
+            backlog is full too, new events are discarded.
+
+    Attributes
+    ----------
+    kinds: tuple[type[MarioEvent], ...]
+        Types of events this stream receives.
+    overflow: str
+        "drop_oldest", "drop_newest" or "block".
+    max_backlog: int
+        Maximum number of events waiting for space in the queue with
+        overflow "block".
+    dropped: int
+        Number of events discarded because the queue (and with overflow
+        "block" the backlog) was full.
+    """
+    OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+    def __init__(self, kinds: Iterable[type[MarioEvent]] = EVENT_TYPES,
+                 maxsize: int = 256, overflow: str = "drop_oldest",
+                 on_close: Union[Callable[["EventStream"], Any], None] = None,
+                 max_backlog: Union[int, None] = None) -> None:
+        """
+        Args:
+            kinds (iterable of event types, optional): Types of events the
+                stream receives. Defaults to all of them.
+            maxsize (int, optional): Size of the queue. Defaults to 256.
+            overflow (str, optional): Policy for a full queue, see above.
+                Defaults to "drop_oldest".
+            on_close (function, optional): Called with the stream when it
+                gets closed. Defaults to None.
+            max_backlog (int, optional): Size of the backlog of overflow
+                "block". Defaults to 16 * maxsize.
+        """
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"Invalid overflow policy {overflow!r}, expected "
+                             f"one of {self.OVERFLOW_POLICIES}")
+        if maxsize < 1:
+            raise ValueError(f"maxsize must be at least 1, got {maxsize}")
+        self.kinds = tuple(kinds)
+        self.overflow = overflow
+        self.max_backlog = (max_backlog if max_backlog is not None
+                            else 16 * maxsize)
+        self.dropped = 0
+        self._queue: asyncio.Queue[Union[MarioEvent, None]] = asyncio.Queue(
+            maxsize)
+        self._backlog: deque[MarioEvent] = deque()
+        self._closed = False
+        self._on_close = on_close
+
+    def put(self, event: MarioEvent) -> None:
+        """Adds an event to the stream. Never blocks."""
+        if self._closed or not isinstance(event, self.kinds):
+            return
+        queue = self._queue
+        if self._backlog or queue.full():
+            if (self.overflow == "block"
+                    and len(self._backlog) < self.max_backlog):
+                self._backlog.append(event)
+                return
+            self.dropped += 1
+            if self.overflow != "drop_oldest":
+                return
+            queue.get_nowait()
+        queue.put_nowait(event)
+
+    def qsize(self) -> int:
+        """Number of events waiting to be consumed."""
+        return self._queue.qsize() + len(self._backlog)
+
+    def close(self) -> None:
+        """Stops receiving events. Events that are already queued can still
+        be consumed, then iteration stops."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._on_close is not None:
+            self._on_close(self)
+        if self._queue.empty():
+            self._queue.put_nowait(None)  # wakes up a waiting consumer
+
+    def __aiter__(self) -> "EventStream":
+        return self
+
+    async def __anext__(self) -> MarioEvent:
+        if self._closed and self._queue.empty() and not self._backlog:
+            raise StopAsyncIteration
+        event = await self._queue.get()
+        if self._backlog:
+            self._queue.put_nowait(self._backlog.popleft())
+        if event is None:
+            raise StopAsyncIteration
+        return event
+
+    async def __aenter__(self) -> "EventStream":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self.close()
@@ -0,0 +1,237 @@
+"""
+mario_fleet.py
+This file implements MarioFleet, which connects many Marios at once. Instead
+of every Mario scanning for devices on its own (which takes a full scan per
+Mario, and Marios racing for the same device), the fleet runs one shared
+scan, which ends as soon as there is a device for every Mario waiting for
+one, hands the devices to them and connects them concurrently.
+
+Example:
+    fleet = MarioFleet(max_parallel_connections=4)
+    players = fleet.create(8)
+    await fleet.connect()
+    print(f"connected {len(fleet.connected)} Marios in {fleet.connect_time}s")
+Copyright (c) 2022 Jamin Kauf
+"""
+import asyncio
+import time
+from typing import Any, Callable, Union
+try:
+    from .mario import Mario
+    from .mario_events import WARNING
+    from .mario_transport import BleakTransport, DeviceFilter, scan
+except ImportError:
+    from mario import Mario
+    from mario_events import WARNING
+    from mario_transport import BleakTransport, DeviceFilter, scan
+
+
+class MarioFleet:
+    """Connects a group of Marios using one shared scan.
+
+    Marios of a fleet connect (and reconnect) through the fleet, so
+    Mario.connect(), auto_reconnect and PygameMario work as usual.
+
+    Attributes
+    ----------
+    members: list[Mario]
+        All Marios of the fleet.
+    transport: BleakTransport | SimulatedTransport
+        Used for scanning and by all members to connect.
+    max_parallel_connections: int
+        Maximum number of Marios that connect at the same time.
+    device_filter: (device, AdvertisementData) -> bool
+        Decides which devices the fleet connects to, see DeviceFilter.
+    scan_timeout: float
+        Maximum duration of a scan in seconds.
+    max_scans: int
+        Number of scans a Mario waits for a device per connection attempt,
+        see Mario.retry_budget.
+    scans: int
+        Number of scans run so far.
+    connect_time: float | None
+        Seconds the last .connect() took until all Marios were connected
+        (or gave up).
+    """
+    def __init__(self, transport: Any = None,
+                 max_parallel_connections: int = 4,
+                 scan_timeout: float = 5.0, max_scans: int = 1,
+                 device_filter: Union[Callable[[Any, Any], bool], None] = None
+                 ) -> None:
+        """
+        Args:
+            transport (optional): Used to find and connect to devices.
+                Defaults to BleakTransport() (real bluetooth).
+            max_parallel_connections (int, optional): Maximum number of
+                Marios that connect at the same time. Defaults to 4.
+            scan_timeout (float, optional): Maximum duration of a scan in
+                seconds. Defaults to 5.0.
+            max_scans (int, optional): Number of scans a Mario waits for a
+                device per connection attempt. Defaults to 1.
+            device_filter (function, optional): Takes (device,
+                advertisement data) and returns whether to connect to the
+                device. Defaults to DeviceFilter() (any Mario, Luigi or
+                Peach).
+        """
+        if max_parallel_connections < 1:
+            raise ValueError("max_parallel_connections must be at least 1, "
+                             f"got {max_parallel_connections}")
+        self.transport = transport if transport is not None else (
+            BleakTransport())
+        self.device_filter = device_filter if device_filter is not None else (
+            DeviceFilter())
+        self.members: list[Mario] = []
+        self.max_parallel_connections = max_parallel_connections
+        self.scan_timeout = scan_timeout
+        self.max_scans = max_scans
+        self.scans = 0
+        self.connect_time: Union[float, None] = None
+        # created on the running loop by _connect(), see Mario._bind_loop()
+        self._limiter: Union[asyncio.Semaphore, None] = None
+        self._limiter_loop: Union[asyncio.AbstractEventLoop, None] = None
+        # Marios waiting for a device -> (future for the result, failed scans)
+        self._waiting: dict[Mario, list[Any]] = {}
+        self._scan_task: Union[asyncio.Task, None] = None
+
+    def add(self, mario: Mario) -> Mario:
+        """Adds a Mario to the fleet. Create it with auto_connect=False,
+        otherwise it starts connecting on its own.
+
+        Args:
+            mario (Mario): The Mario to add.
+
+        Returns:
+            Mario: The same Mario.
+        """
+        mario.fleet = self
+        mario.transport = self.transport
+        self.members.append(mario)
+        return mario
+
+    def create(self, count: int, cls: type = Mario, **kwargs: Any
+               ) -> list[Mario]:
+        """Creates Marios and adds them to the fleet.
+
+        Args:
+            count (int): Number of Marios to create.
+            cls (type, optional): Mario or a subclass, e.g. PygameMario.
+                Defaults to Mario.
+            **kwargs: Passed on to cls.
+
+        Returns:
+            list[Mario]: The new Marios.
+        """
+        kwargs["auto_connect"] = False
+        kwargs.setdefault("transport", self.transport)
+        return [self.add(cls(**kwargs)) for _ in range(count)]
+
+    def remove(self, mario: Mario) -> None:
+        """Removes a Mario from the fleet. It stays connected."""
+        self.members.remove(mario)
+        mario.fleet = None
+        waiting = self._waiting.pop(mario, None)
+        if waiting is not None and not waiting[0].done():
+            waiting[0].set_result(False)
+
+    @property
+    def connected(self) -> list[Mario]:
+        """Members that are currently connected."""
+        return [mario for mario in self.members if mario.is_connected]
+
+    async def connect(self) -> bool:
+        """Connects all members that aren't connected yet and measures how
+        long it takes (see .connect_time).
+
+        Returns:
+            bool: Whether all members are connected.
+        """
+        start = time.monotonic()
+        await asyncio.gather(*(mario.connect() for mario in self.members
+                               if not mario.is_connected))
+        self.connect_time = time.monotonic() - start
+        return len(self.connected) == len(self.members)
+
+    def start(self) -> asyncio.Task:
+        """Starts .connect() in the background, e.g. for pygame games that
+        keep the loop running with AsyncClock.
+
+        Returns:
+            asyncio.Task: The task running .connect().
+        """
+        return asyncio.get_event_loop().create_task(self.connect())
+
+    async def request(self, mario: Mario) -> bool:
+        """Waits until the shared scan found a device for mario and mario
+        connected to it. Called by Mario.connect().
+
+        Args:
+            mario (Mario): A member of the fleet.
+
+        Returns:
+            bool: False if Mario couldn't connect to a device found within
+                max_scans scans.
+        """
+        if mario not in self._waiting:
+            future = asyncio.get_event_loop().create_future()
+            self._waiting[mario] = [future, 0]
+        future = self._waiting[mario][0]
+        if self._scan_task is None:
+            self._scan_task = asyncio.get_event_loop().create_task(
+                self._scan_loop())
+        return await asyncio.shield(future)
+
+    def _resolve(self, mario: Mario, result: bool) -> None:
+        future, _ = self._waiting.pop(mario)
+        if not future.done():
+            future.set_result(result)
+
+    async def _scan_loop(self) -> None:
+        try:
+            while self._waiting:
+                for mario in list(self._waiting):
+                    if not mario.run:  # stopped while waiting
+                        self._resolve(mario, False)
+                    else:
+                        mario.log("Searching for device...",
+                                  category="connection")
+                if not self._waiting:
+                    break
+                self.scans += 1
+                # devices of all Marios, also of those outside the fleet.
+                # The waiting ones hold no device, so any of them can ask.
+                taken = next(iter(self._waiting))._taken_addresses()
+                try:
+                    free = await scan(self.transport, self.device_filter,
+                                      self.scan_timeout,
+                                      count=len(self._waiting), exclude=taken)
+                except OSError as e:
+                    error = OSError("Can't use device - make sure your device"
+                                    f" supports Bluetooth and turn it on.\n{e}")
+                    for future, _ in self._waiting.values():
+                        if not future.done():
+                            future.set_exception(error)
+                    self._waiting.clear()
+                    return
+                pairs = list(zip(list(self._waiting), free))
+                results = await asyncio.gather(*(
+                    self._connect(mario, device) for mario, device in pairs))
+                for (mario, _), connected in zip(pairs, results):
+                    if connected and mario in self._waiting:
+                        self._resolve(mario, True)
+                for mario, waiting in list(self._waiting.items()):
+                    waiting[1] += 1
+                    if waiting[1] >= self.max_scans:
+                        mario.log(f"Not connected after {self.max_scans} "
+                                  "scans", level=WARNING,
+                                  category="connection")
+                        self._resolve(mario, False)
+        finally:
+            self._scan_task = None
+
+    async def _connect(self, mario: Mario, device: Any) -> bool:
+        loop = asyncio.get_running_loop()
+        if self._limiter is None or self._limiter_loop is not loop:
+            self._limiter = asyncio.Semaphore(self.max_parallel_connections)
+            self._limiter_loop = loop
+        async with self._limiter:
+            return await mario._connect_device(device)
@@ -0,0 +1,244 @@
+"""
+mario_hooks.py
+This file implements wrappers around Mario's event hooks that change how
+often and where they are called. Wrapped hooks are stored in Mario's hook
+lists like plain functions and compare equal to the function they wrap, so
+Mario.remove_hooks works with the original function.
+Copyright (c) 2022 Jamin Kauf
+"""
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import Executor
+from typing import Any, Callable, Union
+
+
+class RateLimitedHook:
+    """Accelerometer hook that is called at most max_rate times per second.
+
+    Samples that arrive while the hook has to wait are coalesced: only the
+    newest one is delivered (or, in averaging mode, the mean of all of them)
+    as soon as the hook is allowed to run again. If func is an OffloadedHook
+    that is still busy with earlier samples, the hook also waits until it is
+    done.
+
+    Attributes
+    ----------
+    func: (Mario, int, int, int) -> Any
+        The wrapped accelerometer hook.
+    max_rate: float | None
+        Maximum number of calls per second. None for no limit.
+    average: bool
+        If True, delivers the mean of all coalesced samples instead of the
+        newest one.
+    received: int
+        Number of samples passed to this hook.
+    delivered: int
+        Number of calls of func.
+    coalesced: int
+        Number of samples that were not delivered on their own, because they
+        were merged into or superseded by a later sample.
+    dropped: int
+        Number of samples whose values never reached func (coalesced samples
+        that weren't averaged).
+    """
+    def __init__(self, func: Callable[[Any, int, int, int], Any],
+                 max_rate: Union[float, None] = None,
+                 average: bool = False) -> None:
+        """
+        Args:
+            func (function): accelerometer hook that takes
+                (Mario, int, int, int) as input.
+            max_rate (float, optional): Maximum number of calls per second.
+                Defaults to None (no limit).
+            average (bool, optional): Deliver the mean of coalesced samples
+                instead of the newest one. Defaults to False.
+        """
+        if max_rate is not None and max_rate <= 0:
+            raise ValueError(f"max_rate must be positive, got {max_rate}")
+        self.func = func
+        self.max_rate = max_rate
+        self.average = average
+        self.received = 0
+        self.delivered = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self._interval = 1 / max_rate if max_rate else 0.0
+        self._next_call = 0.0  # time.monotonic() when func may run again
+        self._timer: Union[asyncio.TimerHandle, None] = None
+        self._mario: Any = None
+        self._pending = 0  # number of samples waiting for delivery
+        self._sums = [0, 0, 0]
+
+    def __call__(self, mario: Any, x: int, y: int, z: int) -> None:
+        self.received += 1
+        self._mario = mario
+        if self.average:
+            sums = self._sums
+            sums[0] += x
+            sums[1] += y
+            sums[2] += z
+        else:
+            if self._pending:
+                self.dropped += 1
+            self._sums[:] = (x, y, z)
+        self._pending += 1
+        now = time.monotonic()
+        if now < self._next_call:
+            if self._timer is None:
+                self._timer = asyncio.get_event_loop().call_later(
+                    self._next_call - now, self._on_timer)
+        elif getattr(self.func, "busy", False):
+            self.func.on_idle = self._on_timer
+        else:
+            self._deliver(now)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        if not self._pending:
+            return
+        if getattr(self.func, "busy", False):
+            self.func.on_idle = self._on_timer
+        else:
+            self._deliver(time.monotonic())
+
+    def _deliver(self, now: float) -> None:
+        count = self._pending
+        x, y, z = self._sums
+        if self.average and count > 1:
+            x, y, z = round(x / count), round(y / count), round(z / count)
+        self.coalesced += count - 1
+        self._pending = 0
+        self._sums[:] = (0, 0, 0)
+        self.delivered += 1
+        try:
+            self.func(self._mario, x, y, z)
+        finally:
+            # a hook that takes longer than the interval delays the next call
+            self._next_call = max(now + self._interval, time.monotonic())
+
+    def cancel(self) -> None:
+        """Discards pending samples and stops the delivery timer."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self.dropped += self._pending if not self.average else 0
+        self._pending = 0
+        self._sums[:] = (0, 0, 0)
+        if isinstance(self.func, OffloadedHook):
+            self.func.cancel()
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """Snapshot of the sample counters."""
+        return {"received": self.received, "delivered": self.delivered,
+                "coalesced": self.coalesced, "dropped": self.dropped,
+                "pending": self._pending}
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, RateLimitedHook):
+            return self.func == other.func
+        return self.func == other
+
+    def __hash__(self) -> int:
+        return hash(self.func)
+
+    def __repr__(self) -> str:
+        return (f"RateLimitedHook({self.func!r}, max_rate={self.max_rate}, "
+                f"average={self.average})")
+
+
+class OffloadedHook:
+    """Hook that doesn't run inside Mario's notification handler.
+
+    Coroutine functions are awaited in a task, synchronous functions are run
+    in an executor (e.g. a ThreadPoolExecutor). Calls of the same hook are
+    queued and executed one after another, in the order they were made.
+    Calls of different hooks run concurrently, limited by a semaphore shared
+    by all hooks of a Mario.
+
+    Attributes
+    ----------
+    func: Callable
+        The wrapped hook, a coroutine function or a synchronous function.
+    executor: Executor | None
+        Executor for synchronous functions.
+    busy: bool
+        True while there are calls that haven't finished yet.
+    on_idle: () -> Any | None
+        Called (once) when the queue of calls runs empty.
+    """
+    def __init__(self, func: Callable[..., Any],
+                 limiter: Callable[[], asyncio.Semaphore],
+                 executor: Union[Executor, None] = None) -> None:
+        """
+        Args:
+            func (Callable): The hook. Must be a coroutine function if no
+                executor is given.
+            limiter (() -> asyncio.Semaphore): Returns the semaphore that
+                limits how many offloaded hooks run at the same time. Called
+                on the running loop, so the semaphore can be created there.
+            executor (Executor, optional): Executor to run synchronous
+                functions in. Defaults to None.
+        """
+        self.is_coroutine = asyncio.iscoroutinefunction(func)
+        if not self.is_coroutine and executor is None:
+            raise TypeError(f"{func!r} is not a coroutine function, "
+                            "an executor is needed to offload it")
+        self.func = func
+        self.executor = executor
+        self.on_idle: Union[Callable[[], Any], None] = None
+        self._limiter = limiter
+        self._calls: deque[tuple[Any, ...]] = deque()
+        self._task: Union[asyncio.Task, None] = None
+
+    @property
+    def busy(self) -> bool:
+        return self._task is not None
+
+    def __call__(self, *args: Any) -> None:
+        self._calls.append(args)
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while self._calls:
+                args = self._calls.popleft()
+                async with self._limiter():
+                    try:
+                        if self.is_coroutine:
+                            await self.func(*args)
+                        else:
+                            await loop.run_in_executor(
+                                self.executor, self.func, *args)
+                    except Exception as e:
+                        loop.call_exception_handler({
+                            "message": f"Exception in hook {self.func!r}",
+                            "exception": e})
+        finally:
+            if self._task is asyncio.current_task():
+                self._task = None
+        callback, self.on_idle = self.on_idle, None
+        if callback is not None:
+            callback()
+
+    def cancel(self) -> None:
+        """Discards queued calls and cancels the running one."""
+        self._calls.clear()
+        self.on_idle = None
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, OffloadedHook):
+            return self.func == other.func
+        return self.func == other
+
+    def __hash__(self) -> int:
+        return hash(self.func)
+
+    def __repr__(self) -> str:
+        return f"OffloadedHook({self.func!r}, executor={self.executor!r})"
@@ -0,0 +1,220 @@
+"""
+mario_polling.py
+This file implements PortPoller, which requests the values of Mario's ports
+at fixed rates, e.g. the accelerometer at 20 Hz and the pants at 1 Hz. With
+notifications disabled, this caps the bluetooth traffic and the work per
+Mario, which matters in rooms with many toys. One timer drives all ports of
+a Mario: requests that are due at (about) the same time are queued together.
+
+Example:
+    poller = mario.poll_ports({0: 20, 2: 1})
+    ...
+    print(poller.stats())  # achieved vs requested rate per port
+Copyright (c) 2022 Jamin Kauf
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Union
+from bleak import BleakError
+
+# Ports that are due within this many seconds are requested in the same tick
+_BATCH_WINDOW = 0.002
+# A value that didn't arrive after this many seconds is requested again
+_LOST_AFTER = 1.0
+
+
+class _PolledPort:
+    __slots__ = ("port", "rate", "period", "due", "pending", "requested",
+                 "requests", "samples", "missed", "received")
+
+    def __init__(self, port: int, rate: float, window: float) -> None:
+        self.port = port
+        self.rate = rate
+        self.period = 1 / rate
+        self.due = 0.0
+        self.pending: Union[asyncio.Future, None] = None
+        self.requested = 0.0
+        self.requests = 0
+        self.samples = 0
+        self.missed = 0
+        # receive times of the samples of the last `window` seconds
+        self.received: deque[float] = deque(maxlen=int(rate * window) + 1)
+
+
+class PortPoller:
+    """Requests port values of one Mario at fixed rates.
+
+    A request is only sent if the value of the previous one arrived,
+    otherwise the sample counts as missed. Every value is also sent to
+    Mario's hooks, like with Mario.request_port_value().
+
+    Attributes
+    ----------
+    mario: Mario
+        The polled Mario.
+    rates: dict[int, float]
+        Port -> requested samples per second.
+    disable_notifications: bool
+        Whether the polled ports are set up without notifications whenever
+        Mario (re)connects, so that only the polled values are sent.
+    window: float
+        Seconds of recent samples the achieved rate is measured over.
+    """
+    def __init__(self, mario: Any, rates: dict[int, float],
+                 disable_notifications: bool = True, window: float = 5.0
+                 ) -> None:
+        """
+        Args:
+            mario (Mario): The Mario to poll.
+            rates (dict[int, float]): Port -> samples per second.
+                See Mario.request_port_value() for the ports.
+            disable_notifications (bool, optional): Set the polled ports
+                (0-4) up without notifications whenever Mario (re)connects.
+                Defaults to True.
+            window (float, optional): Seconds of recent samples the achieved
+                rate is measured over. Defaults to 5.0.
+        """
+        for port, rate in rates.items():
+            if port not in (0, 1, 2, 3, 4, 6):
+                raise ValueError("Invalid Port, expected one of "
+                                 f"(0,1,2,3,4,6) got {port}")
+            if rate <= 0:
+                raise ValueError(f"Rate of port {port} must be positive, "
+                                 f"got {rate}")
+        self.mario = mario
+        self.rates = dict(rates)
+        self.disable_notifications = disable_notifications
+        self.window = window
+        self._ports = [_PolledPort(port, rate, window)
+                       for port, rate in self.rates.items()]
+        self._task: Union[asyncio.Task, None] = None
+        self._client: Any = None  # connection the ports were set up for
+        self._started: Union[float, None] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> asyncio.Task:
+        """Starts polling in the background.
+
+        Returns:
+            asyncio.Task: The polling task.
+        """
+        if not self.running:
+            self._task = asyncio.get_event_loop().create_task(self._run())
+        return self._task
+
+    async def stop(self) -> None:
+        """Stops polling. Notifications stay disabled."""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self) -> None:
+        mario = self.mario
+        try:
+            # runs until stopped, also while Mario isn't (yet or any more)
+            # connecting: polling resumes whenever Mario connects
+            while True:
+                if (mario.client is not self._client
+                        or not mario.is_connected):
+                    await self._prepare_connection()
+                    continue
+                now = time.monotonic()
+                for polled in self._ports:
+                    if polled.due - now <= _BATCH_WINDOW:
+                        self._request(polled, now)
+                await asyncio.sleep(max(
+                    min(polled.due for polled in self._ports)
+                    - time.monotonic(), 0))
+        finally:
+            for polled in self._ports:
+                self._discard(polled)
+
+    async def _prepare_connection(self) -> None:
+        """Waits for a connection, sets it up and restarts the schedule."""
+        for polled in self._ports:
+            self._discard(polled)
+        await self.mario.await_connection()
+        client = self.mario.client
+        if self.disable_notifications:
+            for port in self.rates:
+                if port == 0:  # keep the accelerometer's delta interval
+                    await self.mario.port_setup(
+                        0, 0, notifications=False,
+                        delta_interval=self.mario.imu_delta_interval)
+                elif port in (1, 2, 3, 4):
+                    await self.mario.port_setup(port, 0, notifications=False)
+        self._client = client
+        now = time.monotonic()
+        if self._started is None:
+            self._started = now
+        for polled in self._ports:
+            polled.due = now
+
+    def _request(self, polled: _PolledPort, now: float) -> None:
+        polled.due += polled.period
+        if polled.due < now:  # fell behind, don't catch up with a burst
+            polled.missed += int((now - polled.due) / polled.period)
+            polled.due = now + polled.period
+        if polled.pending is not None:
+            polled.missed += 1  # the last value hasn't arrived yet
+            if now - polled.requested < _LOST_AFTER:
+                return
+            self._discard(polled)
+        try:
+            future = self.mario.start_port_read(polled.port)
+        except BleakError:
+            return  # disconnected, the next tick waits for the connection
+        polled.requests += 1
+        polled.requested = now
+        polled.pending = future
+        future.add_done_callback(
+            lambda future, polled=polled: self._on_value(polled, future))
+
+    def _on_value(self, polled: _PolledPort, future: asyncio.Future) -> None:
+        if polled.pending is future:
+            polled.pending = None
+        if future.cancelled() or future.exception() is not None:
+            return  # disconnected, the connection hooks log that
+        polled.samples += 1
+        polled.received.append(time.monotonic())
+
+    def _discard(self, polled: _PolledPort) -> None:
+        future, polled.pending = polled.pending, None
+        if future is not None:
+            self.mario.discard_port_read(polled.port, future)
+            future.cancel()
+
+    def stats(self) -> dict[int, dict[str, Union[int, float]]]:
+        """Requested and achieved rate of every polled port.
+
+        Returns:
+            dict[int, dict]: Port -> requested_hz, achieved_hz (over the
+                last .window seconds), requests, samples and missed
+                (samples that weren't requested because the previous value
+                was late or the poller fell behind).
+        """
+        now = time.monotonic()
+        elapsed = (min(now - self._started, self.window)
+                   if self._started is not None else 0)
+        stats = {}
+        for polled in self._ports:
+            recent = [t for t in polled.received if now - t <= elapsed]
+            # n samples are n - 1 intervals
+            achieved = ((len(recent) - 1) / (recent[-1] - recent[0])
+                        if len(recent) > 1 and recent[-1] > recent[0]
+                        else 0.0)
+            stats[polled.port] = {
+                "requested_hz": polled.rate,
+                "achieved_hz": round(achieved, 2),
+                "requests": polled.requests,
+                "samples": polled.samples,
+                "missed": polled.missed}
+        return stats
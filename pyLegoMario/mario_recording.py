@@ -0,0 +1,301 @@
+"""
+mario_recording.py
+This file implements NotificationRecorder, which writes every raw bluetooth
+notification of a Mario to a compact binary file, and NotificationReplayer,
+which feeds such a file back into a Mario. Replaying makes it possible to
+test the whole decoding and hook pipeline without the toy.
+
+File format (little endian):
+    header:  b"PLMREC", uint16 version
+    blocks:  uint32 record count, int64 timestamp of the first record (ns),
+             uint32 size of the records in bytes, followed by the records:
+                 uint32 time since the first record of the block (ns),
+                 uint16 length, notification data
+    index:   uint32 block count, then per block:
+                 int64 timestamp of the first record, uint64 file offset
+    footer:  uint64 file offset of the index, b"PIDX"
+If a recording wasn't closed properly, the index is missing and gets rebuilt
+by reading all block headers.
+Copyright (c) 2022 Jamin Kauf
+"""
+import asyncio
+import bisect
+import mmap
+import struct
+import time
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Iterator, Union
+
+MAGIC = b"PLMREC"
+VERSION = 1
+_HEADER = struct.Struct("<6sH")
+_BLOCK_HEADER = struct.Struct("<IqI")
+_RECORD_HEADER = struct.Struct("<IH")
+_INDEX_ENTRY = struct.Struct("<qQ")
+_INDEX_COUNT = struct.Struct("<I")
+_FOOTER = struct.Struct("<Q4s")
+_FOOTER_MAGIC = b"PIDX"
+# largest time difference that fits into a record header
+_MAX_DELTA = 0xffffffff
+
+
+class NotificationRecorder:
+    """Writes raw notifications with their timestamps to a file.
+
+    Records are collected in blocks of block_size records, which are written
+    to the file as a whole. Use Mario.start_recording() to record a Mario.
+
+    Attributes
+    ----------
+    path: Path
+        The file the notifications are written to.
+    count: int
+        Number of recorded notifications.
+    """
+    def __init__(self, path: Union[str, Path], block_size: int = 256,
+                 on_close: Union[Callable[["NotificationRecorder"], Any],
+                                 None] = None) -> None:
+        """
+        Args:
+            path (str | Path): File to write to. Will be overwritten.
+            block_size (int, optional): Maximum number of records per block.
+                Defaults to 256.
+            on_close (function, optional): Called with the recorder when it
+                gets closed. Defaults to None.
+        """
+        self.path = Path(path)
+        self.count = 0
+        self._block_size = block_size
+        self._file: BinaryIO = open(self.path, "wb")
+        self._file.write(_HEADER.pack(MAGIC, VERSION))
+        self._index: list[tuple[int, int]] = []
+        self._block = bytearray()
+        self._block_count = 0
+        self._block_start = 0
+        self._on_close = on_close
+
+    def record(self, timestamp: int, data: Union[bytes, bytearray]) -> None:
+        """Adds a notification to the recording.
+
+        Args:
+            timestamp (int): time.monotonic_ns() when it was received.
+            data (bytes | bytearray): The notification.
+        """
+        if self._file.closed:
+            raise ValueError("Recording is already closed")
+        if self._block_count and (
+                self._block_count >= self._block_size
+                or not 0 <= timestamp - self._block_start <= _MAX_DELTA):
+            self.flush()
+        if not self._block_count:
+            self._block_start = timestamp
+        self._block += _RECORD_HEADER.pack(
+            timestamp - self._block_start, len(data))
+        self._block += data
+        self._block_count += 1
+        self.count += 1
+
+    def flush(self) -> None:
+        """Writes the current block to the file."""
+        if not self._block_count:
+            return
+        self._index.append((self._block_start, self._file.tell()))
+        self._file.write(_BLOCK_HEADER.pack(
+            self._block_count, self._block_start, len(self._block)))
+        self._file.write(self._block)
+        self._file.flush()
+        self._block.clear()
+        self._block_count = 0
+
+    def close(self) -> None:
+        """Writes the remaining records and the index, then closes the file."""
+        if self._file.closed:
+            return
+        self.flush()
+        index_offset = self._file.tell()
+        self._file.write(_INDEX_COUNT.pack(len(self._index)))
+        for entry in self._index:
+            self._file.write(_INDEX_ENTRY.pack(*entry))
+        self._file.write(_FOOTER.pack(index_offset, _FOOTER_MAGIC))
+        self._file.close()
+        if self._on_close is not None:
+            self._on_close(self)
+
+    def __enter__(self) -> "NotificationRecorder":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+class NotificationReplayer:
+    """Reads a recording made by NotificationRecorder.
+
+    The file is memory mapped, only the blocks that are played are read.
+
+    Attributes
+    ----------
+    path: Path
+        The recording.
+    start_time: int | None
+        Timestamp (ns) of the first notification, None if it's empty.
+    end_time: int | None
+        Timestamp (ns) of the last notification, None if it's empty.
+    """
+    def __init__(self, path: Union[str, Path]) -> None:
+        """
+        Args:
+            path (str | Path): The recording.
+
+        Raises:
+            ValueError: If the file isn't a recording.
+        """
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            if self.path.stat().st_size < _HEADER.size:
+                raise ValueError(f"{self.path} is not a Mario recording")
+            self._content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = _HEADER.unpack_from(self._content, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{self.path} is not a version {VERSION} "
+                             "Mario recording")
+        self._index = self._read_index() or self._scan_blocks()
+        self._block_starts = [start for start, _ in self._index]
+        self.start_time = self._index[0][0] if self._index else None
+        self.end_time = None
+        if self._index:
+            *_, (self.end_time, _) = self._records_of_block(self._index[-1][1])
+
+    def _read_index(self) -> list[tuple[int, int]]:
+        """Reads the index at the end of the file. Returns an empty list if
+        there is none."""
+        content = self._content
+        if len(content) < _HEADER.size + _FOOTER.size:
+            return []
+        index_offset, magic = _FOOTER.unpack_from(
+            content, len(content) - _FOOTER.size)
+        if magic != _FOOTER_MAGIC:
+            return []
+        count, = _INDEX_COUNT.unpack_from(content, index_offset)
+        return [_INDEX_ENTRY.unpack_from(
+                    content, index_offset + _INDEX_COUNT.size
+                    + i * _INDEX_ENTRY.size)
+                for i in range(count)]
+
+    def _scan_blocks(self) -> list[tuple[int, int]]:
+        """Rebuilds the index by reading every block header."""
+        index = []
+        offset = _HEADER.size
+        content = self._content
+        while offset + _BLOCK_HEADER.size <= len(content):
+            count, start, size = _BLOCK_HEADER.unpack_from(content, offset)
+            if not self._is_block(offset + _BLOCK_HEADER.size, count, size):
+                break  # incomplete block or start of the index
+            index.append((start, offset))
+            offset += _BLOCK_HEADER.size + size
+        return index
+
+    def _is_block(self, offset: int, count: int, size: int) -> bool:
+        """Checks whether count records starting at offset take up exactly
+        size bytes of the file."""
+        end = offset + size
+        if end > len(self._content):
+            return False
+        for _ in range(count):
+            if offset + _RECORD_HEADER.size > end:
+                return False
+            _, length = _RECORD_HEADER.unpack_from(self._content, offset)
+            offset += _RECORD_HEADER.size + length
+        return offset == end
+
+    def _records_of_block(self, offset: int) -> Iterator[tuple[int, bytes]]:
+        content = self._content
+        count, start, _ = _BLOCK_HEADER.unpack_from(content, offset)
+        offset += _BLOCK_HEADER.size
+        for _ in range(count):
+            delta, length = _RECORD_HEADER.unpack_from(content, offset)
+            offset += _RECORD_HEADER.size
+            yield start + delta, content[offset:offset + length]
+            offset += length
+
+    @property
+    def duration(self) -> float:
+        """Seconds between the first and the last notification."""
+        if self.start_time is None or self.end_time is None:
+            return 0.0
+        return (self.end_time - self.start_time) / 1e9
+
+    def records(self, start: float = 0.0) -> Iterator[tuple[int, bytes]]:
+        """Iterates over the recorded notifications.
+
+        Args:
+            start (float, optional): Seconds after the first notification to
+                start at. Only the blocks from there on are read.
+                Defaults to 0.0.
+
+        Yields:
+            tuple[int, bytes]: Timestamp (ns) and data of a notification.
+        """
+        if self.start_time is None:
+            return
+        start_time = self.start_time + int(start * 1e9)
+        first_block = max(
+            bisect.bisect_right(self._block_starts, start_time) - 1, 0)
+        for _, offset in self._index[first_block:]:
+            for timestamp, data in self._records_of_block(offset):
+                if timestamp >= start_time:
+                    yield timestamp, data
+
+    def close(self) -> None:
+        """Closes the file."""
+        self._content.close()
+
+    def __enter__(self) -> "NotificationReplayer":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        content = self._content
+        return sum(_BLOCK_HEADER.unpack_from(content, offset)[0]
+                   for _, offset in self._index)
+
+    async def play(self, mario: Any, speed: Union[float, None] = 1.0,
+                   start: float = 0.0) -> int:
+        """Feeds the recording into a Mario's notification handler.
+
+        Note that recorded "Hub Will Disconnect" messages make Mario
+        disconnect (and reconnect, if auto_reconnect is set).
+
+        Args:
+            mario (Mario): The Mario to feed.
+            speed (float | None, optional): Playback speed, 1.0 is real time,
+                2.0 twice as fast. None plays as fast as possible.
+                Defaults to 1.0.
+            start (float, optional): Seconds after the first notification to
+                start at. Defaults to 0.0.
+
+        Returns:
+            int: Number of notifications played.
+        """
+        if speed is not None and speed <= 0:
+            raise ValueError(f"speed must be positive or None, got {speed}")
+        played = 0
+        first_timestamp = None
+        wall_start = time.monotonic()
+        for timestamp, data in self.records(start):
+            if first_timestamp is None:
+                first_timestamp = timestamp
+            if speed is None:
+                if not played % 64:
+                    await asyncio.sleep(0)  # let the loop run other tasks
+            else:
+                due = wall_start + (timestamp - first_timestamp) / 1e9 / speed
+                delay = due - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            mario._handle_events(0, bytearray(data))
+            played += 1
+        return played
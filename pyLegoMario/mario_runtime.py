@@ -0,0 +1,241 @@
+"""
+mario_runtime.py
+This file implements serve(), which runs Marios (and everything else on the
+asyncio loop) with a single asyncio.run() until they are done or the program
+is asked to stop with Ctrl+C (SIGINT) or SIGTERM. On the way out, all Marios
+are disconnected, queued hook calls and recordings are finished and the
+remaining tasks are cancelled, so no Mario stays connected.
+
+Objects like Mario and MarioWindow can be created before the loop runs.
+They use start_soon() to start their tasks on whichever loop runs first:
+serve(), or a loop run with run_until_complete() as in older scripts.
+
+Example:
+    async def main():
+        mario = Mario()
+        await mario.await_connection()
+        ...
+
+    serve(main=main)
+Copyright (c) 2022 Jamin Kauf
+"""
+import asyncio
+import signal
+import sys
+import weakref
+from typing import Any, Awaitable, Callable, Iterable, Union
+
+# Every Mario registers itself, so serve() can shut all of them down
+_marios: "weakref.WeakSet[Any]" = weakref.WeakSet()
+# Start functions waiting for a loop: (default loop, handle, function)
+_pending: list[tuple[asyncio.AbstractEventLoop, asyncio.Handle,
+                     Callable[[], Any]]] = []
+# Tasks returned by start functions, serve() waits for them
+_started: "weakref.WeakSet[asyncio.Task]" = weakref.WeakSet()
+
+
+def register(mario: Any) -> None:
+    """Lets serve() shut mario down. Called by Mario.__init__()."""
+    _marios.add(mario)
+
+
+def unregister(mario: Any) -> None:
+    """Stops serve() from shutting mario down, e.g. because it runs on
+    another thread's loop."""
+    _marios.discard(mario)
+
+
+def registered() -> list[Any]:
+    """All Marios that exist and are registered."""
+    return list(_marios)
+
+
+def start_soon(func: Callable[[], Union[asyncio.Task, None]]) -> None:
+    """Calls func as soon as an event loop runs: right away if one is
+    running, otherwise when serve() starts or the default loop runs
+    (e.g. with run_until_complete()).
+
+    Args:
+        func (function): Starts something, e.g. creates a task. If it
+            returns a task, serve() keeps running until it is done.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        _track(func())
+        return
+    loop = _default_loop()
+
+    def start() -> None:
+        _pending.remove(entry)
+        _track(func())
+    entry = (loop, loop.call_soon(start), func)
+    _pending.append(entry)
+
+
+def _default_loop() -> asyncio.AbstractEventLoop:
+    try:  # if event loop exists, use that one
+        return asyncio.get_event_loop()
+    except RuntimeError:  # otherwise, create a new one
+        loop = asyncio.SelectorEventLoop()
+        asyncio.set_event_loop(loop)
+        return loop
+
+
+def _track(task: Union[asyncio.Task, None]) -> None:
+    if task is not None:
+        _started.add(task)
+
+
+def _adopt_pending() -> None:
+    """Starts everything that is waiting for a loop on the running loop.
+    Default loops that were only created to wait for it are closed."""
+    running = asyncio.get_running_loop()
+    abandoned = set()
+    while _pending:
+        loop, handle, func = _pending.pop(0)
+        if loop is not running:
+            handle.cancel()
+            abandoned.add(loop)
+        _track(func())
+    for loop in abandoned:
+        if not loop.is_running() and not loop.is_closed():
+            loop.close()
+
+
+def serve(*marios: Any,
+          main: Union[Callable[[], Awaitable[Any]], None] = None,
+          shutdown_timeout: float = 5.0,
+          handle_signals: bool = True) -> Any:
+    """Runs the asyncio loop with asyncio.run() until main returns or, without
+    main, until all Marios stopped and all started tasks (e.g. of
+    MarioWindow) are done. Ctrl+C and SIGTERM end it early. Afterwards, all
+    Marios are shut down (see Mario.shutdown()) and the remaining tasks are
+    cancelled.
+
+    Args:
+        *marios (Mario): Marios to run. Marios created before are run
+            anyway, this only starts the ones created with
+            auto_connect=False.
+        main (coroutine function, optional): Called without arguments once
+            the loop runs. Defaults to None.
+        shutdown_timeout (float, optional): Seconds the shutdown of the
+            Marios may take before their tasks are cancelled.
+            Defaults to 5.0.
+        handle_signals (bool, optional): Shut down gracefully on SIGINT and
+            SIGTERM. Defaults to True.
+
+    Returns:
+        Any: What main returned, None without main or if it was stopped
+            by a signal.
+    """
+    return asyncio.run(_serve(marios, main, shutdown_timeout, handle_signals))
+
+
+def run(shutdown_timeout: float = 5.0) -> None:
+    """Like serve() without main, but on the default event loop, for
+    scripts that already ran it, e.g. with run_until_complete().
+
+    Args:
+        shutdown_timeout (float, optional): See serve(). Defaults to 5.0.
+    """
+    _default_loop().run_until_complete(
+        _serve((), None, shutdown_timeout, True))
+
+
+async def _serve(marios: tuple[Any, ...],
+                 main: Union[Callable[[], Awaitable[Any]], None],
+                 shutdown_timeout: float, handle_signals: bool) -> Any:
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    restore = _install_signal_handlers(loop, stop) if handle_signals else []
+    try:
+        _adopt_pending()
+        for mario in marios:
+            register(mario)
+            if not mario.is_connected:
+                _track(mario.start())
+        if main is not None:
+            work = loop.create_task(main())
+        else:
+            work = loop.create_task(_wait_until_done())
+        stopping = loop.create_task(stop.wait())
+        await asyncio.wait((work, stopping),
+                           return_when=asyncio.FIRST_COMPLETED)
+        stopping.cancel()
+        if not work.done():
+            work.cancel()
+        try:
+            return await work
+        except asyncio.CancelledError:
+            return None
+    finally:
+        await shutdown(timeout=shutdown_timeout)
+        for restore_handler in restore:
+            restore_handler()
+
+
+async def _wait_until_done(interval: float = 0.1) -> None:
+    """Returns once no Mario is running and all started tasks are done."""
+    while (any(mario.run for mario in _marios)
+           or any(not task.done() for task in _started)):
+        await asyncio.sleep(interval)
+
+
+async def shutdown(marios: Union[Iterable[Any], None] = None,
+                   timeout: float = 5.0) -> None:
+    """Shuts Marios down (see Mario.shutdown()), then cancels the remaining
+    tasks of the running loop.
+
+    Args:
+        marios (Iterable[Mario], optional): Marios to shut down.
+            Defaults to None (all registered Marios).
+        timeout (float, optional): Seconds the shutdown of the Marios may
+            take before their tasks are cancelled. Defaults to 5.0.
+    """
+    marios = list(_marios if marios is None else marios)
+    if marios:
+        done, pending = await asyncio.wait(
+            [asyncio.ensure_future(mario.shutdown()) for mario in marios],
+            timeout=timeout)
+        for task in pending:
+            task.cancel()
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                asyncio.get_running_loop().call_exception_handler({
+                    "message": "Exception while shutting down Mario",
+                    "exception": task.exception()})
+    current = asyncio.current_task()
+    tasks = [task for task in asyncio.all_tasks() if task is not current]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    sys.stdout.flush()
+
+
+def _install_signal_handlers(loop: asyncio.AbstractEventLoop,
+                             stop: asyncio.Event
+                             ) -> list[Callable[[], Any]]:
+    """Sets stop on SIGINT and SIGTERM.
+
+    Returns:
+        list[function]: Restore the previous handlers.
+    """
+    restore: list[Callable[[], Any]] = []
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+            restore.append(lambda sig=sig: loop.remove_signal_handler(sig))
+        except NotImplementedError:  # Windows
+            try:
+                previous = signal.signal(
+                    sig, lambda *args: loop.call_soon_threadsafe(stop.set))
+            except ValueError:  # not the main thread
+                continue
+            restore.append(lambda sig=sig, previous=previous:
+                           signal.signal(sig, previous))
+        except (RuntimeError, ValueError):  # not the main thread
+            continue
+    return restore
@@ -0,0 +1,463 @@
+"""
+mario_simulator.py
+This file implements a simulated Lego Mario that runs in-process, so Mario
+can be tested and benchmarked without bluetooth:
+    SimulatedHub answers the commands Mario sends (port input format setup,
+        hub properties like the volume, hub actions like disconnect and turn
+        off, port value requests) with the notifications a real hub sends,
+        and generates accelerometer, tile and pants traffic at configurable
+        rates.
+    SimulatedClient stands in for bleak.BleakClient.
+    SimulatedTransport stands in for BleakTransport and finds all simulated
+        hubs that are advertising.
+    SimulatedScanner stands in for bleak.BleakScanner.
+
+Example:
+    hub = SimulatedHub(imu_rate=100)
+    mario = Mario(transport=SimulatedTransport(hub))
+Copyright (c) 2022 Jamin Kauf
+"""
+import asyncio
+import itertools
+import math
+import struct
+import time
+import zlib
+from typing import Any, Callable, Union
+from bleak import BleakError
+from bleak.backends.scanner import AdvertisementData
+try:
+    from .lego_mario_data import (HEX_TO_RGB_TILE, HEX_TO_PANTS,
+        LEGO_CHARACTERISTIC_UUID, LEGO_HUB_SERVICE_UUID, LEGO_MANUFACTURER_ID)
+except ImportError:
+    from lego_mario_data import (HEX_TO_RGB_TILE, HEX_TO_PANTS,
+        LEGO_CHARACTERISTIC_UUID, LEGO_HUB_SERVICE_UUID, LEGO_MANUFACTURER_ID)
+
+_address_counter = itertools.count(1)
+
+
+class SimulatedHub:
+    """A simulated Lego Mario.
+
+    Ports only send values after notifications have been enabled for them
+    with a port input format setup, just like on a real hub.
+
+    Attributes
+    ----------
+    name: str
+        Advertised name.
+    address: str
+        Simulated bluetooth address.
+    rssi: int
+        Simulated signal strength.
+    imu_rate, tile_rate, pants_rate: float
+        Notifications per second the hub sends for the accelerometer (port 0),
+        the camera (port 1) and the pants (port 2). 0 disables the port.
+    connect_delay: float
+        Seconds a connection attempt takes.
+    write_delay: float
+        Seconds every write takes.
+    advertising_interval: float
+        Seconds between two advertisements.
+    system_type: int
+        System type in the advertised manufacturer data, 0x43 is Mario.
+    powered: bool
+        False after the hub was turned off. Turned off hubs don't advertise.
+    readvertise: bool
+        Whether the hub becomes discoverable again after disconnecting.
+        Otherwise, advertise() needs to be called (like pressing the
+        bluetooth button).
+    advertising: bool
+        Whether the hub can be discovered and connected to.
+    connected: bool
+        Whether a client is connected.
+    volume: int
+        Volume set by the client.
+    port_formats: dict[int, tuple[int, int, bool]]
+        Mode, delta interval and notification setting of every configured
+        port.
+    acceleration: tuple[int, int, int]
+        Most recent accelerometer values.
+    tile_code: int
+        Most recent camera value.
+    pants: int
+        Current pants bits.
+    received: list[bytes]
+        All commands written to the hub.
+    sent: int
+        Number of notifications sent.
+    """
+    def __init__(self, name: str = "LEGO Mario_sim",
+                 address: Union[str, None] = None,
+                 imu_rate: float = 50.0, tile_rate: float = 0.0,
+                 pants_rate: float = 0.0, connect_delay: float = 0.0,
+                 write_delay: float = 0.0, rssi: int = -60,
+                 readvertise: bool = True,
+                 advertising_interval: float = 0.05,
+                 system_type: int = 0x43) -> None:
+        """
+        Args:
+            name (str, optional): Advertised name.
+                Defaults to "LEGO Mario_sim".
+            address (str, optional): Simulated address. Defaults to a new,
+                unique address.
+            imu_rate (float, optional): Accelerometer samples per second.
+                Samples that changed less than the delta interval of port 0
+                aren't sent. Defaults to 50.0.
+            tile_rate (float, optional): Camera notifications per second.
+                Defaults to 0.0.
+            pants_rate (float, optional): Pants notifications per second.
+                Defaults to 0.0.
+            connect_delay (float, optional): Duration of connecting in
+                seconds. Defaults to 0.0.
+            write_delay (float, optional): Duration of every write in
+                seconds. Defaults to 0.0.
+            rssi (int, optional): Simulated signal strength. Defaults to -60.
+            readvertise (bool, optional): Become discoverable again after
+                disconnecting. Defaults to True.
+            advertising_interval (float, optional): Seconds between two
+                advertisements. Defaults to 0.05.
+            system_type (int, optional): Advertised system type, see
+                lego_mario_data.MARIO_SYSTEM_TYPES. Defaults to 0x43 (Mario).
+        """
+        self.name = name
+        self.address = address or f"00:00:00:00:{next(_address_counter):05X}"
+        self.rssi = rssi
+        self.imu_rate = imu_rate
+        self.tile_rate = tile_rate
+        self.pants_rate = pants_rate
+        self.connect_delay = connect_delay
+        self.write_delay = write_delay
+        self.readvertise = readvertise
+        self.advertising_interval = advertising_interval
+        self.system_type = system_type
+        self.powered = True
+        self.advertising = True
+        self.connected = False
+        self.volume = 100
+        self.port_formats: dict[int, tuple[int, int, bool]] = {}
+        self.acceleration = (0, 0, 0)
+        self._sent_acceleration: Union[tuple[int, int, int], None] = None
+        self.tile_code = 0xffffffff
+        self.pants = 0x21  # Mario
+        self.received: list[bytes] = []
+        self.sent = 0
+        self._client: Union["SimulatedClient", None] = None
+        self._traffic: Union[asyncio.Task, None] = None
+        self._tiles = itertools.cycle(sorted(
+            code for code in HEX_TO_RGB_TILE if isinstance(code, int)))
+        self._pants = itertools.cycle(sorted(HEX_TO_PANTS))
+
+    def advertise(self) -> None:
+        """Makes the hub discoverable (like pressing the bluetooth button)."""
+        if self.powered and not self.connected:
+            self.advertising = True
+
+    def advertisement_data(self) -> AdvertisementData:
+        """What the hub advertises: its name, LEGO manufacturer data with
+        its system type and the LEGO hub service."""
+        return AdvertisementData(
+            local_name=self.name,
+            manufacturer_data={
+                LEGO_MANUFACTURER_ID: bytes(
+                    [0x00, self.system_type, 0x02, 0x00, 0x00])},
+            service_data={},
+            service_uuids=[LEGO_HUB_SERVICE_UUID],
+            tx_power=None,
+            rssi=self.rssi,
+            platform_data=())
+
+    def _attach(self, client: "SimulatedClient") -> None:
+        if not self.advertising:
+            raise BleakError(f"Device with address {self.address} was not "
+                             "found.")
+        self.advertising = False
+        self.connected = True
+        self.port_formats.clear()
+        self._sent_acceleration = None
+        self._client = client
+        self._traffic = asyncio.get_event_loop().create_task(
+            self._generate_traffic())
+
+    def _detach(self) -> None:
+        client = self._client
+        self._client = None
+        self.connected = False
+        if self._traffic is not None:
+            self._traffic.cancel()
+            self._traffic = None
+        if self.powered and self.readvertise:
+            self.advertising = True
+        if client is not None:
+            client._on_hub_disconnect()
+
+    def drop_connection(self) -> None:
+        """Simulates losing the connection, e.g. by going out of range."""
+        if self.connected:
+            self._detach()
+
+    def emit(self, data: Union[bytes, bytearray]) -> None:
+        """Sends a notification to the connected client."""
+        if self._client is not None:
+            self.sent += 1
+            self._client._notify(bytearray(data))
+
+    def handle_write(self, data: bytes) -> None:
+        """Answers a command like a real hub would.
+
+        Args:
+            data (bytes): The command.
+        """
+        self.received.append(data)
+        message_type = data[2]
+        if message_type == 0x41:  # Port Input Format Setup
+            port, mode = data[3], data[4]
+            delta, = struct.unpack_from("<I", data, 5)
+            notifications = bool(data[9])
+            self.port_formats[port] = (mode, delta, notifications)
+            self.emit(bytes([0x0a, 0x00, 0x47, port, mode])
+                      + struct.pack("<I", delta) + bytes([notifications]))
+        elif message_type == 0x21:  # Port Information Request
+            value = self.port_value(data[3])
+            if value is not None:
+                self.emit(value)
+        elif message_type == 0x01:  # Hub Properties
+            hub_property, operation = data[3], data[4]
+            if hub_property == 0x12 and operation == 0x01:  # set volume
+                self.volume = data[5]
+            elif operation == 0x05:  # request update
+                value = self.property_value(hub_property)
+                if value is not None:
+                    self.emit(bytes([5 + len(value), 0x00, 0x01, hub_property,
+                                     0x06]) + value)
+        elif message_type == 0x02:  # Hub Actions
+            if data[3] == 0x02:  # disconnect
+                self.emit(bytes([0x04, 0x00, 0x02, 0x31]))
+                self._detach()
+            elif data[3] == 0x01:  # turn off
+                self.emit(bytes([0x04, 0x00, 0x02, 0x30]))
+                self.powered = False
+                self.advertising = False
+                self._detach()
+
+    def port_value(self, port: int) -> Union[bytes, None]:
+        """Port Value message with the current value of a port.
+
+        Args:
+            port (int): 0 (accelerometer), 1 (camera) or 2 (pants).
+
+        Returns:
+            bytes | None: The message, None for other ports.
+        """
+        if port == 0:
+            return struct.pack(">BBBBbbb", 0x07, 0x00, 0x45, 0x00,
+                               *self.acceleration)
+        if port == 1:
+            return struct.pack(">BBBBI", 0x08, 0x00, 0x45, 0x01,
+                               self.tile_code)
+        if port == 2:
+            return bytes([0x05, 0x00, 0x45, 0x02, self.pants])
+        return None
+
+    def property_value(self, hub_property: int) -> Union[bytes, None]:
+        """Value of a hub property, None for unsupported properties."""
+        if hub_property == 0x05:  # Signal Strength
+            return struct.pack("<b", self.rssi)
+        if hub_property == 0x06:  # Battery Voltage (%)
+            return bytes([100])
+        if hub_property == 0x12:  # Volume
+            return bytes([self.volume])
+        return None
+
+    def _next_value(self, port: int, t: float) -> bytes:
+        """Changes the value of a port and returns its Port Value message."""
+        if port == 0:
+            self.acceleration = (round(40 * math.sin(t * 2.0)),
+                                 round(30 * math.sin(t * 3.1)),
+                                 round(20 * math.cos(t * 1.3)))
+        elif port == 1:
+            self.tile_code = next(self._tiles)
+        elif port == 2:
+            self.pants = next(self._pants)
+        return self.port_value(port)
+
+    def _imu_changed(self, delta: int) -> bool:
+        """Whether the acceleration changed by at least the delta interval
+        since the last notification, like on a real hub."""
+        if self._sent_acceleration is not None and max(
+                abs(new - old) for new, old in
+                zip(self.acceleration, self._sent_acceleration)) < delta:
+            return False
+        self._sent_acceleration = self.acceleration
+        return True
+
+    async def _generate_traffic(self) -> None:
+        """Sends values of all ports with enabled notifications at their
+        configured rates."""
+        start = time.monotonic()
+        next_times = {0: start, 1: start, 2: start}
+        while True:
+            rates = {0: self.imu_rate, 1: self.tile_rate, 2: self.pants_rate}
+            now = time.monotonic()
+            for port, rate in rates.items():
+                mode_setup = self.port_formats.get(port)
+                if not rate or not mode_setup or not mode_setup[2]:
+                    next_times[port] = now
+                    continue
+                if now >= next_times[port]:
+                    value = self._next_value(port, now - start)
+                    if port != 0 or self._imu_changed(mode_setup[1]):
+                        self.emit(value)
+                    # catch up without bursts if the loop was blocked
+                    next_times[port] = max(next_times[port] + 1 / rate, now)
+            active = [next_times[port] for port, rate in rates.items()
+                      if rate and self.port_formats.get(port, (0, 0, 0))[2]]
+            delay = min(active) - time.monotonic() if active else 0.05
+            await asyncio.sleep(max(delay, 0))
+
+
+class SimulatedClient:
+    """Stands in for bleak.BleakClient, connected to a SimulatedHub."""
+    def __init__(self, hub: SimulatedHub,
+                 disconnected_callback: Union[
+                     Callable[["SimulatedClient"], Any], None] = None,
+                 **kwargs: Any) -> None:
+        """
+        Args:
+            hub (SimulatedHub): The hub to connect to.
+            disconnected_callback (function, optional): Called with the
+                client when the connection is lost. Defaults to None.
+        """
+        self.hub = hub
+        self.address = hub.address
+        self._disconnected_callback = disconnected_callback
+        self._notify_callback: Union[Callable[[Any, bytearray], Any], None] = (
+            None)
+        self._connected = False
+
+    @property
+    def is_connected(self) -> bool:
+        return self._connected
+
+    async def connect(self, **kwargs: Any) -> bool:
+        await asyncio.sleep(self.hub.connect_delay)
+        self.hub._attach(self)
+        self._connected = True
+        return True
+
+    async def disconnect(self) -> bool:
+        if self._connected:
+            self.hub._detach()
+        return True
+
+    async def start_notify(self, char_specifier: Any,
+                           callback: Callable[[Any, bytearray], Any],
+                           **kwargs: Any) -> None:
+        self._check_connected()
+        self._notify_callback = callback
+
+    async def stop_notify(self, char_specifier: Any) -> None:
+        self._notify_callback = None
+
+    async def write_gatt_char(self, char_specifier: Any,
+                              data: Union[bytes, bytearray],
+                              response: bool = False) -> None:
+        self._check_connected()
+        if char_specifier != LEGO_CHARACTERISTIC_UUID:
+            raise BleakError(f"Characteristic {char_specifier} was not found!")
+        if self.hub.write_delay:
+            await asyncio.sleep(self.hub.write_delay)
+        self._check_connected()
+        self.hub.handle_write(bytes(data))
+
+    def _check_connected(self) -> None:
+        if not self._connected:
+            raise BleakError("Not connected")
+
+    def _notify(self, data: bytearray) -> None:
+        if self._notify_callback is not None:
+            # bleak calls notification callbacks from the event loop
+            asyncio.get_event_loop().call_soon(
+                self._notify_callback, LEGO_CHARACTERISTIC_UUID, data)
+
+    def _on_hub_disconnect(self) -> None:
+        self._connected = False
+        self._notify_callback = None
+        if self._disconnected_callback is not None:
+            self._disconnected_callback(self)
+
+
+class SimulatedScanner:
+    """Stands in for bleak.BleakScanner. Reports the advertisements of all
+    advertising hubs at their advertising intervals while started."""
+    def __init__(self, hubs: list[SimulatedHub],
+                 detection_callback: Callable[[SimulatedHub,
+                                               AdvertisementData], Any]
+                 ) -> None:
+        self.hubs = hubs
+        self.detection_callback = detection_callback
+        self._task: Union[asyncio.Task, None] = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(
+                self._advertise())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _advertise(self) -> None:
+        start = time.monotonic()
+        # the first advertisement arrives at a point of the interval that
+        # depends on the address, the same in every run (unlike hash())
+        next_times = {hub: start + hub.advertising_interval
+                      * (zlib.crc32(hub.address.encode()) % 100) / 100
+                      for hub in self.hubs}
+        while True:
+            now = time.monotonic()
+            for hub in self.hubs:
+                if now >= next_times[hub]:
+                    next_times[hub] = now + hub.advertising_interval
+                    if hub.advertising:
+                        self.detection_callback(hub, hub.advertisement_data())
+            await asyncio.sleep(max(min(next_times.values(), default=now + 0.1)
+                                    - now, 0))
+
+
+class SimulatedTransport:
+    """Stands in for BleakTransport. Finds and connects to SimulatedHubs.
+
+    Attributes
+    ----------
+    hubs: list[SimulatedHub]
+        All simulated hubs.
+    scan_duration: float
+        Seconds a discovery takes at most.
+    """
+    def __init__(self, *hubs: SimulatedHub, scan_duration: float = 0.1
+                 ) -> None:
+        """
+        Args:
+            *hubs (SimulatedHub): The simulated hubs.
+            scan_duration (float, optional): Seconds a discovery takes at
+                most. Defaults to 0.1.
+        """
+        self.hubs = list(hubs)
+        self.scan_duration = scan_duration
+
+    def scanner(self, detection_callback: Callable[
+                    [SimulatedHub, AdvertisementData], Any]
+                ) -> SimulatedScanner:
+        return SimulatedScanner(self.hubs, detection_callback)
+
+    async def discover(self, timeout: float = 5.0) -> list[SimulatedHub]:
+        await asyncio.sleep(min(timeout, self.scan_duration))
+        return [hub for hub in self.hubs if hub.advertising]
+
+    def client(self, address: str, **kwargs: Any) -> SimulatedClient:
+        for hub in self.hubs:
+            if hub.address == address:
+                return SimulatedClient(hub, **kwargs)
+        raise BleakError(f"Device with address {address} was not found.")
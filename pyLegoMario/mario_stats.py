@@ -0,0 +1,147 @@
+"""
+mario_stats.py
+This file implements LinkStats, the counters behind Mario.stats(). They are
+updated for every notification, so that only stores the time of arrival in
+a ring of the most recent ones: rates and jitter are computed from it when a
+snapshot is taken.
+Copyright (c) 2022 Jamin Kauf
+"""
+import time
+from collections import deque
+from typing import Any, Union
+
+# Number of recent arrival times kept per kind of notification, a power of 2
+_WINDOW = 64
+_WINDOW_MASK = _WINDOW - 1
+
+
+class ArrivalStats:
+    """Arrival times of one kind of notification.
+
+    Attributes
+    ----------
+    count: int
+        Number of notifications.
+    times: list[int]
+        time.monotonic_ns() of the most recent notifications, a ring buffer
+        indexed by the count modulo its length.
+    """
+    __slots__ = ("count", "times")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.times = [0] * _WINDOW
+
+    def add(self, timestamp: int) -> None:
+        count = self.count
+        self.times[count & _WINDOW_MASK] = timestamp
+        self.count = count + 1
+
+    def snapshot(self, now: int) -> dict[str, Union[int, float]]:
+        count = self.count
+        start = count & _WINDOW_MASK
+        if count > _WINDOW:
+            recent = self.times[start:] + self.times[:start]
+        else:
+            recent = self.times[:count]
+        interval = jitter = 0.0
+        if len(recent) > 1:
+            interval = (recent[-1] - recent[0]) / (len(recent) - 1)
+            jitter = sum(abs(later - earlier - interval) for earlier, later
+                         in zip(recent, recent[1:])) / (len(recent) - 1)
+        rate_interval = interval
+        if count > 1 and now - recent[-1] > 2 * interval:
+            rate_interval = now - recent[-1]  # stopped arriving
+        return {"count": count,
+                "rate_hz": (round(1e9 / rate_interval, 2)
+                            if count > 1 and rate_interval else 0.0),
+                "interval_ms": round(interval / 1e6, 3),
+                "jitter_ms": round(jitter / 1e6, 3)}
+
+
+class LinkStats:
+    """Notification, error and connection counters of one Mario.
+
+    Attributes
+    ----------
+    kinds: tuple[str, ...]
+        Names of the kinds of notifications, e.g. "accelerometer". Kinds
+        starting with "unknown" count as not understood.
+    arrivals: list[ArrivalStats]
+        Counters per kind, in the order of .kinds. Updated by
+        Mario._handle_events().
+    undecodable: int
+        Number of notifications whose decoder raised an error.
+    hook_errors: int
+        Number of notifications for which a synchronous hook raised an
+        error. They are decoded and counted in .arrivals anyway.
+    connections: int
+        Number of successful connections.
+    reconnects: int
+        Number of connections after a lost or closed connection.
+    reconnect_durations: deque[float]
+        Seconds from the end of a connection until the next one was set up,
+        of the most recent reconnects.
+    disconnected_at: float | None
+        time.monotonic() of the end of the last connection, None while
+        connected or before the first connection.
+    rssi: int | None
+        Most recent signal strength reported by Mario in dBm.
+    rssi_at: float | None
+        time.monotonic() of the most recent signal strength.
+    """
+    def __init__(self, kinds: tuple[str, ...],
+                 reconnect_samples: int = 16) -> None:
+        self.kinds = kinds
+        self.arrivals = [ArrivalStats() for _ in kinds]
+        self.undecodable = 0
+        self.hook_errors = 0
+        self.connections = 0
+        self.reconnects = 0
+        self.reconnect_durations: deque[float] = deque(
+            maxlen=reconnect_samples)
+        self.disconnected_at: Union[float, None] = None
+        self.rssi: Union[int, None] = None
+        self.rssi_at: Union[float, None] = None
+
+    def connected(self) -> None:
+        self.connections += 1
+        if self.disconnected_at is not None:
+            self.reconnects += 1
+            self.reconnect_durations.append(
+                time.monotonic() - self.disconnected_at)
+            self.disconnected_at = None
+
+    def disconnected(self) -> None:
+        if self.disconnected_at is None:
+            self.disconnected_at = time.monotonic()
+
+    def set_rssi(self, rssi: int) -> None:
+        self.rssi = rssi
+        self.rssi_at = time.monotonic()
+
+    def snapshot(self) -> dict[str, Any]:
+        """The counters as a dict, see Mario.stats()."""
+        now = time.monotonic_ns()
+        notifications = {kind: arrivals.snapshot(now) for kind, arrivals
+                         in zip(self.kinds, self.arrivals) if arrivals.count}
+        unknown = sum(arrivals.count for kind, arrivals
+                      in zip(self.kinds, self.arrivals)
+                      if kind.startswith("unknown"))
+        durations = self.reconnect_durations
+        return {
+            "notifications": notifications,
+            "notifications_total": sum(arrivals.count for arrivals
+                                       in self.arrivals),
+            "unknown": unknown,
+            "undecodable": self.undecodable,
+            "hook_errors": self.hook_errors,
+            "connections": self.connections,
+            "reconnects": self.reconnects,
+            "reconnect_last_s": (round(durations[-1], 3) if durations
+                                 else None),
+            "reconnect_mean_s": (round(sum(durations) / len(durations), 3)
+                                 if durations else None),
+            "rssi": self.rssi,
+            "rssi_age_s": (round(time.monotonic() - self.rssi_at, 1)
+                           if self.rssi_at is not None else None)}
@@ -0,0 +1,270 @@
+"""
+mario_thread.py
+This file implements MarioThread, which runs Marios on an asyncio loop in a
+background thread, and ThreadedMario, the thread-safe synchronous interface
+to such a Mario. Bluetooth and decoding then keep running while the UI thread
+is busy, and the UI doesn't have to pump the asyncio loop (no AsyncClock or
+run() needed).
+
+Example:
+    with MarioThread() as runtime:
+        mario = runtime.create()
+        mario.wait_connected()
+        while game_running:
+            for event in mario.drain_events():
+                ...
+            x, y, z = mario.acceleration or (0, 0, 0)
+Copyright (c) 2022 Jamin Kauf
+"""
+import asyncio
+import inspect
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Awaitable, Callable, Iterable, Union
+try:
+    from .mario import Mario
+    from .mario_events import EVENT_TYPES, MarioEvent
+    from .mario_runtime import shutdown, unregister
+except ImportError:
+    from mario import Mario
+    from mario_events import EVENT_TYPES, MarioEvent
+    from mario_runtime import shutdown, unregister
+
+
+class MarioThread:
+    """An asyncio event loop running in a daemon thread.
+
+    Attributes
+    ----------
+    loop: asyncio.AbstractEventLoop
+        The loop of the thread. Only touch Marios running on it through
+        ThreadedMario or .call().
+    thread: threading.Thread
+        The thread running the loop.
+    marios: list[ThreadedMario]
+        Marios created with .create().
+    """
+    def __init__(self, name: str = "pyLegoMario") -> None:
+        """
+        Args:
+            name (str, optional): Name of the thread.
+                Defaults to "pyLegoMario".
+        """
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name=name,
+                                       daemon=True)
+        self.marios: list[ThreadedMario] = []
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def start(self) -> "MarioThread":
+        """Starts the thread, if it isn't running yet.
+
+        Returns:
+            MarioThread: self
+        """
+        if not self.thread.is_alive():
+            self.thread.start()
+        return self
+
+    def submit(self, coroutine: Awaitable[Any]) -> Future:
+        """Runs a coroutine on the thread's loop without waiting for it.
+
+        Returns:
+            concurrent.futures.Future: Its result.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def call(self, func: Callable[..., Any], *args: Any,
+             timeout: Union[float, None] = None) -> Any:
+        """Calls a function or coroutine function on the thread's loop and
+        waits for its result.
+
+        Args:
+            func (function): Called with *args. If it returns an awaitable,
+                that is awaited as well.
+            timeout (float, optional): Seconds to wait. Defaults to None
+                (wait forever).
+
+        Returns:
+            Any: What func returned.
+        """
+        async def call() -> Any:
+            result = func(*args)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        return self.submit(call()).result(timeout)
+
+    def create(self, cls: type = Mario,
+               event_kinds: Iterable[type[MarioEvent]] = EVENT_TYPES,
+               **kwargs: Any) -> "ThreadedMario":
+        """Creates a Mario on the thread's loop. It starts connecting right
+        away (unless auto_connect=False is passed).
+
+        Args:
+            cls (type, optional): Mario or a subclass, e.g. PygameMario.
+                Defaults to Mario.
+            event_kinds (Iterable[type], optional): Events put into
+                ThreadedMario.events. Defaults to all of them.
+            **kwargs: Passed on to cls.
+
+        Returns:
+            ThreadedMario: Thread-safe interface to the new Mario.
+        """
+        self.start()
+        kwargs.setdefault("do_log", False)
+        event_kinds = tuple(event_kinds)
+
+        def create() -> ThreadedMario:
+            mario = cls(**kwargs)
+            unregister(mario)  # shut down by .stop(), not by serve()
+            threaded = ThreadedMario(self, mario, event_kinds)
+            self.marios.append(threaded)
+            return threaded
+        return self.call(create)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Shuts all Marios of the thread down (see Mario.shutdown()) and
+        stops the thread.
+
+        Args:
+            timeout (float, optional): Seconds the shutdown may take.
+                Defaults to 5.0.
+        """
+        if not self.thread.is_alive():
+            return
+        marios = [threaded.mario for threaded in self.marios]
+        try:
+            self.submit(shutdown(marios, timeout)).result(timeout + 1)
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout)
+            if not self.thread.is_alive():
+                self.loop.close()
+
+    def __enter__(self) -> "MarioThread":
+        return self.start()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
+
+
+class ThreadedMario:
+    """Thread-safe, synchronous interface to a Mario running on a
+    MarioThread.
+
+    The latest values (.acceleration, .pants, ...) are read without locks:
+    Mario replaces them with new immutable objects, so a read always sees a
+    complete value. Events are put into .events, a queue.SimpleQueue that
+    any thread can take them from. Drain it regularly, it is unbounded.
+
+    Attributes
+    ----------
+    mario: Mario
+        The Mario. Only use it from the thread's loop, e.g. with
+        runtime.call().
+    runtime: MarioThread
+        The thread Mario runs on.
+    events: queue.SimpleQueue[MarioEvent]
+        Mario's events, in the order they were received.
+    """
+    def __init__(self, runtime: MarioThread, mario: Mario,
+                 event_kinds: Iterable[type[MarioEvent]] = EVENT_TYPES
+                 ) -> None:
+        self.runtime = runtime
+        self.mario = mario
+        self.events: "queue.SimpleQueue[MarioEvent]" = queue.SimpleQueue()
+        mario.add_event_hooks(self._put_event, kinds=event_kinds)
+
+    def _put_event(self, mario: Mario, event: MarioEvent) -> None:
+        self.events.put(event)
+
+    # latest state, lock-free
+    @property
+    def acceleration(self) -> Union[tuple[int, int, int], None]:
+        return self.mario.acceleration
+
+    @property
+    def pants(self) -> Union[str, None]:
+        return self.mario.pants
+
+    @property
+    def ground(self) -> Union[str, None]:
+        return self.mario.ground
+
+    @property
+    def recent_tile(self) -> Union[str, None]:
+        return self.mario.recent_tile
+
+    @property
+    def is_connected(self) -> bool:
+        return self.mario.is_connected
+
+    def drain_events(self) -> list[MarioEvent]:
+        """Takes all events that are waiting, without blocking.
+
+        Returns:
+            list[MarioEvent]: The events, oldest first.
+        """
+        events = []
+        try:
+            while True:
+                events.append(self.events.get_nowait())
+        except queue.Empty:
+            return events
+
+    # commands
+    def set_volume(self, new_volume: int) -> None:
+        """Sets Mario's volume without waiting, see Mario.set_volume()."""
+        self.runtime.loop.call_soon_threadsafe(self.mario.set_volume,
+                                               new_volume)
+
+    def read_port(self, port: int = 0, timeout: float = 1.0
+                  ) -> Union[MarioEvent, bytes]:
+        """Blocks until the value of a port arrived, see Mario.read_port().
+        """
+        return self.runtime.submit(
+            self.mario.read_port(port, timeout)).result(timeout + 1)
+
+    def port_setup(self, port: int, mode: int, notifications: bool = True,
+                   delta_interval: int = 1,
+                   timeout: Union[float, None] = None) -> bool:
+        """Blocks until the port was set up, see Mario.port_setup()."""
+        return self.runtime.submit(self.mario.port_setup(
+            port, mode, notifications, delta_interval)).result(timeout)
+
+    def wait_connected(self, timeout: Union[float, None] = None) -> bool:
+        """Blocks until Mario is connected.
+
+        Args:
+            timeout (float, optional): Seconds to wait. Defaults to None
+                (wait forever).
+
+        Returns:
+            bool: Whether Mario is connected.
+        """
+        future = self.runtime.submit(self.mario.await_connection())
+        try:
+            future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+        return self.is_connected
+
+    def disconnect(self, timeout: Union[float, None] = None) -> None:
+        """Blocks until disconnected, see Mario.disconnect()."""
+        self.runtime.submit(self.mario.disconnect()).result(timeout)
+
+    def turn_off(self, timeout: Union[float, None] = None) -> None:
+        """Blocks until Mario was turned off, see Mario.turn_off()."""
+        self.runtime.submit(self.mario.turn_off()).result(timeout)
+
+    def stats(self) -> dict[str, Any]:
+        """See Mario.stats(). Taken on the thread's loop."""
+        return self.runtime.call(self.mario.stats)
+
+    def __str__(self) -> str:
+        return str(self.mario)
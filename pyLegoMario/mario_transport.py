@@ -0,0 +1,171 @@
+"""
+mario_transport.py
+This file implements BleakTransport, the default way Mario finds and connects
+to bluetooth devices. Mario only talks to bluetooth through its transport, so
+it can be replaced, e.g. by mario_simulator.SimulatedTransport for testing
+without bluetooth.
+
+A transport needs to provide:
+    scanner(detection_callback) -> object with async start() and stop(),
+        which calls detection_callback(device, advertisement_data) for every
+        advertisement while started (like bleak.BleakScanner)
+    async discover(timeout: float) -> list of devices with .name and .address
+    client(address: str, **kwargs) -> object with the same interface as
+        bleak.BleakClient (address, is_connected, connect, disconnect,
+        start_notify, write_gatt_char)
+
+It also implements DeviceFilter, which recognizes Mario's advertisements,
+and scan(), which stops scanning as soon as enough Marios were seen.
+Copyright (c) 2022 Jamin Kauf
+"""
+import asyncio
+from typing import Any, Callable, Iterable, Union
+from bleak import BleakScanner, BleakClient
+from bleak.backends.device import BLEDevice
+from bleak.backends.scanner import AdvertisementData
+try:
+    from .lego_mario_data import (MARIO_NAME_PREFIXES, LEGO_MANUFACTURER_ID,
+        LEGO_HUB_SERVICE_UUID, MARIO_SYSTEM_TYPES)
+except ImportError:
+    from lego_mario_data import (MARIO_NAME_PREFIXES, LEGO_MANUFACTURER_ID,
+        LEGO_HUB_SERVICE_UUID, MARIO_SYSTEM_TYPES)
+
+
+class BleakTransport:
+    """Real bluetooth, using bleak."""
+    def scanner(self, detection_callback: Callable[
+                    [BLEDevice, AdvertisementData], Any]) -> BleakScanner:
+        """Creates a (not yet started) scanner.
+
+        Args:
+            detection_callback (function): Called with (device,
+                advertisement data) for every advertisement.
+
+        Returns:
+            BleakScanner: The scanner.
+        """
+        return BleakScanner(detection_callback=detection_callback)
+
+    async def discover(self, timeout: float = 5.0) -> list[BLEDevice]:
+        """Scans for bluetooth devices.
+
+        Args:
+            timeout (float, optional): Duration of the scan in seconds.
+                Defaults to 5.0.
+
+        Returns:
+            list[BLEDevice]: All devices found.
+        """
+        return await BleakScanner.discover(timeout=timeout)
+
+    def client(self, address: str, **kwargs: Any) -> BleakClient:
+        """Creates a (not yet connected) client for a device.
+
+        Args:
+            address (str): Bluetooth address of the device.
+            **kwargs: Passed on to BleakClient.
+
+        Returns:
+            BleakClient: The client.
+        """
+        return BleakClient(address, **kwargs)
+
+
+class DeviceFilter:
+    """Decides whether an advertisement belongs to a Mario to connect to.
+
+    By default, a device is a Mario if its name starts with "LEGO Mario",
+    "LEGO Luigi" or "LEGO Peach", or if it sends LEGO manufacturer data of a
+    Mario, Luigi or Peach hub (the name may only arrive with a later scan
+    response). Hubs that send the LEGO hub service UUID but no manufacturer
+    data are accepted as well.
+
+    Attributes
+    ----------
+    names: tuple[str] | None
+        Lowercase name beginnings to accept. If set, only the name counts.
+    addresses: set[str] | None
+        Uppercase addresses to accept. If set, all other devices are
+        ignored.
+    """
+    def __init__(self, names: Union[Iterable[str], None] = None,
+                 addresses: Union[Iterable[str], None] = None) -> None:
+        """
+        Args:
+            names (Iterable[str], optional): Accept only devices whose name
+                starts with one of these (case insensitive), e.g.
+                ["LEGO Mario_j"]. Defaults to None (any Mario).
+            addresses (Iterable[str], optional): Accept only these
+                addresses. Defaults to None (any address).
+        """
+        self.names = (tuple(name.lower() for name in names)
+                      if names is not None else None)
+        self.addresses = ({address.upper() for address in addresses}
+                          if addresses is not None else None)
+
+    def __call__(self, device: Any,
+                 advertisement: Union[AdvertisementData, None] = None
+                 ) -> bool:
+        if (self.addresses is not None
+                and device.address.upper() not in self.addresses):
+            return False
+        name = (advertisement and advertisement.local_name) or device.name
+        if name and name.lower().startswith(self.names or MARIO_NAME_PREFIXES):
+            return True
+        if self.names is not None:
+            return False
+        if advertisement is None:
+            # a KnownDevice that connected before its name was advertised,
+            # only an explicitly accepted address identifies it
+            return device.name is None and self.addresses is not None
+        manufacturer_data = advertisement.manufacturer_data.get(
+            LEGO_MANUFACTURER_ID)
+        if manufacturer_data is not None:
+            return (len(manufacturer_data) > 1
+                    and manufacturer_data[1] in MARIO_SYSTEM_TYPES)
+        return LEGO_HUB_SERVICE_UUID in advertisement.service_uuids
+
+    def __repr__(self) -> str:
+        return f"DeviceFilter(names={self.names}, addresses={self.addresses})"
+
+
+async def scan(transport: Any, device_filter: Callable[[Any, Any], bool],
+               timeout: float = 5.0, count: int = 1,
+               exclude: Iterable[str] = ()) -> list[Any]:
+    """Scans until count matching devices were seen, or until timeout.
+
+    Args:
+        transport (BleakTransport | SimulatedTransport): Used to scan.
+        device_filter (function): Takes (device, advertisement data) and
+            returns whether the device should be returned.
+        timeout (float, optional): Maximum duration of the scan in seconds.
+            Defaults to 5.0.
+        count (int, optional): Number of devices to wait for.
+            Defaults to 1.
+        exclude (Iterable[str], optional): Addresses to ignore, e.g. of
+            devices that are already connected. Defaults to ().
+
+    Returns:
+        list: The matching devices in the order they were seen.
+    """
+    found: dict[str, Any] = {}
+    exclude = set(exclude)
+    enough = asyncio.Event()
+
+    def detected(device: Any, advertisement: Any) -> None:
+        if (device.address in found or device.address in exclude
+                or not device_filter(device, advertisement)):
+            return
+        found[device.address] = device
+        if len(found) >= count:
+            enough.set()
+
+    scanner = transport.scanner(detected)
+    await scanner.start()
+    try:
+        await asyncio.wait_for(enough.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        await scanner.stop()
+    return list(found.values())
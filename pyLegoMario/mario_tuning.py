@@ -0,0 +1,200 @@
+"""
+mario_tuning.py
+This file implements DeltaIntervalTuner, which adjusts the delta interval of
+Mario's accelerometer port while Mario is connected. The delta interval is
+the change of the accelerometer values needed for a new notification: higher
+values mean fewer notifications and less work for the host. The right value
+depends on the machine, so instead of guessing it, the tuner watches the
+notification rate, how late the event loop runs and (optionally) the CPU
+time of the process, and sets the port up again with a larger or smaller
+delta interval to stay within the budget.
+
+Example:
+    tuner = mario.tune_delta_interval(max_rate=30, max_lag=0.02)
+    ...
+    print(tuner.stats())
+Copyright (c) 2022 Jamin Kauf
+"""
+import asyncio
+import time
+from typing import Any, Union
+try:
+    from .mario_events import AccelEvent
+except ImportError:
+    from mario_events import AccelEvent
+
+# Seconds between two measurements of the event loop lag
+_LAG_PROBE_INTERVAL = 0.05
+
+
+class DeltaIntervalTuner:
+    """Keeps Mario's accelerometer notifications within a rate, event loop
+    lag and CPU budget by adjusting the delta interval of port 0.
+
+    Every interval, the delta interval is increased by one if any budget is
+    exceeded. It is decreased by one if everything stayed below half of the
+    budget for two intervals in a row, so it doesn't flip back and forth.
+    The current value is kept in Mario.imu_delta_interval and used again
+    when Mario reconnects.
+
+    Attributes
+    ----------
+    mario: Mario
+        The tuned Mario.
+    max_rate: float
+        Maximum accelerometer notifications per second.
+    max_lag: float
+        Maximum delay in seconds of the event loop, e.g. caused by slow
+        hooks.
+    max_cpu: float | None
+        Maximum CPU time of the process per second (1.0 = one core).
+        None to ignore CPU time.
+    min_delta: int
+        Smallest delta interval the tuner sets.
+    max_delta: int
+        Largest delta interval the tuner sets.
+    interval: float
+        Seconds between two adjustments.
+    rate: float
+        Accelerometer notifications per second during the last interval.
+    lag: float
+        Largest event loop delay in seconds during the last interval.
+    cpu: float
+        CPU time of the process per second during the last interval.
+    changes: int
+        Number of times the delta interval was changed.
+    """
+    def __init__(self, mario: Any, max_rate: float = 50.0,
+                 max_lag: float = 0.02, max_cpu: Union[float, None] = None,
+                 min_delta: int = 1, max_delta: int = 20,
+                 interval: float = 1.0) -> None:
+        """
+        Args:
+            mario (Mario): The Mario to tune.
+            max_rate (float, optional): Maximum accelerometer notifications
+                per second. Defaults to 50.0.
+            max_lag (float, optional): Maximum event loop delay in seconds.
+                Defaults to 0.02.
+            max_cpu (float, optional): Maximum CPU time of the process per
+                second, e.g. 0.5 for half a core. Note that this includes
+                everything else the process does. Defaults to None (ignore
+                CPU time).
+            min_delta (int, optional): Smallest delta interval.
+                Defaults to 1.
+            max_delta (int, optional): Largest delta interval.
+                Defaults to 20.
+            interval (float, optional): Seconds between two adjustments.
+                Defaults to 1.0.
+        """
+        if not 0 <= min_delta <= max_delta:
+            raise ValueError("Expected 0 <= min_delta <= max_delta, got "
+                             f"{min_delta} and {max_delta}")
+        self.mario = mario
+        self.max_rate = max_rate
+        self.max_lag = max_lag
+        self.max_cpu = max_cpu
+        self.min_delta = min_delta
+        self.max_delta = max_delta
+        self.interval = interval
+        self.rate = 0.0
+        self.lag = 0.0
+        self.cpu = 0.0
+        self.changes = 0
+        self._samples = 0
+        self._calm_intervals = 0
+        self._task: Union[asyncio.Task, None] = None
+
+    @property
+    def delta(self) -> int:
+        """The current delta interval of the accelerometer port."""
+        return self.mario.imu_delta_interval
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> asyncio.Task:
+        """Starts tuning in the background.
+
+        Returns:
+            asyncio.Task: The tuning task.
+        """
+        if not self.running:
+            self.mario.add_event_hooks(self._count, kinds=(AccelEvent,))
+            self._task = asyncio.get_event_loop().create_task(self._run())
+        return self._task
+
+    async def stop(self) -> None:
+        """Stops tuning. The delta interval stays as it is."""
+        task, self._task = self._task, None
+        if task is not None:
+            self.mario.remove_hooks(self._count)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def _count(self, mario: Any, event: AccelEvent) -> None:
+        self._samples += 1
+
+    async def _run(self) -> None:
+        while True:
+            await self.mario.await_connection()
+            self._samples = 0
+            lag = 0.0
+            start = time.monotonic()
+            cpu_start = time.process_time()
+            while time.monotonic() - start < self.interval:
+                before = time.monotonic()
+                await asyncio.sleep(_LAG_PROBE_INTERVAL)
+                lag = max(lag, time.monotonic() - before
+                          - _LAG_PROBE_INTERVAL)
+            elapsed = time.monotonic() - start
+            self.rate = self._samples / elapsed
+            self.lag = lag
+            self.cpu = (time.process_time() - cpu_start) / elapsed
+            if self.mario.is_connected:
+                await self._adjust()
+
+    def _over_budget(self, share: float) -> bool:
+        return (self.rate > self.max_rate * share
+                or self.lag > self.max_lag * share
+                or (self.max_cpu is not None
+                    and self.cpu > self.max_cpu * share))
+
+    async def _adjust(self) -> None:
+        delta = self.delta
+        if self._over_budget(1.0):
+            self._calm_intervals = 0
+            delta = min(delta + 1, self.max_delta)
+        elif not self._over_budget(0.5):
+            self._calm_intervals += 1
+            if self._calm_intervals >= 2:
+                self._calm_intervals = 0
+                delta = max(delta - 1, self.min_delta)
+        else:
+            self._calm_intervals = 0
+        delta = min(max(delta, self.min_delta), self.max_delta)
+        if delta == self.delta:
+            return
+        self.mario.log(f"Accelerometer delta interval {self.delta} -> "
+                       f"{delta} ({self.rate:.0f}/s, lag "
+                       f"{self.lag * 1000:.0f} ms, CPU {self.cpu:.0%})",
+                       category="port")
+        # e.g. a PortPoller turned the notifications off, keep it that way
+        notifications = self.mario.port_notifications(0)
+        if await self.mario.port_setup(0, 0, notifications=notifications,
+                                       delta_interval=delta):
+            self.mario.imu_delta_interval = delta
+            self.changes += 1
+
+    def stats(self) -> dict[str, Union[int, float]]:
+        """Measurements of the last interval and the current delta interval.
+
+        Returns:
+            dict: delta, rate, lag_ms, cpu and changes.
+        """
+        return {"delta": self.delta, "rate": round(self.rate, 1),
+                "lag_ms": round(self.lag * 1000, 2),
+                "cpu": round(self.cpu, 3), "changes": self.changes}
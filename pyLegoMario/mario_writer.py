@@ -0,0 +1,185 @@
+"""
+mario_writer.py
+This file implements WriteQueue, which sends all of Mario's commands over one
+connection. Commands are written one at a time, in the order they were
+submitted. A command that is submitted with a key replaces a command with the
+same key that is still waiting, e.g. dragging a volume slider only sends the
+latest volume instead of dozens of outdated ones.
+Copyright (c) 2022 Jamin Kauf
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Hashable, Union
+from bleak import BleakError
+
+
+class _Write:
+    __slots__ = ("data", "key", "response", "future", "submitted")
+
+    def __init__(self, data: bytes, key: Union[Hashable, None],
+                 response: bool, future: asyncio.Future) -> None:
+        self.data = data
+        self.key = key
+        self.response = response
+        self.future = future
+        self.submitted = time.monotonic()
+
+
+class WriteQueue:
+    """Serializes and coalesces the writes to one bluetooth client.
+
+    Attributes
+    ----------
+    client: BleakClient
+        The connected client that is written to.
+    characteristic: str
+        UUID of the characteristic that is written to.
+    submitted: int
+        Number of submitted commands.
+    written: int
+        Number of commands that were written.
+    coalesced: int
+        Number of commands that were replaced by a newer one with the same
+        key before they were written.
+    failed: int
+        Number of writes that raised an error.
+    max_depth: int
+        Largest number of commands that were waiting at the same time.
+    """
+    def __init__(self, client: Any, characteristic: str,
+                 latency_samples: int = 256) -> None:
+        """
+        Args:
+            client (BleakClient): The connected client.
+            characteristic (str): UUID of the characteristic to write to.
+            latency_samples (int, optional): Number of recent write latencies
+                kept for the statistics. Defaults to 256.
+        """
+        self.client = client
+        self.characteristic = characteristic
+        self.submitted = 0
+        self.written = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.max_depth = 0
+        self._queue: deque[_Write] = deque()
+        self._by_key: dict[Hashable, _Write] = {}
+        self._latencies: deque[float] = deque(maxlen=latency_samples)
+        self._task: Union[asyncio.Task, None] = None
+        self._current: Union[_Write, None] = None  # being written
+        self._closed = False
+
+    @property
+    def depth(self) -> int:
+        """Number of commands waiting to be written."""
+        return len(self._queue)
+
+    def submit(self, data: Union[bytes, bytearray],
+               key: Union[Hashable, None] = None,
+               response: bool = False) -> asyncio.Future:
+        """Queues a command without waiting for it to be written.
+
+        Args:
+            data (bytes | bytearray): The command.
+            key (Hashable, optional): Commands with the same key supersede
+                each other: if one is still waiting, it is replaced by this
+                one (at its place in the queue). Defaults to None (never
+                replaced).
+            response (bool, optional): Write with response. Without response
+                is faster, Mario answers commands with notifications anyway.
+                Defaults to False.
+
+        Returns:
+            asyncio.Future: Done when the command was written. Raises the
+                write's error, if any. A replaced command shares the future
+                of the command that replaced it.
+        """
+        if self._closed:
+            raise BleakError("Not connected")
+        self.submitted += 1
+        data = bytes(data)  # the caller may reuse its buffer
+        if key is not None and key in self._by_key:
+            write = self._by_key[key]
+            write.data = data
+            write.response = write.response or response
+            self.coalesced += 1
+            return write.future
+        write = _Write(data, key, response,
+                       asyncio.get_event_loop().create_future())
+        self._queue.append(write)
+        if key is not None:
+            self._by_key[key] = write
+        self.max_depth = max(self.max_depth, len(self._queue))
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self._run())
+        return write.future
+
+    async def write(self, data: Union[bytes, bytearray],
+                    key: Union[Hashable, None] = None,
+                    response: bool = False) -> None:
+        """Queues a command and waits until it was written. See .submit().
+        """
+        await self.submit(data, key, response)
+
+    async def _run(self) -> None:
+        try:
+            while self._queue:
+                write = self._queue.popleft()
+                if write.key is not None:
+                    del self._by_key[write.key]
+                self._current = write
+                try:
+                    await self.client.write_gatt_char(
+                        self.characteristic, write.data,
+                        response=write.response)
+                except Exception as e:
+                    self.failed += 1
+                    if not write.future.done():
+                        write.future.set_exception(e)
+                else:
+                    self.written += 1
+                    self._latencies.append(time.monotonic() - write.submitted)
+                    if not write.future.done():
+                        write.future.set_result(None)
+                finally:
+                    self._current = None
+        finally:
+            if self._task is asyncio.current_task():
+                self._task = None
+
+    def close(self) -> None:
+        """Discards waiting commands and the one being written, their
+        futures raise BleakError."""
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        unfinished = list(self._queue)
+        if self._current is not None:
+            unfinished.insert(0, self._current)
+            self._current = None
+        self._queue.clear()
+        for write in unfinished:
+            if not write.future.done():
+                write.future.set_exception(BleakError("Not connected"))
+                write.future.exception()  # nobody may be waiting for it
+        self._by_key.clear()
+
+    @property
+    def stats(self) -> dict[str, Union[int, float, None]]:
+        """Snapshot of the counters, the current queue depth and the
+        latency (submit to written, in ms) of recent writes."""
+        latencies = sorted(self._latencies)
+        if latencies:
+            p50 = round(latencies[len(latencies) // 2] * 1000, 3)
+            p95 = round(latencies[min(int(len(latencies) * 0.95),
+                                      len(latencies) - 1)] * 1000, 3)
+            maximum = round(latencies[-1] * 1000, 3)
+        else:
+            p50 = p95 = maximum = None
+        return {"submitted": self.submitted, "written": self.written,
+                "coalesced": self.coalesced, "failed": self.failed,
+                "depth": self.depth, "max_depth": self.max_depth,
+                "latency_p50_ms": p50, "latency_p95_ms": p95,
+                "latency_max_ms": maximum}
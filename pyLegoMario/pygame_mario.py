@@ -2,7 +2,10 @@
 pygame_mario.py
 This file implements class PygameMario that subclasses Mario to utilize pygame
 events. It also implements AsyncClock, which behaves like a regular pygame
-clock but also keeps Mario running.
+clock but also keeps Mario running. PygameMario can combine the accelerometer
+samples of a frame into a single event, so a few toys don't flood pygame's
+limited event queue, and InputRouter keeps the latest input of every Mario
+for games with several players.
 Copyright (c) 2022 Jamin Kauf
 """
 import os
@@ -11,32 +14,92 @@ os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "hide"
 import pygame
 from pygame.locals import *
 from pyLegoMario import Mario
+from pyLegoMario.mario_events import AccelEvent
+from pyLegoMario.mario_runtime import start_soon
 import asyncio
+import time
+import weakref
+from typing import Any, Callable, Iterator, Union
+
+# The asyncio loop returns this many seconds before the end of a frame, the
+# pygame clock waits the rest (the loop's timers may be late by ~1 ms)
+_TICK_MARGIN = 0.001
 
 ACC_EVENT = pygame.event.custom_type()
 RGB_EVENT = pygame.event.custom_type()
 PANTS_EVENT = pygame.event.custom_type()
 
+# Ways to combine the accelerometer samples of a frame, see PygameMario
+ACC_MODES = ("latest", "mean", "peak")
+# PygameMarios with acc_mode, AsyncClock posts their events every frame
+_coalescing: "weakref.WeakSet[PygameMario]" = weakref.WeakSet()
+
+
+def _post(mario: Mario, event: pygame.event.Event) -> None:
+    try:
+        pygame.event.post(event)
+    except pygame.error:  # the event queue is full
+        mario.dropped_events += 1
+
 
 def _acceleration_callback(mario: Mario, x: int, y: int, z: int):
     event = pygame.event.Event(ACC_EVENT, value=(x, y, z), sender=mario)
-    pygame.event.post(event)
+    _post(mario, event)
 
 
 def _rgb_callback(mario: Mario, t: str):
     event = pygame.event.Event(RGB_EVENT, value=t, sender=mario)
-    pygame.event.post(event)
+    _post(mario, event)
 
 
 def _pants_callback(mario: Mario, powerup: str):
     event = pygame.event.Event(PANTS_EVENT, value=powerup, sender=mario)
-    pygame.event.post(event)
+    _post(mario, event)
+
+
+class _AccFrame:
+    """Accelerometer samples of one frame."""
+    __slots__ = ("samples", "sum_x", "sum_y", "sum_z", "latest", "peak",
+                 "peak_size", "first", "last")
+
+    def __init__(self, event: AccelEvent) -> None:
+        self.samples = 1
+        self.sum_x = event.x
+        self.sum_y = event.y
+        self.sum_z = event.z
+        self.latest = self.peak = (event.x, event.y, event.z)
+        self.peak_size = event.x ** 2 + event.y ** 2 + event.z ** 2
+        self.first = self.last = event.timestamp
+
+    def add(self, event: AccelEvent) -> None:
+        x, y, z = event.x, event.y, event.z
+        self.samples += 1
+        self.sum_x += x
+        self.sum_y += y
+        self.sum_z += z
+        self.latest = (x, y, z)
+        size = x * x + y * y + z * z
+        if size > self.peak_size:
+            self.peak = self.latest
+            self.peak_size = size
+        self.last = event.timestamp
+
+    def value(self, mode: str) -> tuple[float, float, float]:
+        if mode == "mean":
+            return (self.sum_x / self.samples, self.sum_y / self.samples,
+                    self.sum_z / self.samples)
+        return self.peak if mode == "peak" else self.latest
 
 
 class AsyncClock:
     """Use this instead of pygame.time.Clock when using Lego Mario.
     Your AsyncClock object's tick method must be called once per frame,
     otherwise Mario cannot send events.
+
+    tick() runs the asyncio loop only for the time that is left of the frame:
+    the loop waits for bluetooth data in the time the frame would be delayed
+    anyway, and gets a single pass (without waiting) if the frame is late or
+    no framerate is given.
     """
 
     def __init__(self) -> None:
@@ -47,6 +110,9 @@ class AsyncClock:
         self._tick = self.clock.tick
         self.loop = asyncio.get_event_loop()
         self._tick_busy_loop = self.clock.tick_busy_loop
+        self._last_tick: Union[float, None] = None
+        self._ble_time = 0.0
+        self._sleep_time = 0.0
 
     def tick(self, framerate: int = 0) -> int:
         """Limits framerate by blocking, but uses spare time for async loop.
@@ -58,12 +124,38 @@ class AsyncClock:
         Returns:
             int: The number of milliseconds since last call.
         """
-        self.loop.run_until_complete(asyncio.sleep(0.01))
-        return self._tick(framerate)
+        return self._run_frame(framerate, self._tick)
 
     def tick_busy_loop(self, framerate: int = 0) -> int:
-        self.loop.run_until_complete(asyncio.sleep(0.01))
-        return self._tick_busy_loop(framerate)
+        return self._run_frame(framerate, self._tick_busy_loop)
+
+    def get_ble_time(self) -> float:
+        """Milliseconds the asyncio loop (bluetooth, decoding and hooks) was
+        busy during the last tick. Measured as CPU time of the thread."""
+        return self._ble_time
+
+    def get_sleep_time(self) -> float:
+        """Milliseconds the last tick waited, in the asyncio loop or the
+        pygame clock."""
+        return self._sleep_time
+
+    def _run_frame(self, framerate: int, tick: Callable[[int], int]) -> int:
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        remaining = 0.0
+        if framerate > 0 and self._last_tick is not None:
+            remaining = (self._last_tick + 1 / framerate - start
+                         - _TICK_MARGIN)
+        # sleep(0) is a single pass over ready callbacks and received data
+        self.loop.run_until_complete(asyncio.sleep(max(remaining, 0)))
+        for mario in tuple(_coalescing):
+            mario.post_acceleration()
+        ble_time = time.thread_time() - cpu_start
+        passed = tick(framerate)
+        self._last_tick = end = time.perf_counter()
+        self._ble_time = ble_time * 1000
+        self._sleep_time = max(end - start - ble_time, 0) * 1000
+        return passed
 
 
 class PygameMario(Mario):
@@ -71,9 +163,25 @@ class PygameMario(Mario):
     Lego Mario's events will contain a sender (event.sender), which is the
     Lego Mario object, and a value (event.value), which will either be a
     string (in case of pants or camera data) or a tuple of integers (in
-    case of acceleration data)."""
+    case of acceleration data).
+
+    With acc_mode, there is at most one ACC_EVENT per frame (per call of
+    .post_acceleration(), which AsyncClock.tick() does): event.value
+    combines all samples since the last one, and event.samples,
+    event.first_timestamp and event.last_timestamp (time.monotonic_ns())
+    tell which samples that were.
+
+    Attributes
+    ----------
+    acc_mode: str | None
+        How accelerometer samples are combined, see ACC_MODES. None posts
+        every sample.
+    dropped_events: int
+        Number of events that were lost because pygame's event queue was
+        full.
+    """
 
-    def __init__(self, enable_acc_events: bool = True, enable_rgb_events: bool = True, enable_pants_events: bool = True, **kwargs) -> None:
+    def __init__(self, enable_acc_events: bool = True, enable_rgb_events: bool = True, enable_pants_events: bool = True, acc_mode: Union[str, None] = None, **kwargs) -> None:
         """
         Args:
             enable_acc_events (bool, optional): Whether to send acceleration
@@ -85,16 +193,31 @@ class PygameMario(Mario):
                 Defaults to True.
             enable_pants_events (bool, optional): Whether to send pants events.
                 event.value will be str. Defaults to True.
+            acc_mode (str, optional): Post at most one acceleration event
+                per frame with the "latest" sample, the "mean" of all
+                samples or the "peak" sample (largest acceleration) of the
+                frame. Defaults to None (one event per sample).
         """
+        if acc_mode is not None and acc_mode not in ACC_MODES:
+            raise ValueError(f"Invalid acc_mode, expected one of {ACC_MODES} "
+                             f"or None, got {acc_mode!r}")
+        self.acc_mode = acc_mode
+        self.dropped_events = 0
+        self._acc_frame: Union[_AccFrame, None] = None
         kwargs.setdefault("do_log", False)
         kwargs.setdefault("default_volume", 0)
         super().__init__(**kwargs)
-        ports_task = self._init_ports(enable_acc_events, enable_rgb_events, enable_pants_events)
-        asyncio.get_event_loop().create_task(ports_task)
+        start_soon(lambda: asyncio.get_event_loop().create_task(
+            self._init_ports(enable_acc_events, enable_rgb_events,
+                             enable_pants_events)))
 
     async def _init_ports(self, acc_enabled: bool, rgb_enabled: bool, pants_enabled: bool) -> None:
         await self.await_connection()
-        if acc_enabled:
+        if acc_enabled and self.acc_mode is not None:
+            self.add_event_hooks(self._collect_acceleration,
+                                 kinds=(AccelEvent,))
+            _coalescing.add(self)
+        elif acc_enabled:
             self.add_accelerometer_hooks(_acceleration_callback)
         else:
             await self.port_setup(0, 0, False)
@@ -106,3 +229,143 @@ class PygameMario(Mario):
             self.add_pants_hooks(_pants_callback)
         else:
             await self.port_setup(2, 0, False)
+
+    def _collect_acceleration(self, mario: Mario, event: AccelEvent) -> None:
+        frame = self._acc_frame
+        if frame is None:
+            self._acc_frame = _AccFrame(event)
+        else:
+            frame.add(event)
+
+    def post_acceleration(self) -> None:
+        """Posts the acceleration event of the samples since the last call,
+        if there were any. Only needed with acc_mode and without
+        AsyncClock, call it once per frame then."""
+        frame, self._acc_frame = self._acc_frame, None
+        if frame is None:
+            return
+        _post(self, pygame.event.Event(
+            ACC_EVENT, value=frame.value(self.acc_mode), sender=self,
+            samples=frame.samples, first_timestamp=frame.first,
+            last_timestamp=frame.last))
+
+    def stats(self) -> dict[str, Any]:
+        """See Mario.stats(). Additionally has the key dropped_events, see
+        .dropped_events."""
+        stats = super().stats()
+        stats["dropped_events"] = self.dropped_events
+        return stats
+
+class MarioInput:
+    """Latest input of one Mario, kept up to date by InputRouter.
+
+    Attributes
+    ----------
+    mario: PygameMario
+        The Mario.
+    acceleration: tuple[float, float, float] | None
+        Latest acceleration (event.value of the latest ACC_EVENT), None
+        before the first one.
+    samples: int
+        Number of accelerometer samples since InputRouter.new_frame(), 0 if
+        the acceleration didn't change this frame.
+    tile: str | None
+        Latest tile or ground color (RGB_EVENT).
+    pants: str | None
+        Latest pants (PANTS_EVENT).
+    """
+    __slots__ = ("mario", "acceleration", "samples", "tile", "pants")
+
+    def __init__(self, mario: Mario) -> None:
+        self.mario = mario
+        self.acceleration: Union[tuple[float, float, float], None] = None
+        self.samples = 0
+        self.tile: Union[str, None] = None
+        self.pants: Union[str, None] = None
+
+
+class InputRouter:
+    """Routes the pygame events of PygameMarios to one MarioInput per
+    Mario, so every player reads its own input directly instead of looking
+    through the events of all players. No input is lost if several Marios
+    send events in the same frame.
+
+    Example:
+        router = InputRouter()
+        player_input = router.add(mario)
+        while True:
+            router.new_frame()
+            for event in pygame.event.get():
+                if router.handle(event):
+                    continue
+                ...
+            if player_input.samples:
+                move(player_input.acceleration)
+    """
+    def __init__(self, *marios: Mario) -> None:
+        """
+        Args:
+            *marios (PygameMario): Marios to route. Others are added when
+                their first event is handled.
+        """
+        self._inputs: dict[Mario, MarioInput] = {}
+        for mario in marios:
+            self.add(mario)
+
+    def add(self, mario: Mario) -> MarioInput:
+        """Routes mario's events.
+
+        Returns:
+            MarioInput: The input of mario, updated by .handle().
+        """
+        state = self._inputs.get(mario)
+        if state is None:
+            state = self._inputs[mario] = MarioInput(mario)
+        return state
+
+    def remove(self, mario: Mario) -> None:
+        """Stops routing mario's events."""
+        self._inputs.pop(mario, None)
+
+    def __getitem__(self, mario: Mario) -> MarioInput:
+        return self._inputs[mario]
+
+    def __contains__(self, mario: Mario) -> bool:
+        return mario in self._inputs
+
+    def __iter__(self) -> Iterator[MarioInput]:
+        return iter(self._inputs.values())
+
+    def __len__(self) -> int:
+        return len(self._inputs)
+
+    def new_frame(self) -> None:
+        """Resets MarioInput.samples of every Mario. Call it once per frame,
+        before handling the frame's events."""
+        for state in self._inputs.values():
+            state.samples = 0
+
+    def handle(self, event: pygame.event.Event) -> bool:
+        """Updates the input of the event's Mario.
+
+        Args:
+            event (pygame.event.Event): Any pygame event.
+
+        Returns:
+            bool: Whether it was an event of a Mario (ACC_EVENT, RGB_EVENT
+                or PANTS_EVENT).
+        """
+        kind = event.type
+        if kind != ACC_EVENT and kind != RGB_EVENT and kind != PANTS_EVENT:
+            return False
+        state = self._inputs.get(event.sender)
+        if state is None:
+            state = self.add(event.sender)
+        if kind == ACC_EVENT:
+            state.acceleration = event.value
+            state.samples += getattr(event, "samples", 1)
+        elif kind == RGB_EVENT:
+            state.tile = event.value
+        else:
+            state.pants = event.value
+        return True
@@ -5,7 +5,8 @@ from pygame.locals import *
 from pygame.sprite import AbstractGroup
 from pathlib import Path
 from itertools import cycle
-from pyLegoMario import PygameMario, AsyncClock, ACC_EVENT, RGB_EVENT, PANTS_EVENT
+from pyLegoMario import PygameMario, AsyncClock, InputRouter, RGB_EVENT, PANTS_EVENT
+from pyLegoMario import MarioFleet
 
 pygame.init()
 WIDTH, HEIGHT = 1200, 600
@@ -104,6 +105,8 @@ class Player(pygame.sprite.Sprite):
             unique identifier, starting at 1
         mario: PygameMario
             object representing bluetooth connection to a Lego Mario
+        input: MarioInput
+            latest input of mario, updated by the game's InputRouter
         image: pygame.Surface
             Contains an image representing the player visually.
             Required for interaction with pygame.sprite's functions
@@ -123,10 +126,15 @@ class Player(pygame.sprite.Sprite):
                           (243, 151, 214),
                           (128, 192, 244)))
 
-    def __init__(self, *groups: tuple[AbstractGroup]) -> None:
+    def __init__(self, fleet: MarioFleet, router: InputRouter,
+                 *groups: tuple[AbstractGroup]) -> None:
         super().__init__(*groups)
         self.id = next(Player.player_counter)
-        self.mario = PygameMario()
+        # the fleet connects all players' Marios with one shared scan
+        # one acceleration event per frame, with the latest sample
+        self.mario = fleet.add(PygameMario(auto_connect=False,
+                                           acc_mode="latest"))
+        self.input = router.add(self.mario)
         # player icon
         self.image = pygame.Surface((50,50))
         self.image.fill(next(self.PLAYER_COLORS))
@@ -144,12 +152,11 @@ class Player(pygame.sprite.Sprite):
         self.precise_coords = np.random.random(2) * (max_x, max_y)
         self.rect = self.image.get_rect(topleft = self.precise_coords)
 
-    def update(self, sender=None, mario_acc=None, *args,
-               **kwargs) -> None:
-        """Checks kwargs for a new direction from Mario, calculates step, and
-           calls self.move to move."""
-        if (sender == self.mario) and mario_acc:
-            mario_acc = np.array(mario_acc)
+    def update(self, *args, **kwargs) -> None:
+        """Checks self.input for a new direction from Mario, calculates step,
+           and calls self.move to move."""
+        if self.input.samples:
+            mario_acc = np.array(self.input.acceleration[::2])
             length = np.linalg.norm(mario_acc)
             length = max(length, 0.01)  # prevent zerodivision
             self.direction = mario_acc / length
@@ -230,8 +237,12 @@ class Game:
     def __init__(self, target_surface: pygame.Surface,
                  player_num: int) -> None:
         self.surface = target_surface
-        self.players = [Player() for _ in range(player_num)]
+        self.fleet = MarioFleet()
+        self.router = InputRouter()
+        self.players = [Player(self.fleet, self.router)
+                        for _ in range(player_num)]
         self.clock = AsyncClock()
+        self.fleet.start()
         self.text = None
         self.rect = self.surface.get_rect()
         self.new_game()
@@ -296,11 +307,11 @@ class Game:
                       'frame': self.frame_counter,
                       'players': self.active_player_group}
 
-            # event handling
+            # event handling, Mario's events go to the players' inputs
+            self.router.new_frame()
             for event in pygame.event.get():
-                if event.type == ACC_EVENT:
-                    kwargs['mario_acc'] = event.value[::2]
-                    kwargs['sender'] = event.sender
+                if self.router.handle(event):
+                    continue
                 elif event.type == QUIT:
                     pygame.quit()
                     sys.exit()
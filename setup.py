@@ -15,6 +15,7 @@ setup(
     long_description=long_description,
     packages=find_packages(),
     install_requires=['bleak', 'pathlib', 'asyncio', 'pillow', 'pygame'],
+    extras_require={'numpy': ['numpy']},
     keywords=['lego', 'python', 'super mario', 'lego mario', 'bluetooth'],
     classifiers=[
         'Development Status :: 5 - Production/Stable',